@@ -41,6 +41,11 @@ from rdagent.scenarios.kaggle.kaggle_crawler import download_data
 
 class DataScienceRDLoop(RDLoop):
     skip_loop_error = (CoderError, RunnerError)
+    ordered_steps = ("feedback", "record")
+    # the exp generator proposes on the selection it sets in the shared trace, so one loop proposes at a time
+    step_concurrency = {**RDLoop.step_concurrency, "direct_exp_gen": 1}
+    # the knowledge base is big, so it is rebuilt by `load` instead of being saved
+    checkpoint_excluded_attributes = ("trace.knowledge_base",)
 
     def __init__(self, PROP_SETTING: BasePropSetting):
         logger.log_object(PROP_SETTING.competition, tag="competition")
@@ -84,10 +89,11 @@ class DataScienceRDLoop(RDLoop):
 
         # FIXME: this is for LLM debug webapp, remove this when the debugging is done.
         logger.log_object(exp, tag="debug_exp_gen")
-        return exp
+        # the parent is resolved now: the trace may be changed by the other loops before this loop is recorded
+        return {"exp_gen": exp, "selection": self.trace.resolve_selection()}
 
     def coding(self, prev_out: dict[str, Any]):
-        exp = prev_out["direct_exp_gen"]
+        exp = prev_out["direct_exp_gen"]["exp_gen"]
         for tasks in exp.pending_tasks_list:
             exp.sub_tasks = tasks
             with logger.tag(f"{exp.sub_tasks[0].__class__.__name__}"):
@@ -140,7 +146,7 @@ class DataScienceRDLoop(RDLoop):
 
     def record(self, prev_out: dict[str, Any]):
         # set the DAG parent for the trace
-        self.trace.sync_dag_parent_and_hist()
+        self.trace.sync_dag_parent_and_hist(prev_out["direct_exp_gen"]["selection"])
 
         e = prev_out.get(self.EXCEPTION_KEY, None)
         if e is None:
@@ -148,7 +154,7 @@ class DataScienceRDLoop(RDLoop):
         else:
             self.trace.hist.append(
                 (
-                    prev_out["direct_exp_gen"] if isinstance(e, CoderError) else prev_out["coding"],
+                    prev_out["direct_exp_gen"]["exp_gen"] if isinstance(e, CoderError) else prev_out["coding"],
                     ExperimentFeedback.from_exception(e),
                 )
             )
@@ -249,19 +255,6 @@ class DataScienceRDLoop(RDLoop):
             )
         return session
 
-    def dump(self, path: str | Path) -> None:
-        """
-        Since knowledge_base is big and we don't want to dump it every time
-        So we remove it from the trace before dumping and restore it after.
-        """
-        backup_knowledge_base = None
-        if self.trace.knowledge_base is not None:
-            backup_knowledge_base = self.trace.knowledge_base
-            self.trace.knowledge_base = None
-        super().dump(path)
-        if backup_knowledge_base is not None:
-            self.trace.knowledge_base = backup_knowledge_base
-
 
 def main(
     path=None,
@@ -5,6 +5,7 @@ from pathlib import Path
 from rdagent.components.coder.CoSTEER.config import CoSTEERSettings
 from rdagent.components.coder.CoSTEER.evaluators import CoSTEERMultiFeedback
 from rdagent.components.coder.CoSTEER.evolvable_subjects import EvolvingItem
+from rdagent.components.coder.CoSTEER.evolving_agent import PipelinedRAGEvoAgent
 from rdagent.components.coder.CoSTEER.knowledge_management import (
     CoSTEERKnowledgeBaseV1,
     CoSTEERKnowledgeBaseV2,
@@ -16,6 +17,7 @@ from rdagent.core.evaluation import Evaluator, Feedback
 from rdagent.core.evolving_agent import EvolvingStrategy, RAGEvoAgent
 from rdagent.core.exception import CoderError
 from rdagent.core.experiment import Experiment
+from rdagent.core.knowledge_base import KnowledgeBase
 from rdagent.log import rdagent_logger as logger
 
 
@@ -37,6 +39,8 @@ class CoSTEER(Developer[Experiment]):
         super().__init__(*args, **kwargs)
         self.max_loop = settings.max_loop if max_loop is None else max_loop
         self.max_seconds = settings.max_seconds
+        self.pipelined_evolving = settings.pipelined_evolving
+        self.pipelined_evolving_workers = settings.pipelined_evolving_workers
         self.knowledge_base_path = (
             Path(settings.knowledge_base_path) if settings.knowledge_base_path is not None else None
         )
@@ -65,7 +69,15 @@ class CoSTEER(Developer[Experiment]):
         )
 
     def load_or_init_knowledge_base(self, former_knowledge_base_path: Path = None, component_init_list: list = []):
-        if former_knowledge_base_path is not None and former_knowledge_base_path.exists():
+        if (
+            former_knowledge_base_path is not None
+            and former_knowledge_base_path.exists()
+            and KnowledgeBase.is_segmented_path(former_knowledge_base_path)
+        ):
+            knowledge_base = (
+                CoSTEERKnowledgeBaseV2 if self.evolving_version == 2 else CoSTEERKnowledgeBaseV1
+            ).from_segments(former_knowledge_base_path)
+        elif former_knowledge_base_path is not None and former_knowledge_base_path.exists():
             knowledge_base = pickle.load(open(former_knowledge_base_path, "rb"))
             if self.evolving_version == 1 and not isinstance(knowledge_base, CoSTEERKnowledgeBaseV1):
                 raise ValueError("The former knowledge base is not compatible with the current version")
@@ -89,31 +101,47 @@ class CoSTEER(Developer[Experiment]):
         # init intermediate items
         evo_exp = EvolvingItem.from_experiment(exp)
 
-        self.evolve_agent = RAGEvoAgent(
+        agent_kwargs = (
+            {"max_workers": self.pipelined_evolving_workers, "max_seconds": self.max_seconds}
+            if self.pipelined_evolving
+            else {}
+        )
+        # a local agent: the loops running `coding` at the same time must not share the evolving trace
+        evolve_agent = (PipelinedRAGEvoAgent if self.pipelined_evolving else RAGEvoAgent)(
             max_loop=self.max_loop,
             evolving_strategy=self.evolving_strategy,
             rag=self.rag,
             with_knowledge=self.with_knowledge,
             with_feedback=self.with_feedback,
             knowledge_self_gen=self.knowledge_self_gen,
+            **agent_kwargs,
         )
 
-        start_datetime = datetime.now()
-        for evo_exp in self.evolve_agent.multistep_evolve(evo_exp, self.evaluator):
-            assert isinstance(evo_exp, Experiment)  # multiple inheritance
-            logger.log_object(evo_exp.sub_workspace_list, tag="evolving code")
-            for sw in evo_exp.sub_workspace_list:
-                logger.info(f"evolving code workspace: {sw}")
-            if (datetime.now() - start_datetime).seconds > self.max_seconds:
-                break
-
-        if self.with_feedback and self.filter_final_evo:
-            evo_exp = self._exp_postprocess_by_feedback(evo_exp, self.evolve_agent.evolving_trace[-1].feedback)
+        try:
+            start_datetime = datetime.now()
+            for evo_exp in evolve_agent.multistep_evolve(evo_exp, self.evaluator):
+                assert isinstance(evo_exp, Experiment)  # multiple inheritance
+                logger.log_object(evo_exp.sub_workspace_list, tag="evolving code")
+                for sw in evo_exp.sub_workspace_list:
+                    logger.info(f"evolving code workspace: {sw}")
+                if (datetime.now() - start_datetime).seconds > self.max_seconds:
+                    break
+
+            if self.with_feedback and self.filter_final_evo:
+                evo_exp = self._exp_postprocess_by_feedback(evo_exp, evolve_agent.evolving_trace[-1].feedback)
+        finally:
+            # the last feedback is propagated to the next developer (e.g. the runner), even if the coding failed
+            if evolve_agent.evolving_trace:
+                exp.prop_dev_feedback = evolve_agent.evolving_trace[-1].feedback
 
         # save new knowledge base
         if self.new_knowledge_base_path is not None:
-            with self.new_knowledge_base_path.open("wb") as f:
-                pickle.dump(self.knowledge_base, f)
+            if KnowledgeBase.is_segmented_path(self.new_knowledge_base_path):
+                # only the knowledge added since the last develop is appended
+                self.knowledge_base.dump_segments(self.new_knowledge_base_path)
+            else:
+                with self.new_knowledge_base_path.open("wb") as f:
+                    pickle.dump(self.knowledge_base, f)
             logger.info(f"New knowledge base saved to {self.new_knowledge_base_path}")
         exp.sub_workspace_list = evo_exp.sub_workspace_list
         exp.experiment_workspace = evo_exp.experiment_workspace
@@ -28,12 +28,24 @@ class CoSTEERSettings(ExtendedBaseSettings):
     v2_knowledge_sampler: float = 1.0
 
     knowledge_base_path: Optional[str] = None
-    """Path to the knowledge base"""
+    """Path to the knowledge base (a pickle file, or a directory ending with `.segments` in the segmented format)"""
 
     new_knowledge_base_path: Optional[str] = None
-    """Path to the new knowledge base"""
+    """
+    Path to the new knowledge base; the whole knowledge base is pickled into it after every develop. A path ending with
+    `.segments` opts in to the segmented format, a directory which only appends the knowledge added since the last save.
+    """
 
     max_seconds: int = 10**6
 
+    pipelined_evolving: bool = False
+    """
+    Evolve the sub-tasks independently (implement -> evaluate -> re-implement) instead of in lock-step loops,
+    so a slow sub-task does not block the others. Only for the coders whose sub-tasks own their workspaces.
+    """
+
+    pipelined_evolving_workers: int = 4
+    """The number of sub-tasks implemented or evaluated at the same time in the pipelined evolving"""
+
 
 CoSTEER_SETTINGS = CoSTEERSettings()
@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from copy import deepcopy
+from copy import copy
 from dataclasses import dataclass
 from typing import TYPE_CHECKING, List
 
@@ -244,7 +244,7 @@ class CoSTEERMultiEvaluator(CoSTEEREvaluator):
         # merge the feedbacks
         merged_task_feedback = []
         for task_id, fb in enumerate(task_li_feedback_li[0]):
-            fb = deepcopy(fb)  # deep copy to make it more robust
+            fb = copy(fb)  # the merged attributes are assigned to a copy, the original feedback is kept
 
             fb.final_decision = all(
                 task_li_feedback[task_id].final_decision for task_li_feedback in task_li_feedback_li
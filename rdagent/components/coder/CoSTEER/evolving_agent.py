@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import contextvars
+import copy
+import threading
+import time
+from collections.abc import Generator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any
+
+from tqdm import tqdm
+
+from rdagent.components.coder.CoSTEER.evaluators import (
+    CoSTEERMultiFeedback,
+    CoSTEERSingleFeedback,
+)
+from rdagent.components.coder.CoSTEER.evolvable_subjects import EvolvingItem
+from rdagent.components.coder.CoSTEER.evolving_strategy import (
+    MultiProcessEvolvingStrategy,
+)
+from rdagent.core.evaluation import Feedback
+from rdagent.core.evolving_agent import RAGEvaluator, RAGEvoAgent
+from rdagent.core.evolving_framework import EvoStep, QueriedKnowledge
+from rdagent.core.profiling import PROFILER
+from rdagent.core.utils import LLM_CACHE_SEED_GEN
+from rdagent.log import rdagent_logger as logger
+
+
+class PipelinedRAGEvoAgent(RAGEvoAgent):
+    """
+    The sub-tasks are evolved independently instead of in lock-step rounds:
+    every sub-task goes through query -> implement -> evaluate -> (re-)implement on its own, so a slow sub-task
+    does not block the others, and the sub-tasks that pass stop consuming resources.
+    The knowledge is generated in a background thread from the step of every sub-task as soon as it is evaluated.
+
+    NOTE:
+    - The stages run in threads (they are LLM-bound or run the code in subprocesses); the sub-tasks should own their
+      workspaces, like the factors and the models do.
+    - `evolving_trace` holds a snapshot of the whole evolving item each time all the unfinished sub-tasks have been
+      evaluated once more; they are also yielded to the caller. The sub-tasks without feedback have `None` in it.
+      Every sub-task is copied into the snapshots as it was when it was evaluated last, so the snapshots are not
+      changed by the rounds still running.
+    - The knowledge is generated while the other sub-tasks query it, so the knowledge bases must allow it (the graphs
+      & the task similarity indexes of CoSTEER lock their own updates).
+    - No round is started after `max_seconds`; the running rounds are finished and the last snapshot is yielded.
+    """
+
+    def __init__(self, *args: Any, max_workers: int = 4, max_seconds: float | None = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_workers = max_workers
+        self.max_seconds = max_seconds
+        self.knowledge_trace: list[EvoStep] = []
+        """the single sub-task steps used to generate the knowledge"""
+        self._query_lock = threading.Lock()  # the queries update the caches of the knowledge base
+        self._generate_lock = threading.Lock()
+        self._assign_lock = threading.Lock()
+
+    @staticmethod
+    def _sub_evo(evo: EvolvingItem, index: int) -> EvolvingItem:
+        """A view of `evo` with the `index`-th sub-task only; it shares the task & the workspace with `evo`"""
+        sub_evo = copy.copy(evo)
+        sub_evo.sub_tasks = [evo.sub_tasks[index]]
+        sub_evo.sub_workspace_list = [evo.sub_workspace_list[index]]
+        if evo.sub_gt_implementations is not None:
+            sub_evo.sub_gt_implementations = [evo.sub_gt_implementations[index]]
+        return sub_evo
+
+    def _generate_knowledge(self) -> None:
+        with self._generate_lock, PROFILER.span("generate_knowledge", cat="costeer"):
+            self.rag.generate_knowledge(self.knowledge_trace)
+
+    def _evolve_one_task(
+        self,
+        evo: EvolvingItem,
+        index: int,
+        eva: RAGEvaluator,
+        prev_task_feedback: CoSTEERSingleFeedback | None,
+        seed: int,
+        knowledge_future: Future | None,
+    ) -> EvoStep | None:
+        """
+        One round of the `index`-th sub-task; it returns None if the sub-task is given up.
+        It mirrors `MultiProcessEvolvingStrategy.evolve` and `RAGEvoAgent.multistep_evolve` for a single sub-task.
+        """
+        LLM_CACHE_SEED_GEN.set_seed(seed, scoped=True)
+        if knowledge_future is not None:
+            knowledge_future.result()  # the knowledge of the last round of the sub-task is used by the query
+
+        queried_knowledge: QueriedKnowledge | None = None
+        if self.with_knowledge and self.rag is not None:
+            with self._query_lock, PROFILER.span("query_knowledge", cat="costeer"):
+                queried_knowledge = self.rag.query(self._sub_evo(evo, index), self.knowledge_trace)
+
+        target_task = evo.sub_tasks[index]
+        target_task_desc = target_task.get_task_information()
+        success_task_to_knowledge_dict = getattr(queried_knowledge, "success_task_to_knowledge_dict", {})
+        if target_task_desc in success_task_to_knowledge_dict:
+            evo.sub_workspace_list[index] = success_task_to_knowledge_dict[target_task_desc].implementation
+        elif target_task_desc in getattr(queried_knowledge, "failed_task_info_set", set()):
+            return None
+        else:
+            strategy = self.evolving_strategy
+            assert isinstance(strategy, MultiProcessEvolvingStrategy)
+            with PROFILER.span("evolve", cat="costeer"):
+                code = strategy.implement_one_task(
+                    target_task, queried_knowledge, evo.experiment_workspace, prev_task_feedback
+                )
+            code_list: list[Any] = [None] * len(evo.sub_tasks)
+            code_list[index] = code
+            with self._assign_lock:
+                strategy.assign_code_list_to_evo(code_list, evo)
+
+        sub_evo = self._sub_evo(evo, index)
+        es = EvoStep(sub_evo, queried_knowledge)
+        with PROFILER.span("evaluate", cat="costeer"):
+            es.feedback = eva.evaluate(sub_evo, queried_knowledge=queried_knowledge)
+        return es
+
+    def multistep_evolve(
+        self,
+        evo: EvolvingItem,
+        eva: RAGEvaluator | Feedback,
+    ) -> Generator[EvolvingItem, None, None]:
+        if (
+            not self.with_feedback
+            or isinstance(eva, Feedback)
+            or not isinstance(self.evolving_strategy, MultiProcessEvolvingStrategy)
+        ):
+            # there is nothing to pipeline without the feedback of every sub-task
+            yield from super().multistep_evolve(evo, eva)
+            return
+
+        n_tasks = len(evo.sub_tasks)
+        rounds = [0] * n_tasks
+        feedback: list[CoSTEERSingleFeedback | None] = [None] * n_tasks
+        finished: set[int] = set()
+        # the seeds are bound to (sub-task, round), so the LLM cache is hit whatever the completion order is
+        base_seed = LLM_CACHE_SEED_GEN.get_next_seed()
+        deadline = None if self.max_seconds is None else time.monotonic() + self.max_seconds
+        # the workspace of every sub-task when it was evaluated last (a sub-task is not running when it is copied)
+        workspaces = [copy.deepcopy(workspace) for workspace in evo.sub_workspace_list]
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, n_tasks)))
+        knowledge_executor = ThreadPoolExecutor(max_workers=1)
+        futures: dict[Future, int] = {}
+
+        def submit(index: int, knowledge_future: Future | None = None) -> None:
+            rounds[index] += 1
+            futures[
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self._evolve_one_task,
+                    evo,
+                    index,
+                    eva,
+                    feedback[index],
+                    hash((base_seed, index, rounds[index])),
+                    knowledge_future,
+                )
+            ] = index
+
+        generation = 0
+        progress = tqdm(total=n_tasks, desc="Implementing")
+        try:
+            for index in range(n_tasks):
+                submit(index)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures.pop(future)
+                    es = future.result()
+                    with self._assign_lock:
+                        workspaces[index] = copy.deepcopy(evo.sub_workspace_list[index])
+                    if es is None:
+                        finished.add(index)
+                        progress.update()
+                        continue
+                    assert isinstance(es.feedback, CoSTEERMultiFeedback)
+                    feedback[index] = es.feedback[0]
+                    self.knowledge_trace.append(es)
+                    knowledge_future = None
+                    if self.knowledge_self_gen and self.rag is not None and hasattr(self.rag, "generate_knowledge"):
+                        knowledge_future = knowledge_executor.submit(self._generate_knowledge)
+                    if (
+                        (feedback[index] is not None and feedback[index].final_decision)
+                        or rounds[index] >= self.max_loop
+                        or (deadline is not None and time.monotonic() > deadline)
+                    ):
+                        finished.add(index)
+                        progress.update()
+                    else:
+                        submit(index, knowledge_future)
+
+                # a snapshot is taken when all the unfinished sub-tasks have been evaluated once more
+                current = min((rounds[i] - 1 for i in range(n_tasks) if i not in finished), default=self.max_loop)
+                if current > generation or not futures:
+                    generation = current
+                    snapshot = copy.copy(evo)
+                    snapshot.sub_workspace_list = list(workspaces)
+                    with logger.tag(f"evo_loop_{len(self.evolving_trace)}"):
+                        es = EvoStep(snapshot, None, CoSTEERMultiFeedback(list(feedback)))
+                        logger.log_object(es.feedback, tag="evolving feedback")
+                        self.evolving_trace.append(es)
+                        yield snapshot
+            if deadline is not None and time.monotonic() > deadline:
+                logger.info(f"The evolving is stopped after {self.max_seconds} seconds.")
+            else:
+                logger.info("All tasks in evolving subject have been completed.")
+        finally:
+            # the running rounds are finished (but no new round is started) if the caller stops early
+            executor.shutdown(wait=True, cancel_futures=True)
+            knowledge_executor.shutdown(wait=True)
+            progress.close()
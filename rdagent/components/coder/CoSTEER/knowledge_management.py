@@ -4,10 +4,13 @@ import copy
 import json
 import random
 import re
-from itertools import combinations, chain
+import threading
+from collections import OrderedDict
+from itertools import chain
 from pathlib import Path
-from typing import List, Union
+from typing import Any, List, Union
 
+import numpy as np
 from jinja2 import Environment, StrictUndefined
 
 from rdagent.components.coder.CoSTEER.config import CoSTEERSettings
@@ -16,6 +19,7 @@ from rdagent.components.knowledge_management.graph import (
     UndirectedGraph,
     UndirectedNode,
 )
+from rdagent.components.knowledge_management.vector_base import VectorIndex
 from rdagent.core.evolving_agent import Feedback
 from rdagent.core.evolving_framework import (
     EvolvableSubjects,
@@ -465,7 +469,17 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
         v2_query_component_limit: int = 5,
         knowledge_sampler: float = 1.0,
     ) -> CoSTEERQueriedKnowledge | None:
-        
+        # rank the successful tasks for all the target tasks in one batch
+        self.knowledgebase.task_similarity.add_tasks(list(self.knowledgebase.success_task_to_knowledge_dict))
+        similar_tasks = self.knowledgebase.task_similarity.rank(
+            [
+                task_information
+                for task_information in (target_task.get_task_information() for target_task in evo.sub_tasks)
+                if task_information not in self.knowledgebase.success_task_to_knowledge_dict
+                and task_information not in queried_knowledge_v2.failed_task_info_set
+            ]
+        )
+
         for target_task in evo.sub_tasks:
             target_task_information = target_task.get_task_information()
             if (
@@ -530,20 +544,10 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
                             ].append(target_knowledge)
 
                 # finally add embedding related knowledge
-                knowledge_base_success_task_list = list(self.knowledgebase.success_task_to_knowledge_dict)
-
-                similarity = calculate_embedding_distance_between_str_list(
-                    [target_task_information],
-                    knowledge_base_success_task_list,
-                )[0]
-                similar_indexes = sorted(
-                    range(len(similarity)),
-                    key=lambda i: similarity[i],
-                    reverse=True,
-                )
                 embedding_similar_successful_knowledge = [
-                    self.knowledgebase.success_task_to_knowledge_dict[knowledge_base_success_task_list[index]]
-                    for index in similar_indexes
+                    self.knowledgebase.success_task_to_knowledge_dict[task]
+                    for task in similar_tasks[target_task_information]
+                    if task in self.knowledgebase.success_task_to_knowledge_dict
                 ]
                 for knowledge in embedding_similar_successful_knowledge:
                     if ( 
@@ -723,6 +727,87 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
         return queried_knowledge_v2
 
 
+class TaskSimilarityIndex:
+    """
+    The normalized embeddings of the successful task descriptions, kept with the knowledge base so every task is
+    embedded only once. The target tasks of a query are ranked against all the successful tasks in one matmul.
+    """
+
+    # the tasks may be added while the others are ranked in another thread; the lock is shared by the indexes, so it is
+    # not a part of their pickled state
+    _lock = threading.Lock()
+
+    max_query_embeddings: int = 1024
+    """The embeddings of the latest queried (not indexed) tasks kept in memory; they are not pickled"""
+
+    def __init__(self) -> None:
+        self.tasks: list[str] = []
+        self.index = VectorIndex()
+        self._embeddings: dict[str, np.ndarray] = {}  # the embeddings of the indexed tasks
+        self._query_embeddings: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the index only duplicates the embeddings of the indexed tasks, so it is rebuilt after loading
+        return {k: v for k, v in self.__dict__.items() if k not in ("index", "_query_embeddings")}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        # the indexes dumped by the older versions kept the embeddings of the queried tasks too
+        self._embeddings = {task: self._embeddings[task] for task in self.tasks}
+        self._query_embeddings = OrderedDict()
+        self.index = VectorIndex()
+        if self.tasks:
+            self.index.add(np.stack([self._embeddings[task] for task in self.tasks]), [None] * len(self.tasks))
+
+    def _embed(self, tasks: list[str]) -> np.ndarray:
+        embeddings: dict[str, np.ndarray] = {}
+        with self._lock:
+            for task in dict.fromkeys(tasks):
+                if task in self._embeddings:
+                    embeddings[task] = self._embeddings[task]
+                elif task in self._query_embeddings:
+                    self._query_embeddings.move_to_end(task)
+                    embeddings[task] = self._query_embeddings[task]
+        missing = [task for task in dict.fromkeys(tasks) if task not in embeddings]
+        if missing:
+            # outside the lock, so the ranking is not blocked by the requests
+            for task, embedding in zip(missing, APIBackend().create_embedding(input_content=missing)):
+                embeddings[task] = np.asarray(embedding, dtype=np.float32)
+            with self._lock:
+                self._query_embeddings.update((task, embeddings[task]) for task in missing)
+                while len(self._query_embeddings) > max(0, self.max_query_embeddings):
+                    self._query_embeddings.popitem(last=False)
+        return np.stack([embeddings[task] for task in tasks])
+
+    def add_tasks(self, tasks: list[str]) -> None:
+        indexed = set(self.tasks)
+        new_tasks = [task for task in dict.fromkeys(tasks) if task not in indexed]
+        if new_tasks:
+            embeddings = dict(zip(new_tasks, self._embed(new_tasks)))
+            with self._lock:
+                indexed = set(self.tasks)
+                new_tasks = [task for task in new_tasks if task not in indexed]
+                if new_tasks:
+                    self.index.add(np.stack([embeddings[task] for task in new_tasks]), [None] * len(new_tasks))
+                    self.tasks.extend(new_tasks)
+                    for task in new_tasks:
+                        self._embeddings[task] = embeddings[task]
+                        self._query_embeddings.pop(task, None)
+
+    def rank(self, target_tasks: list[str]) -> dict[str, list[str]]:
+        """The indexed tasks sorted by the similarity to each target task (the most similar first)"""
+        if not target_tasks:
+            return {}
+        if not self.tasks:
+            return {task: [] for task in target_tasks}
+        embeddings = self._embed(target_tasks)
+        with self._lock:
+            tasks = list(self.tasks)
+            similarities = self.index.similarities(embeddings)
+        orders = np.argsort(-similarities, axis=1, kind="stable")
+        return {task: [tasks[i] for i in order] for task, order in zip(target_tasks, orders.tolist())}
+
+
 class CoSTEERKnowledgeBaseV2(EvolvingKnowledgeBase):
     def __init__(self, init_component_list=None, path: str | Path = None) -> None:
         """Load knowledge, offer brief information of knowledge and common handle interfaces"""
@@ -751,6 +836,31 @@ class CoSTEERKnowledgeBaseV2(EvolvingKnowledgeBase):
         # store the task description to component nodes
         self.task_to_component_nodes = {}
 
+        self._task_similarity = TaskSimilarityIndex()
+
+    @property
+    def task_similarity(self) -> TaskSimilarityIndex:
+        # the knowledge bases dumped by the older versions have no similarity index; it is built on the next query
+        if "_task_similarity" not in self.__dict__:
+            self._task_similarity = TaskSimilarityIndex()
+        return self._task_similarity
+
+    segment_excluded_attributes = ("graph",)
+
+    def dump_segments(self, path: Path) -> None:
+        self.graph.dump_segments(path / "graph")
+        super().dump_segments(path)
+
+    def load_segments(self, path: Path) -> None:
+        self.graph = UndirectedGraph.from_segments(path / "graph")
+        super().load_segments(path)
+
+    def persistent_id(self, obj: Any) -> Any:
+        return self.graph.persistent_id(obj)
+
+    def persistent_load(self, pid: Any) -> Any:
+        return self.graph.persistent_load(pid)
+
     def get_all_nodes_by_label(self, label: str) -> list[UndirectedNode]:
         return self.graph.get_all_nodes_by_label(label)
 
@@ -765,11 +875,12 @@ class CoSTEERKnowledgeBaseV2(EvolvingKnowledgeBase):
             if success_task_info in self.working_trace_error_analysis
             else []
         )
+        self.task_similarity.add_tasks([success_task_info])
         task_des_node = UndirectedNode(content=success_task_info, label="task_description")
-        self.graph.add_nodes(
-            node=task_des_node,
-            neighbors=self.task_to_component_nodes[success_task_info],
-        )  # 1st version, we assume that all component nodes are given
+        # all the nodes of the trace are added to the graph in one batch
+        node_neighbors = [
+            (task_des_node, self.task_to_component_nodes[success_task_info])
+        ]  # 1st version, we assume that all component nodes are given
         for index, trace_unit in enumerate(success_task_trace):  # every unit: single_knowledge
             neighbor_nodes = [task_des_node]
             if index != len(success_task_trace) - 1:
@@ -790,14 +901,15 @@ class CoSTEERKnowledgeBaseV2(EvolvingKnowledgeBase):
                             success_task_error_analysis_record[index][node_index] = queried_node
                 valid_error_nodes = [node for node in success_task_error_analysis_record[index] if isinstance(node, UndirectedNode)]
                 neighbor_nodes.extend(valid_error_nodes)
-                self.graph.add_nodes(node=trace_node, neighbors=neighbor_nodes)
+                node_neighbors.append((trace_node, neighbor_nodes))
             else:
                 success_node = UndirectedNode(
                     content=trace_unit.get_implementation_and_feedback_str(),
                     label="task_success_implement",
                 )
-                self.graph.add_nodes(node=success_node, neighbors=neighbor_nodes)
+                node_neighbors.append((success_node, neighbor_nodes))
                 self.node_to_implementation_knowledge_dict[success_node.id] = trace_unit
+        self.graph.add_nodes_bulk(node_neighbors)
 
     def query(self):
         pass
@@ -874,25 +986,9 @@ class CoSTEERKnowledgeBaseV2(EvolvingKnowledgeBase):
 
         node_count = len(nodes)
         assert node_count >= 2, "nodes length must >=2"
-        intersection_node_list = []
+        intersection_node_list = self.graph.query_by_intersection(
+            nodes, steps=steps, constraint_labels=constraint_labels
+        )
         if output_intersection_origin:
-            origin_list = []
-        for k in range(node_count, 1, -1):
-            possible_combinations = combinations(nodes, k)
-            for possible_combination in possible_combinations:
-                node_list = list(possible_combination)
-                intersection_node_list.extend(
-                    self.graph.get_nodes_intersection(node_list, steps=steps, constraint_labels=constraint_labels),
-                )
-                if output_intersection_origin:
-                    for _ in range(len(intersection_node_list)):
-                        origin_list.append(node_list)
-        intersection_node_list_sort_by_freq = []
-        for index, node in enumerate(intersection_node_list):
-            if node not in intersection_node_list_sort_by_freq:
-                if output_intersection_origin:
-                    intersection_node_list_sort_by_freq.append([origin_list[index], node])
-                else:
-                    intersection_node_list_sort_by_freq.append(node)
-
-        return intersection_node_list_sort_by_freq
+            return [[origin, node] for origin, node in intersection_node_list]
+        return [node for _, node in intersection_node_list]
@@ -21,9 +21,17 @@ class DSCoderCoSTEERSettings(CoSTEERSettings):
 
     max_seconds: int = 2400
     env_type: str = "docker"
+
+    parallel_eval_checks: int = 2
+    """
+    The number of the checks of a component evaluation (e.g. the unit test & the whole workflow) run at the same time,
+    each in its own copy of the workspace; 1 runs them one by one and skips the checks whose required check fails
+    """
     # TODO: extract a function for env and conf.
 
 
+DS_CODER_COSTEER_SETTINGS = DSCoderCoSTEERSettings()
+
 
 def get_ds_env(
     conf_type: Literal["kaggle", "mlebench"] = "kaggle",
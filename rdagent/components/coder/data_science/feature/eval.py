@@ -8,6 +8,7 @@ from rdagent.components.coder.CoSTEER.evaluators import (
     CoSTEERSingleFeedback,
 )
 from rdagent.components.coder.data_science.conf import get_ds_env
+from rdagent.components.coder.data_science.share.checks import Check, run_checks
 from rdagent.components.coder.data_science.utils import remove_eda_part
 from rdagent.core.evolving_framework import QueriedKnowledge
 from rdagent.core.experiment import FBWorkspace, Task
@@ -54,13 +55,14 @@ class FeatureCoSTEEREvaluator(CoSTEEREvaluator):
        
         fname = "test/feature_test.py"
         test_code = (DIRNAME / "eval_tests" / "feature_test.txt").read_text()
-        implementation.inject_files(**{fname: test_code})
+        # the whole workflow runs at the same time as the test, but it is only judged if the test passes
+        checks = [Check("feature_test", f"python {fname}", files={fname: test_code})]
+        if "main.py" in implementation.file_dict:
+            checks.append(Check("main", "python main.py", in_place=True, requires="feature_test"))
+        (stdout, ret_code), *workflow_results = run_checks(implementation, env, checks)
 
-        stdout, ret_code = implementation.execute_ret_code(env=env, entry=f"python {fname}")
-
-        if "main.py" in implementation.file_dict and ret_code == 0:
-            workflow_stdout = implementation.execute(env=env, entry="python main.py")
-            workflow_stdout = remove_eda_part(workflow_stdout)
+        if workflow_results and ret_code == 0:
+            workflow_stdout = remove_eda_part(workflow_results[0][0])
         else:
             workflow_stdout = None
 
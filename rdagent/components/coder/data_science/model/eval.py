@@ -13,6 +13,7 @@ from rdagent.components.coder.CoSTEER.evaluators import (
     CoSTEERSingleFeedback,
 )
 from rdagent.components.coder.data_science.conf import get_ds_env
+from rdagent.components.coder.data_science.share.checks import Check, run_checks
 from rdagent.components.coder.data_science.utils import remove_eda_part
 from rdagent.core.evolving_framework import QueriedKnowledge
 from rdagent.core.exception import CoderError
@@ -65,28 +66,33 @@ class ModelGeneralCaseSpecEvaluator(CoSTEEREvaluator):
             }
         )
 
-        if_model_removed = False
+        if_model_removed = f"{target_task.name}.py" not in implementation.file_dict
 
-        if f"{target_task.name}.py" in implementation.file_dict:
+        # the whole workflow runs at the same time as the test, but it is only judged if the test passes
+        checks = []
+        if not if_model_removed:
             fname = "test/model_test.py"
             test_code = (
                 (DIRNAME / "eval_tests" / "model_test.txt").read_text().replace("model01", target_task.name)
             )  # only check the model changed this time
-            implementation.inject_files(**{fname: test_code})
-            stdout, ret_code = implementation.execute_ret_code(env=env, entry=f"python {fname}")
+            checks.append(Check("model_test", f"python {fname}", files={fname: test_code}))
+        if "main.py" in implementation.file_dict:
+            requires = None if if_model_removed else "model_test"
+            checks.append(Check("main", "python main.py", in_place=True, requires=requires))
+        results = run_checks(implementation, env, checks)
 
+        if if_model_removed:
+            ret_code = 0
+            stdout = f"Model {target_task.name} removal succeeded."
+        else:
+            (stdout, ret_code), results = results[0], results[1:]
             if stdout is None:
                 raise CoderError(
                     "The execution output contains too many progress bars and results in the LLM's token size exceeding the limit."
                 )
-        else:
-            ret_code = 0
-            if_model_removed = True
-            stdout = f"Model {target_task.name} removal succeeded."
 
-        if "main.py" in implementation.file_dict and ret_code == 0:
-            workflow_stdout = implementation.execute(env=env, entry="python main.py")
-            workflow_stdout = remove_eda_part(workflow_stdout)
+        if results and ret_code == 0:
+            workflow_stdout = remove_eda_part(results[0][0])
         else:
             workflow_stdout = None
 
@@ -12,6 +12,7 @@ from rdagent.components.coder.CoSTEER.knowledge_management import (
     CoSTEERQueriedKnowledgeV2,
 )
 from rdagent.components.coder.data_science.conf import get_ds_env
+from rdagent.components.coder.data_science.share.checks import Check, run_checks
 from rdagent.components.coder.data_science.utils import remove_eda_part
 from rdagent.core.experiment import FBWorkspace, Task
 from rdagent.utils.agent.tpl import T
@@ -56,8 +57,11 @@ class DataLoaderCoSTEEREvaluator(CoSTEEREvaluator):
         # TODO: do we need to clean the generated temporary content?
         fname = "test/data_loader_test.py"
         test_code = (DIRNAME / "eval_tests" / "data_loader_test.txt").read_text()
-        implementation.inject_files(**{fname: test_code})
-        stdout, ret_code = implementation.execute_ret_code(env=env, entry=f"python {fname}")
+        # the whole workflow runs at the same time as the test, but it is only judged if the test passes
+        checks = [Check("data_loader_test", f"python {fname}", files={fname: test_code})]
+        if "main.py" in implementation.file_dict:
+            checks.append(Check("main", "python main.py", in_place=True, requires="data_loader_test"))
+        (stdout, ret_code), *workflow_results = run_checks(implementation, env, checks)
         match = re.search(r"(.*?)=== Start of EDA part ===(.*)=== End of EDA part ===(.*)", stdout, re.DOTALL) if stdout else None
         if match:
             stdout_part_1, eda_output, stdout_part_2 = match.groups()
@@ -65,9 +69,8 @@ class DataLoaderCoSTEEREvaluator(CoSTEEREvaluator):
         if eda_output is not None and len(eda_output.split(" ")) > 10000:
             eda_output += "Length of EDA output is too long, truncated. Please reject this implementation and motivate it to reduce the length of EDA output."
 
-        if "main.py" in implementation.file_dict and ret_code == 0:
-            workflow_stdout = implementation.execute(env=env, entry="python main.py")
-            workflow_stdout = remove_eda_part(workflow_stdout)
+        if workflow_results and ret_code == 0:
+            workflow_stdout = remove_eda_part(workflow_results[0][0])
         else:
             workflow_stdout = None
 
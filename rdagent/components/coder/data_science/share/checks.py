@@ -0,0 +1,145 @@
+"""
+Run the checks of a component evaluation (e.g. the unit test of the component and the whole workflow) at the same
+time.
+
+A check may require another check to pass (e.g. the whole workflow is only judged if the unit test passes). It still
+runs speculatively at the same time as the check it requires, and its result is discarded if that check fails; so
+the evaluation takes about as long as its slowest check.
+
+Each check runs in an overlay copy of the workspace (a sibling folder holding the files of the workspace), so the
+checks do not see the outputs of each other; the check marked `in_place` runs in the workspace itself, so its outputs
+are kept there like before. The overlays are kept between the evaluations and only the files changed since the last
+injection are written into them; the outputs of a check are removed from its overlay after it runs.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from rdagent.components.coder.data_science.conf import DS_CODER_COSTEER_SETTINGS
+from rdagent.core.blob_store import FileDict
+from rdagent.core.experiment import FBWorkspace
+from rdagent.core.profiling import PROFILER
+from rdagent.utils.env import Env
+from rdagent.utils.run_cache import file_digest
+
+
+@dataclass
+class Check:
+    name: str
+    """The name of the check (and of its overlay folder)"""
+    entry: str
+    files: dict[str, str] = field(default_factory=dict)
+    """The files needed by the check (e.g. the test script); they are injected into the workspace too"""
+    in_place: bool = False
+    """Run in the workspace itself instead of an overlay copy"""
+    requires: str | None = None
+    """The name of a former check which must pass (return 0); otherwise the result of this check is discarded"""
+
+
+def overlay_path(workspace: FBWorkspace, name: str) -> Path:
+    return workspace.workspace_path.parent / f"{workspace.workspace_path.name}.checks" / name
+
+
+def _record_path(folder: Path) -> Path:
+    return folder.with_name(f"{folder.name}.injected.json")
+
+
+def sync_overlay(file_dict: FileDict, folder: Path) -> None:
+    """Make the files of `folder` match `file_dict`; only the changed files are written"""
+    folder.mkdir(parents=True, exist_ok=True)
+    # the files injected last time, so the files removed from the workspace are removed from the overlay too
+    record_path = _record_path(folder)
+    injected = json.loads(record_path.read_text()) if record_path.exists() else []
+    for name in injected:
+        if name not in file_dict:
+            (folder / name).unlink(missing_ok=True)
+    for name, content in file_dict.items():
+        target = folder / name
+        key = file_dict.key(name)
+        # the digests of the files are memoized by their stat, so the unchanged files are not read
+        if key is not None and target.is_file() and file_digest(target) == key:
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content, encoding="utf-8", errors="surrogatepass")
+    record_path.write_text(json.dumps(sorted(file_dict)))
+
+
+def remove_outputs(folder: Path) -> None:
+    """Remove the files of `folder` which were not injected by `sync_overlay` (i.e. the outputs of the check)"""
+    injected = set(json.loads(_record_path(folder).read_text()))
+    for root, dirs, files in os.walk(folder, topdown=False):
+        for name in files:
+            path = Path(root) / name
+            if path.relative_to(folder).as_posix() not in injected:
+                path.unlink(missing_ok=True)
+        for name in dirs:
+            path = Path(root) / name
+            if path.is_symlink():
+                path.unlink()
+            elif not any(path.iterdir()):
+                path.rmdir()
+
+
+def _run_check(workspace: FBWorkspace, file_dict: FileDict, env: Env, check: Check) -> tuple[str, int]:
+    with PROFILER.span(f"check.{check.name}", cat="costeer", in_place=check.in_place):
+        if check.in_place:
+            return workspace.execute_ret_code(env=env, entry=check.entry)
+        folder = overlay_path(workspace, check.name)
+        sync_overlay(file_dict, folder)
+        try:
+            stdout, return_code = env.run_ret_code(check.entry, str(folder), env={"PYTHONPATH": "./"})
+        finally:
+            remove_outputs(folder)
+        return workspace.shrink_stdout(stdout), return_code
+
+
+def _passed(result: tuple[str, int] | None) -> bool:
+    return result is not None and result[1] == 0
+
+
+def run_checks(workspace: FBWorkspace, env: Env, checks: list[Check]) -> list[tuple[str, int] | None]:
+    """
+    Run the checks (at most `DSCoderCoSTEERSettings.parallel_eval_checks` at the same time), so the evaluation takes
+    about as long as its slowest check.
+
+    Returns
+    -------
+    list[tuple[str, int] | None]
+        the stdout & the return code of every check, in the order of `checks`;
+        None for the checks whose required check did not pass
+    """
+    assert sum(check.in_place for check in checks) <= 1, "Only one check can run in the workspace itself"
+    for i, check in enumerate(checks):
+        assert check.requires is None or check.requires in [c.name for c in checks[:i]], (
+            f"{check.name} must come after the check it requires"
+        )
+    workspace.prepare()
+    for check in checks:
+        workspace.inject_files(**check.files)
+    file_dict = workspace.file_dict.copy()  # the checks share a snapshot, whatever the workspace becomes
+    n_workers = max(1, min(DS_CODER_COSTEER_SETTINGS.parallel_eval_checks, len(checks)))
+    results: dict[str, tuple[str, int] | None] = {}
+    if n_workers == 1:
+        # one by one, the checks whose required check did not pass are not run at all
+        for check in checks:
+            if check.requires is None or _passed(results[check.requires]):
+                results[check.name] = _run_check(workspace, file_dict, env, check)
+            else:
+                results[check.name] = None
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="eval-check") as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, _run_check, workspace, file_dict, env, check)
+                for check in checks
+            ]
+            for check, future in zip(checks, futures):
+                result = future.result()
+                # the checks come after the checks they require
+                results[check.name] = result if check.requires is None or _passed(results[check.requires]) else None
+    return [results[check.name] for check in checks]
@@ -1,16 +1,22 @@
 from __future__ import annotations
 
+import functools
 import random
-from collections import deque
+import threading
+from collections import defaultdict, deque
+from collections.abc import Callable
 from pathlib import Path
 import sys
-from typing import Any, NoReturn
+from typing import Any, NoReturn, TypeVar
 
+import numpy as np
+from scipy.spatial.distance import cosine
+
+from rdagent.components.knowledge_management.segment_store import GraphSegmentStore
 from rdagent.components.knowledge_management.vector_base import (
     KnowledgeMetaData,
     PDVectorBase,
     VectorBase,
-    cosine,
 )
 from rdagent.core.knowledge_base import KnowledgeBase
 from rdagent.log import rdagent_logger as logger
@@ -19,6 +25,19 @@ from rdagent.oai.llm_utils import APIBackend
 
 Node = KnowledgeMetaData
 
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def synchronized(method: F) -> F:
+    """Run the method holding `Graph._lock`, so the queries never see a half added batch of nodes"""
+
+    @functools.wraps(method)
+    def wrapper(self: Graph, *args: Any, **kwargs: Any) -> Any:
+        with Graph._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
 
 class UndirectedNode(Node):
     def __init__(
@@ -38,17 +57,32 @@ class UndirectedNode(Node):
         self.appendix = appendix  # appendix stores any additional information
         assert isinstance(content, str), "content must be a string"
 
+    @property
+    def neighbors_by_label(self) -> defaultdict[str, set[UndirectedNode]]:
+        """The neighbors partitioned by label (built lazily for the nodes dumped by the older versions)"""
+        if "_neighbors_by_label" not in self.__dict__:
+            self._neighbors_by_label: defaultdict[str, set[UndirectedNode]] = defaultdict(set)
+            for neighbor in self.neighbors:
+                self._neighbors_by_label[neighbor.label].add(neighbor)
+        return self._neighbors_by_label
+
     def add_neighbor(self, node: UndirectedNode) -> None:
         self.neighbors.add(node)
+        self.neighbors_by_label[node.label].add(node)
         node.neighbors.add(self)
+        node.neighbors_by_label[self.label].add(self)
 
     def remove_neighbor(self, node: UndirectedNode) -> None:
         if node in self.neighbors:
             self.neighbors.remove(node)
+            self.neighbors_by_label[node.label].discard(node)
             node.neighbors.remove(self)
+            node.neighbors_by_label[self.label].discard(self)
 
-    def get_neighbors(self) -> set[UndirectedNode]:
-        return self.neighbors
+    def get_neighbors(self, labels: list[str] | None = None) -> set[UndirectedNode]:
+        if labels is None:
+            return self.neighbors
+        return set().union(*(self.neighbors_by_label.get(label, ()) for label in labels))
 
     def __str__(self) -> str:
         return (
@@ -68,10 +102,56 @@ class Graph(KnowledgeBase):
     base Graph class for Knowledge Graph Search
     """
 
+    # the graphs may be queried while the knowledge is generated in another thread; the lock is shared by the graphs,
+    # so it is not a part of their pickled state
+    _lock = threading.RLock()
+    _write_lock = threading.Lock()  # the nodes are embedded outside `_lock`, so the writers take turns
+
     def __init__(self, path: str | Path | None = None) -> None:
         self.nodes = {}
+        # content -> label -> node id & label -> node ids (an ordered set), to look up the nodes in O(1)
+        self._content_index: dict[str, dict[str, str]] = {}
+        self._label_index: dict[str, dict[str, None]] = {}
+        # the position of each node in the bitsets of the neighborhoods
+        self._node_ids: list[str] = []
+        self._node_positions: dict[str, int] = {}
+        self._neighborhood_cache: dict[tuple, tuple[list[Node], np.ndarray]] = {}
+        # the edges in the order they are added (in node positions), so they can be saved incrementally
+        self._edges: list[tuple[int, int]] = []
         super().__init__(path=path)
 
+    def _ensure_index(self) -> None:
+        # the graphs dumped by the older versions (or the nodes put into `self.nodes` directly) are indexed lazily
+        if len(getattr(self, "_node_ids", ())) != len(self.nodes) or not hasattr(self, "_edges"):
+            self._content_index = {}
+            self._label_index = {}
+            self._node_ids = []
+            self._node_positions = {}
+            self._neighborhood_cache = {}
+            for node in self.nodes.values():
+                self._index_node(node)
+            self._edges = self._collect_edges()
+
+    def _collect_edges(self) -> list[tuple[int, int]]:
+        """The edges of the nodes (in node positions), read from their neighbors"""
+        return [
+            (position, self._node_positions[neighbor.id])
+            for position, node in enumerate(self.nodes.values())
+            for neighbor in getattr(node, "neighbors", ())
+            if self._node_positions.get(neighbor.id, -1) > position
+        ]
+
+    def _index_node(self, node: Node) -> None:
+        self._content_index.setdefault(node.content, {}).setdefault(node.label, node.id)
+        self._label_index.setdefault(node.label, {})[node.id] = None
+        self._node_positions[node.id] = len(self._node_ids)
+        self._node_ids.append(node.id)
+
+    def _register_node(self, node: Node) -> None:
+        self._ensure_index()
+        self.nodes[node.id] = node
+        self._index_node(node)
+
     def size(self) -> int:
         return len(self.nodes)
 
@@ -84,29 +164,28 @@ class Graph(KnowledgeBase):
     def get_all_nodes(self) -> list[Node]:
         return list(self.nodes.values())
 
+    @synchronized
+    def get_all_nodes_by_label(self, label: str) -> list[Node]:
+        self._ensure_index()
+        return [self.nodes[node_id] for node_id in self._label_index.get(label, {})]
+
+    @synchronized
     def get_all_nodes_by_label_list(self, label_list: list[str]) -> list[Node]:
-        return [node for node in self.nodes.values() if node.label in label_list]
+        """The nodes are grouped by label in the order of `label_list`"""
+        return [node for label in dict.fromkeys(label_list) for node in self.get_all_nodes_by_label(label)]
 
+    @synchronized
     def find_node(self, content: str, label: str) -> Node | None:
-        for node in self.nodes.values():
-            if node.content == content and node.label == label:
-                return node
-        return None
+        self._ensure_index()
+        node_id = self._content_index.get(content, {}).get(label)
+        return None if node_id is None else self.nodes.get(node_id)
 
     @staticmethod
     def batch_embedding(nodes: list[Node]) -> list[Node]:
         contents = [node.content for node in nodes]
-        # openai create embedding API input's max length is 16
-        size = 16
-        embeddings = []
-        for i in range(0, len(contents), size):
-            logger.info(
-                f"Creating embedding for index {i} to {i + size} with {len(contents)} contents",
-                tag="batch embedding",
-            )
-            embeddings.extend(
-                APIBackend().create_embedding(input_content=contents[i : i + size]),
-            )
+        # the chunking, deduplication & concurrency of the requests are handled by the backend
+        logger.info(f"Creating embedding for {len(contents)} contents", tag="batch embedding")
+        embeddings = APIBackend().create_embedding(input_content=contents)
 
         assert len(nodes) == len(embeddings), "nodes' length must equals embeddings' length"
         for node, embedding in zip(nodes, embeddings):
@@ -122,6 +201,19 @@ class UndirectedGraph(Graph):
     Undirected Graph which edges have no relationship
     """
 
+    segment_excluded_attributes = (
+        "nodes",
+        "vector_base",
+        "_content_index",
+        "_label_index",
+        "_node_ids",
+        "_node_positions",
+        "_neighborhood_cache",
+        "_edges",
+    )
+    max_segments: int = 32
+    """The segments are compacted into one when there are more of them"""
+
     def __init__(self, path: str | Path | None = None) -> None:
         self.vector_base: VectorBase = PDVectorBase()
         super().__init__(path=path)
@@ -129,6 +221,72 @@ class UndirectedGraph(Graph):
     def __str__(self) -> str:
         return f"UndirectedGraph(nodes={self.nodes})"
 
+    @synchronized
+    def dump_segments(self, path: Path) -> None:
+        """
+        The nodes, the edges and the embeddings added since the last dump are appended to the segments of `path`;
+        the other attributes are saved in `state.pkl` (with the nodes referred to by their ids).
+        """
+        self._ensure_index()
+        store = GraphSegmentStore(path)
+        nodes = [self.nodes[node_id] for node_id in self._node_ids]
+        if any(nodes[b] not in nodes[a].neighbors for a, b in self._edges):
+            # the edges removed by `UndirectedNode.remove_neighbor` can not be removed from the segments
+            self._edges = self._collect_edges()
+            self._neighborhood_cache = {}
+            store.reset()
+        if not store.is_prefix_of(self._node_ids) or store.edge_count > len(self._edges):
+            # the graph is not an extension of the saved one
+            store.reset()
+        store.append(
+            [self.nodes[node_id] for node_id in self._node_ids[store.node_count :]],
+            self._edges[store.edge_count :],
+        )
+        if len(store.manifest["segments"]) > self.max_segments:
+            store.compact()
+        super().dump_segments(path)
+
+    def load_segments(self, path: Path) -> None:
+        columns, embeddings, edges = GraphSegmentStore(path).read()
+        embedding_rows = (row for matrix in embeddings for row in matrix)
+        nodes = []
+        for node_id, label, content, appendix, has_embedding, embedding in zip(
+            columns["id"],
+            columns["label"],
+            columns["content"],
+            columns["appendix"],
+            columns["has_embedding"],
+            embedding_rows,
+        ):
+            # the embeddings stay in the memory mapped segments
+            node = UndirectedNode(
+                content=content,
+                label=label,
+                embedding=embedding if has_embedding else None,
+                appendix=appendix,
+            )
+            node.id = node_id
+            nodes.append(node)
+        for a, b in edges.tolist():
+            nodes[a].add_neighbor(nodes[b])
+
+        self.nodes = {node.id: node for node in nodes}
+        self._ensure_index()
+        self._edges = [(a, b) for a, b in edges.tolist()]
+        self.vector_base = PDVectorBase()
+        self.vector_base.add([node for node in nodes if node.embedding is not None])
+        super().load_segments(path)
+
+    def persistent_id(self, obj: Any) -> Any:
+        if isinstance(obj, UndirectedNode) and self.nodes.get(obj.id) is obj:
+            return ("node", obj.id)
+        return None
+
+    def persistent_load(self, pid: Any) -> Any:
+        if pid[0] == "node":
+            return self.nodes[pid[1]]
+        return super().persistent_load(pid)
+
     def add_node(
         self,
         node: UndirectedNode,
@@ -148,49 +306,71 @@ class UndirectedGraph(Graph):
         -------
 
         """
-        if self.get_node(node.id):
-            node = self.get_node(node.id)
-        elif self.find_node(content=node.content, label=node.label):
-            node = self.find_node(content=node.content, label=node.label)
-        else:
-            # same_node = self.semantic_search(node=node.content, similarity_threshold=same_node_threshold, topk_k=1)
-            # if len(same_node):
-            #     node = same_node[0]
-            # else:
-            node.create_embedding()
-            self.vector_base.add(document=node)
-            self.nodes.update({node.id: node})
-
-        if neighbor is not None:
-            if self.get_node(neighbor.id):
-                neighbor = self.get_node(neighbor.id)
-            elif self.find_node(content=neighbor.content, label=node.label):
-                neighbor = self.find_node(content=neighbor.content, label=node.label)
-            else:
-                # same_node = self.semantic_search(node=neighbor.content,
-                #                                  similarity_threshold=same_node_threshold, topk_k=1)
-                # if len(same_node):
-                #     neighbor = same_node[0]
-                # else:
-                neighbor.create_embedding()
-                self.vector_base.add(document=neighbor)
-                self.nodes.update({neighbor.id: neighbor}) 
-
-            node.add_neighbor(neighbor)
-
-    
-    
+        self.add_nodes_bulk([(node, [] if neighbor is None else [neighbor])])
 
     def add_nodes(self, node: UndirectedNode, neighbors: list[UndirectedNode]) -> None:
-        if not neighbors:
-            self.add_node(node)
-        else:
-            for neighbor in neighbors:
-                self.add_node(node, neighbor=neighbor)
+        self.add_nodes_bulk([(node, neighbors)])
+
+    def add_nodes_bulk(self, node_neighbors: list[tuple[UndirectedNode, list[UndirectedNode]]]) -> None:
+        """
+        Add the nodes and connect each of them to its neighbors.
+
+        The nodes already in the graph (with the same id, or the same content and label) are reused.
+        The new nodes are embedded in one batched call and added to the vector base together.
+
+        Parameters
+        ----------
+        node_neighbors : list[tuple[UndirectedNode, list[UndirectedNode]]]
+            The nodes and their neighbors.
+        """
+        with self._write_lock:
+            with self._lock:
+                new_nodes, edges = self._resolve_nodes(node_neighbors)
+            to_embed = [node for node in new_nodes if node.embedding is None]
+            if to_embed:
+                self.batch_embedding(to_embed)  # the queries are not blocked by the requests
+            with self._lock:
+                if new_nodes:
+                    self.vector_base.add(document=new_nodes)
+                    for node in new_nodes:
+                        self._register_node(node)
+                for node, neighbor in edges:
+                    if neighbor not in node.neighbors:
+                        node.add_neighbor(neighbor)
+                        self._edges.append((self._node_positions[node.id], self._node_positions[neighbor.id]))
+                self._neighborhood_cache = {}
+
+    def _resolve_nodes(
+        self, node_neighbors: list[tuple[UndirectedNode, list[UndirectedNode]]]
+    ) -> tuple[list[UndirectedNode], list[tuple[UndirectedNode, UndirectedNode]]]:
+        """The new nodes and the edges to add, where the nodes already in the graph are reused"""
+        new_nodes: dict[str, UndirectedNode] = {}
+        new_content_index: dict[tuple[str, str], UndirectedNode] = {}
+
+        def resolve(node: UndirectedNode, label: str) -> UndirectedNode:
+            existing = (
+                self.get_node(node.id)
+                or new_nodes.get(node.id)
+                or self.find_node(content=node.content, label=label)
+                or new_content_index.get((label, node.content))
+            )
+            if existing is not None:
+                return existing
+            new_nodes[node.id] = node
+            new_content_index.setdefault((node.label, node.content), node)
+            return node
+
+        edges = []
+        for node, neighbors in node_neighbors:
+            node = resolve(node, node.label)
+            # the neighbors are looked up by the label of the node (kept from the original implementation)
+            edges.extend((node, resolve(neighbor, node.label)) for neighbor in neighbors)
+        return list(new_nodes.values()), edges
 
     def get_node(self, node_id: str) -> UndirectedNode:
         return self.nodes.get(node_id)
 
+    @synchronized
     def get_node_by_content(self, content: str) -> UndirectedNode | None:
         """
         Get node by semantic distance
@@ -202,13 +382,15 @@ class UndirectedGraph(Graph):
         -------
 
         """
-        if content == "Model":
-            pass
+        self._ensure_index()
+        if content in self._content_index:
+            return self.nodes[next(iter(self._content_index[content].values()))]
         match = self.semantic_search(node=content, similarity_threshold=0.999)
         if match:
             return match[0]
         return None
    
+    @synchronized
     def get_nodes_within_steps(
         self,
         start_node: UndirectedNode,
@@ -234,11 +416,11 @@ class UndirectedGraph(Graph):
                 visited.add(node)
                 result.append(node)
 
-                for neighbor in sorted(
-                    self.get_node(node.id).neighbors,
-                    key=lambda x: x.content,
-                ):  # to make sure the result is deterministic
-                    if neighbor not in visited and not (block and constraint_labels is not None and neighbor.label not in constraint_labels):
+                neighbors = self.get_node(node.id).get_neighbors(
+                    labels=constraint_labels if block and constraint_labels is not None else None,
+                )
+                for neighbor in sorted(neighbors, key=lambda x: x.content):  # to make sure the result is deterministic
+                    if neighbor not in visited:
                         queue.append((neighbor, current_steps + 1))
 
         if constraint_labels:
@@ -247,6 +429,7 @@ class UndirectedGraph(Graph):
             result.remove(start_node)
         return result
 
+    @synchronized
     def get_nodes_intersection(
         self,
         nodes: list[UndirectedNode],
@@ -276,25 +459,70 @@ class UndirectedGraph(Graph):
 
         min_nodes_count = 2
         assert len(nodes) >= min_nodes_count, "nodes length must >= 2"
-        intersection = None
+        neighborhoods = [self.get_neighborhood(node, steps=steps, constraint_labels=constraint_labels) for node in nodes]
+        intersection = np.bitwise_and.reduce([bitset for _, bitset in neighborhoods])
+        return [node for node in neighborhoods[0][0] if self._in_bitset(intersection, node)]
 
-        for node in nodes:
-            if intersection is None:
-                intersection = self.get_nodes_within_steps(
-                    node,
-                    steps=steps,
-                    constraint_labels=constraint_labels,
-                )
-            intersection = self.intersection(
-                nodes1=intersection,
-                nodes2=self.get_nodes_within_steps(
-                    node,
-                    steps=steps,
-                    constraint_labels=constraint_labels,
-                ),
-            )
-        return intersection
+    def _in_bitset(self, bitset: np.ndarray, node: UndirectedNode) -> bool:
+        position = self._node_positions[node.id]
+        return bool(bitset[position >> 3] & (0x80 >> (position & 7)))
+
+    @synchronized
+    def get_neighborhood(
+        self,
+        node: UndirectedNode,
+        steps: int = 1,
+        constraint_labels: list[str] | None = None,
+        *,
+        block: bool = False,
+    ) -> tuple[list[UndirectedNode], np.ndarray]:
+        """
+        The nodes returned by `get_nodes_within_steps` and their bitset (packed by `np.packbits`) over the node
+        positions of the graph. The neighborhoods are cached until the graph is changed.
+        """
+        self._ensure_index()
+        key = (node.id, steps, None if constraint_labels is None else tuple(constraint_labels), block)
+        if key not in self._neighborhood_cache:
+            nodes = self.get_nodes_within_steps(node, steps=steps, constraint_labels=constraint_labels, block=block)
+            mask = np.zeros(len(self._node_ids), dtype=bool)
+            mask[[self._node_positions[n.id] for n in nodes]] = True
+            self._neighborhood_cache[key] = (nodes, np.packbits(mask))
+        return self._neighborhood_cache[key]
+
+    @synchronized
+    def query_by_intersection(
+        self,
+        nodes: list[UndirectedNode],
+        steps: int = 1,
+        constraint_labels: list[str] | None = None,
+    ) -> list[tuple[list[UndirectedNode], UndirectedNode]]:
+        """
+        Get the nodes within `steps` of at least two of `nodes`.
+
+        The result is the same as intersecting the neighborhoods of every combination of `nodes` (from the largest
+        combinations to the smallest ones) without enumerating the combinations.
 
+        Returns
+        -------
+        list[tuple[list[UndirectedNode], UndirectedNode]]
+            The nodes and the input nodes reaching them. The nodes reached by more input nodes come first; the ties
+            are ordered by the combinations of the input nodes, then by the search order of the neighborhood.
+        """
+        neighborhoods = [self.get_neighborhood(node, steps=steps, constraint_labels=constraint_labels) for node in nodes]
+        membership = np.unpackbits(
+            np.stack([bitset for _, bitset in neighborhoods]), axis=1, count=len(self._node_ids)
+        ).astype(bool)
+        frequency = membership.sum(axis=0)
+        ranked = {}
+        for neighborhood, _ in neighborhoods:
+            for rank, node in enumerate(neighborhood):
+                position = self._node_positions[node.id]
+                if frequency[position] >= 2 and node.id not in ranked:
+                    origin = tuple(np.flatnonzero(membership[:, position]).tolist())
+                    ranked[node.id] = ((-len(origin), origin, rank), origin, node)
+        return [([nodes[i] for i in origin], node) for _, origin, node in sorted(ranked.values(), key=lambda r: r[0])]
+
+    @synchronized
     def semantic_search(
         self,
         node: UndirectedNode | str,
@@ -334,6 +562,7 @@ class UndirectedGraph(Graph):
         )
         return [self.get_node(doc.id) for doc in docs]
 
+    @synchronized
     def query_by_node(
         self,
         node: UndirectedNode,
@@ -372,6 +601,7 @@ class UndirectedGraph(Graph):
             return []
         return nodes
 
+    @synchronized
     def query_by_content(
         self,
         content: str | list[str],
@@ -461,8 +691,10 @@ class UndirectedGraph(Graph):
     def filter_label(nodes: list[UndirectedNode], labels: list[str]) -> list[UndirectedNode]:
         return [node for node in nodes if node.label in labels]
 
+    @synchronized
     def clear(self) -> None:
         self.nodes.clear()
+        self._neighborhood_cache = {}
         self.vector_base: VectorBase = PDVectorBase()
     
     pass
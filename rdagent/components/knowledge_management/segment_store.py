@@ -0,0 +1,160 @@
+"""
+The segmented on-disk format of the graphs.
+
+.. code-block::
+
+    <path>/
+        manifest.json           # the committed segments; it is replaced atomically after a segment is written
+        state.pkl               # the other attributes of the knowledge base
+        segments/00000/
+            nodes.pkl           # the columns of the nodes: id, label, content, appendix, has_embedding
+            embeddings.npy      # float32 matrix of the embeddings, loaded with memory mapping
+            edges.npy           # int64 matrix (n, 2) of the edges, in node positions of the whole graph
+        segments/00001/
+            ...
+
+The nodes and the edges are append-only: every dump writes a new segment with the nodes & edges added since the
+last dump. `compact` rewrites all the segments into one.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+MANIFEST_VERSION = 1
+
+
+class GraphSegmentStore:
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self) -> dict[str, Any]:
+        manifest_path = self.path / "manifest.json"
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text())
+            if manifest["version"] > MANIFEST_VERSION:
+                raise ValueError(f"The graph at {self.path} is saved by a newer version (format {manifest['version']})")
+            return manifest
+        return self._empty_manifest()
+
+    @staticmethod
+    def _empty_manifest() -> dict[str, Any]:
+        return {"version": MANIFEST_VERSION, "segments": [], "node_count": 0, "edge_count": 0, "last_node_id": None}
+
+    def _write_manifest(self) -> None:
+        tmp_path = self.path / "manifest.json.tmp"
+        tmp_path.write_text(json.dumps(self.manifest, indent=2))
+        os.replace(tmp_path, self.path / "manifest.json")
+
+    @property
+    def node_count(self) -> int:
+        return self.manifest["node_count"]
+
+    @property
+    def edge_count(self) -> int:
+        return self.manifest["edge_count"]
+
+    def is_prefix_of(self, node_ids: list[str]) -> bool:
+        """Whether the saved nodes are the first nodes of `node_ids` (so only the rest need to be appended)"""
+        return self.node_count <= len(node_ids) and (
+            self.node_count == 0 or node_ids[self.node_count - 1] == self.manifest["last_node_id"]
+        )
+
+    def append(self, nodes: list[Any], edges: list[tuple[int, int]]) -> None:
+        """
+        Append a segment of the nodes (with `id`, `label`, `content`, `appendix` & `embedding` attributes) and the
+        edges (in the node positions of the whole graph).
+        """
+        if not nodes and not edges:
+            return
+        name = self._next_segment_name()
+        segment_path = self.path / "segments" / name
+        if segment_path.exists():  # left by an interrupted dump
+            shutil.rmtree(segment_path)
+        segment_path.mkdir(parents=True)
+
+        has_embedding = [node.embedding is not None for node in nodes]
+        embeddings = [np.asarray(node.embedding, dtype=np.float32) for node in nodes if node.embedding is not None]
+        dim = embeddings[0].shape[0] if embeddings else self.manifest.get("dim", 0)
+        matrix = np.zeros((len(nodes), dim), dtype=np.float32)
+        if embeddings:
+            matrix[np.asarray(has_embedding)] = np.stack(embeddings)
+        columns = {
+            "id": [node.id for node in nodes],
+            "label": [node.label for node in nodes],
+            "content": [node.content for node in nodes],
+            "appendix": [getattr(node, "appendix", None) for node in nodes],
+            "has_embedding": has_embedding,
+        }
+        with (segment_path / "nodes.pkl").open("wb") as f:
+            pickle.dump(columns, f)
+        np.save(segment_path / "embeddings.npy", matrix)
+        np.save(segment_path / "edges.npy", np.asarray(edges, dtype=np.int64).reshape(-1, 2))
+
+        self.manifest["segments"].append({"name": name, "nodes": len(nodes), "edges": len(edges)})
+        self.manifest["node_count"] += len(nodes)
+        self.manifest["edge_count"] += len(edges)
+        if nodes:
+            self.manifest["last_node_id"] = nodes[-1].id
+        self.manifest["dim"] = dim
+        self._write_manifest()
+
+    def _next_segment_name(self) -> str:
+        return f"{max((int(segment['name']) + 1 for segment in self.manifest['segments']), default=0):05d}"
+
+    def reset(self) -> None:
+        """Drop all the segments (e.g. before rewriting a graph that is not an extension of the saved one)"""
+        self.manifest = self._empty_manifest()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write_manifest()
+        shutil.rmtree(self.path / "segments", ignore_errors=True)
+
+    def read(self) -> tuple[dict[str, list], list[np.ndarray], np.ndarray]:
+        """
+        Returns
+        -------
+        tuple[dict[str, list], list[np.ndarray], np.ndarray]
+            the columns of the nodes, the embeddings of each segment (memory mapped rather than read into memory)
+            and the edges of all the segments.
+        """
+        columns: dict[str, list] = {"id": [], "label": [], "content": [], "appendix": [], "has_embedding": []}
+        embeddings, edges = [], []
+        for segment in self.manifest["segments"]:
+            segment_path = self.path / "segments" / segment["name"]
+            with (segment_path / "nodes.pkl").open("rb") as f:
+                for key, values in pickle.load(f).items():
+                    columns[key].extend(values)
+            embeddings.append(np.load(segment_path / "embeddings.npy", mmap_mode="r"))
+            edges.append(np.load(segment_path / "edges.npy"))
+        return columns, embeddings, np.concatenate(edges) if edges else np.zeros((0, 2), dtype=np.int64)
+
+    def compact(self) -> None:
+        """Rewrite all the segments into one"""
+        if len(self.manifest["segments"]) <= 1:
+            return
+        columns, embeddings, edges = self.read()
+        # the segments without any embedding have no columns; the result is detached from the memory mapped files
+        dim = max(embedding.shape[1] for embedding in embeddings)
+        embeddings = np.concatenate(
+            [np.pad(embedding, ((0, 0), (0, dim - embedding.shape[1]))) for embedding in embeddings]
+        )
+        old_segments = self.manifest["segments"]
+        name = self._next_segment_name()
+        segment_path = self.path / "segments" / name
+        segment_path.mkdir(parents=True, exist_ok=True)
+        with (segment_path / "nodes.pkl").open("wb") as f:
+            pickle.dump(columns, f)
+        np.save(segment_path / "embeddings.npy", embeddings)
+        np.save(segment_path / "edges.npy", edges)
+        self.manifest["segments"] = [{"name": name, "nodes": len(columns["id"]), "edges": len(edges)}]
+        self._write_manifest()
+        for segment in old_segments:
+            shutil.rmtree(self.path / "segments" / segment["name"], ignore_errors=True)
@@ -1,15 +1,16 @@
 import uuid
+from collections import defaultdict
 from pathlib import Path
-from typing import List, Tuple, Union, Optional
+from typing import Any, List, Optional, Tuple, Union
+
 import numpy as np
 import pandas as pd
-from scipy.spatial.distance import cosine
 
 from rdagent.core.knowledge_base import KnowledgeBase
 from rdagent.log import rdagent_logger as logger
 from rdagent.oai.llm_utils import APIBackend
 
-import numpy
+
 class KnowledgeMetaData:
     def __init__(self, content: str = "", label: str = None, embedding=None, identity=None):
         self.label = label
@@ -60,15 +61,121 @@ Document = KnowledgeMetaData
 
 
 def contents_to_documents(contents: List[str], label: str = None) -> List[Document]:
-    # openai create embedding API input's max length is 16
-    size = 16
-    embedding = []
-    for i in range(0, len(contents), size):
-        embedding.extend(APIBackend().create_embedding(input_content=contents[i : i + size]))
+    # the chunking, deduplication & concurrency of the requests are handled by the backend
+    embedding = APIBackend().create_embedding(input_content=contents) if contents else []
     docs = [Document(content=c, label=label, embedding=e) for c, e in zip(contents, embedding)]
     return docs
 
 
+class VectorIndex:
+    """
+    In-memory index of the embeddings for cosine similarity search.
+
+    The embeddings are normalized and stored in a contiguous float32 matrix, so a query is answered by a single
+    matrix multiply and `argpartition`. The rows of each label are tracked to apply the label constraints without
+    scanning the labels.
+
+    If `ivf_lists` > 0, the rows are partitioned by (spherical) k-means once the index reaches `ivf_min_size` rows,
+    and only the rows in the `ivf_probes` partitions closest to the query are scored. The search becomes
+    approximate in this case.
+    """
+
+    def __init__(self, ivf_lists: int = 0, ivf_probes: int = 8, ivf_min_size: int = 10000) -> None:
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.ivf_min_size = ivf_min_size
+        self.size = 0
+        self._matrix: np.ndarray | None = None
+        self._label_rows: defaultdict[Any, list[int]] = defaultdict(list)
+        self._centroids: np.ndarray | None = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+    def add(self, embeddings: list | np.ndarray, labels: list) -> None:
+        embeddings = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(labels), -1))
+        if self._matrix is None:
+            self._matrix = np.empty((max(len(embeddings), 64), embeddings.shape[1]), dtype=np.float32)
+        new_size = self.size + len(embeddings)
+        if new_size > self._matrix.shape[0]:
+            # grow geometrically, so adding the rows one by one is still amortized O(1)
+            matrix = np.empty((max(new_size, 2 * self._matrix.shape[0]), self._matrix.shape[1]), dtype=np.float32)
+            matrix[: self.size] = self._matrix[: self.size]
+            self._matrix = matrix
+        self._matrix[self.size : new_size] = embeddings
+        for row, label in enumerate(labels, start=self.size):
+            self._label_rows[label].append(row)
+        if self._centroids is not None:
+            self._assignments = np.concatenate([self._assignments, self._assign(embeddings)])
+        self.size = new_size
+
+    def _assign(self, embeddings: np.ndarray) -> np.ndarray:
+        return np.argmax(embeddings @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _train(self, n_iter: int = 10) -> None:
+        matrix = self._matrix[: self.size]
+        rng = np.random.default_rng(0)
+        centroids = matrix[rng.choice(self.size, self.ivf_lists, replace=False)]
+        for _ in range(n_iter):
+            assignments = np.argmax(matrix @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, matrix)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]  # keep the centroids of the empty lists
+            centroids = self._normalize(sums)
+        self._centroids = centroids
+        self._assignments = self._assign(matrix)
+        self._trained_size = self.size
+
+    def similarities(self, queries: list | np.ndarray) -> np.ndarray:
+        """The cosine similarities (n_queries, size) between the queries and all the rows, in one matrix multiply"""
+        queries = self._normalize(np.asarray(queries, dtype=np.float32).reshape(len(queries), -1))
+        if self.size == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        return queries @ self._matrix[: self.size].T
+
+    def search(
+        self,
+        query: list | np.ndarray,
+        topk_k: Optional[int] = None,
+        similarity_threshold: float = 0,
+        constraint_labels: list | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The row ids and the cosine similarities of the matched rows, sorted by similarity (descending).
+        """
+        if self.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = self._normalize(np.asarray(query, dtype=np.float32).ravel())
+
+        rows = None
+        if constraint_labels is not None:
+            rows = np.fromiter(
+                (row for label in set(constraint_labels) for row in self._label_rows.get(label, [])), dtype=np.int64
+            )
+        if self.ivf_lists > 0 and self.size >= max(self.ivf_min_size, self.ivf_lists):
+            if self._centroids is None or self.size >= 2 * self._trained_size:
+                self._train()
+            probes = np.argsort(-(self._centroids @ query))[: self.ivf_probes]
+            probed = np.isin(self._assignments, probes)
+            rows = np.flatnonzero(probed) if rows is None else rows[probed[rows]]
+
+        matrix = self._matrix[: self.size] if rows is None else self._matrix[rows]
+        similarities = matrix @ query
+        matched = np.flatnonzero(similarities > similarity_threshold)
+        if topk_k is not None and topk_k < len(matched):
+            matched = matched[np.argpartition(-similarities[matched], topk_k - 1)[:topk_k]]
+        matched = matched[np.argsort(-similarities[matched], kind="stable")]
+        return (matched if rows is None else rows[matched]), similarities[matched]
+
+
 class VectorBase(KnowledgeBase):
     """
     This class is used for handling vector storage and query
@@ -106,14 +213,75 @@ class VectorBase(KnowledgeBase):
 class PDVectorBase(VectorBase):
     """
     Implement of VectorBase using Pandas
+
+    The rows are kept in `vector_df`, and the embeddings are indexed by a `VectorIndex` for searching.
+    The added rows are buffered and concatenated to `vector_df` in one batch when it is accessed.
     """
 
-    def __init__(self, path: Union[str, Path] = None):
-        self.vector_df = pd.DataFrame(columns=["id", "label", "content", "embedding"])
+    def __init__(self, path: Union[str, Path] = None, ivf_lists: int = 0, ivf_probes: int = 8):
+        self._vector_df = pd.DataFrame(columns=["id", "label", "content", "embedding"])
+        self._pending_rows: list[dict] = []
+        self._index = VectorIndex(ivf_lists=ivf_lists, ivf_probes=ivf_probes)
+        self._version = 0
+        """bumped whenever the rows of `vector_df` may be replaced or edited in place (not when rows are added)"""
+        self._index_version = 0
+        """the `_version` of the rows in `_index`; the index is rebuilt on the next search if they differ"""
         super().__init__(path)
 
+    def _rows(self) -> pd.DataFrame:
+        if self._pending_rows:
+            self._vector_df = pd.concat([self._vector_df, pd.DataFrame(self._pending_rows)], ignore_index=True)
+            self._pending_rows = []
+        return self._vector_df
+
+    @property
+    def vector_df(self) -> pd.DataFrame:
+        # the caller may edit the rows in place, so the index is rebuilt on the next search
+        self._version += 1
+        return self._rows()
+
+    @vector_df.setter
+    def vector_df(self, vector_df: pd.DataFrame) -> None:
+        self._vector_df = vector_df.reset_index(drop=True)
+        self._pending_rows = []
+        self._version += 1
+
+    def __getstate__(self) -> dict:
+        # the index only duplicates the embeddings of `vector_df`, so it is rebuilt after loading instead of pickled
+        state = self.__dict__.copy()
+        if "_index" in state:
+            state["_index"] = VectorIndex(ivf_lists=self._index.ivf_lists, ivf_probes=self._index.ivf_probes)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._migrate()
+
+    def load(self) -> None:
+        super().load()
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # the vector bases dumped by the older versions only have a `vector_df` or have a pickled index
+        index = self.__dict__.get("_index", VectorIndex())
+        self._index = VectorIndex(ivf_lists=index.ivf_lists, ivf_probes=index.ivf_probes)
+        self.__dict__.setdefault("_version", 0)
+        self._index_version = self._version
+        if "vector_df" in self.__dict__:
+            self.__dict__["_pending_rows"] = []
+            self.vector_df = self.__dict__.pop("vector_df")
+
+    def _sync_index(self) -> None:
+        vector_df = self._rows()
+        if self._index_version != self._version:
+            self._index = VectorIndex(ivf_lists=self._index.ivf_lists, ivf_probes=self._index.ivf_probes)
+            self._index_version = self._version
+        if self._index.size < len(vector_df):
+            new_rows = vector_df.iloc[self._index.size :]
+            self._index.add(np.stack(new_rows["embedding"].map(np.asarray).to_list()), new_rows["label"].to_list())
+
     def shape(self):
-        return self.vector_df.shape
+        return self._rows().shape
 
     def add(self, document: Union[Document, List[Document]]):
         """
@@ -126,10 +294,12 @@ class PDVectorBase(VectorBase):
         -------
 
         """
-        if isinstance(document, Document):
+        documents = [document] if isinstance(document, Document) else document
+        docs = []
+        for document in documents:
             if document.embedding is None:
                 document.create_embedding()
-            docs = [
+            docs.append(
                 {
                     "id": document.id,
                     "label": document.label,
@@ -137,7 +307,7 @@ class PDVectorBase(VectorBase):
                     "trunk": document.content,
                     "embedding": document.embedding,
                 }
-            ]
+            )
             docs.extend(
                 [
                     {
@@ -150,10 +320,7 @@ class PDVectorBase(VectorBase):
                     for trunk, embedding in zip(document.trunks, document.trunks_embedding)
                 ]
             )
-            self.vector_df = pd.concat([self.vector_df, pd.DataFrame(docs)], ignore_index=True)
-        else:
-            for doc in document:
-                self.add(document=doc)
+        self._pending_rows.extend(docs)
 
     def search(
         self,
@@ -182,29 +349,18 @@ class PDVectorBase(VectorBase):
             A list of `topk_k` nodes that are semantically similar to the input node, sorted by similarity score.
             All nodes shall meet the `similarity_threshold` and `constraint_labels` criteria.
         """
-        if not self.vector_df.shape[0]:
+        if not self._rows().shape[0]:
             return [], []
 
         document = Document(content=content)
         document.create_embedding()
 
-        filtered_df = self.vector_df
-        if constraint_labels is not None:
-            filtered_df = self.vector_df[self.vector_df["label"].isin(constraint_labels)]
-
-        similarities = filtered_df["embedding"].apply(lambda x: (1 - cosine(np.array(x), np.array(document.embedding)))
-        if not isinstance(x, numpy.ndarray) or not isinstance(document.embedding, numpy.ndarray)
-        else (1 - cosine(x, document.embedding))
+        self._sync_index()
+        rows, similarities = self._index.search(
+            document.embedding,
+            topk_k=topk_k,
+            similarity_threshold=similarity_threshold,
+            constraint_labels=constraint_labels,
         )
-        # cosine is cosine distance, 1-similarity
-
-        searched_similarities = similarities[similarities > similarity_threshold]
-        if topk_k is not None:
-            searched_similarities = searched_similarities.nlargest(topk_k)
-        most_similar_docs = filtered_df.loc[searched_similarities.index]
-
-        docs = []
-        for _, similar_docs in most_similar_docs.iterrows():
-            docs.append(Document().from_dict(similar_docs.to_dict()))
-
-        return docs, searched_similarities.to_list()
+        docs = [Document().from_dict(row) for row in self._rows().iloc[rows].to_dict("records")]
+        return docs, similarities.tolist()
@@ -22,6 +22,11 @@ from rdagent.utils.workflow import LoopBase, LoopMeta
 
 
 class RDLoop(LoopBase, metaclass=LoopMeta):
+    checkpoint_append_only_attributes = ("trace.hist",)
+    # the feedback of a loop is based on the trace updated by the former loops
+    ordered_steps = ("feedback",)
+    # the experiments share the machine (e.g. the GPU & the qlib data), so they are run one at a time
+    step_concurrency = {"running": 1}
 
     def __init__(self, PROP_SETTING: BasePropSetting):
         with logger.tag("init"):
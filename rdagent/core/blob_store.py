@@ -0,0 +1,223 @@
+"""
+Content-addressed storage of the workspace files.
+
+The contents of the files are kept once per process in `WORKSPACE_BLOB_STORE` (sha256 -> text) and the workspaces
+only hold `FileDict` views (file name -> key). Copying a `FileDict` shares the view until one side writes
+(copy-on-write), so the copies & snapshots of the workspaces do not duplicate the source text.
+
+When pickling inside `WORKSPACE_BLOB_STORE.persist_to(folder)`, the views are saved as keys and the contents are
+written once into `folder` (one file per blob); such pickles are loaded lazily after `attach(folder)`.
+Other pickles are self-contained.
+
+The contents in memory are bounded by `RD_AGENT_SETTINGS.workspace_blob_memory_chars`: the least recently used ones
+are dropped and read again from the folder they are saved to (the contents never saved are spilled to a temporary
+folder first).
+"""
+
+from __future__ import annotations
+
+import contextvars
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Generator, Iterator, Mapping, MutableMapping
+from contextlib import contextmanager
+from copy import deepcopy
+from pathlib import Path
+from typing import Any
+
+from rdagent.core.conf import RD_AGENT_SETTINGS
+
+
+class BlobStore:
+    def __init__(self) -> None:
+        self._blobs: OrderedDict[str, str] = OrderedDict()  # in the order of the last use
+        self._chars = 0  # the total length of the contents in memory
+        self._folders: list[Path] = []
+        self._persisted: dict[Path, set[str]] = {}
+        """the keys known to be written in each folder, to avoid checking the files again"""
+        self._locations: dict[str, Path] = {}
+        """the folder holding the file of each key, so the blob can be dropped from memory"""
+        self._spill_dir: tempfile.TemporaryDirectory | None = None
+        self._lock = threading.Lock()
+        self._sink: contextvars.ContextVar[Path | None] = contextvars.ContextVar("blob_sink", default=None)
+
+    @staticmethod
+    def hash(content: str) -> str:
+        return hashlib.sha256(content.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def put(self, content: str) -> str:
+        """Store `content` and return its key; the equal contents are stored (and referred to) only once"""
+        key = self.hash(content)
+        with self._lock:
+            self._cache(key, content)
+        return key
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            content = self._blobs.get(key)
+            if content is not None:
+                self._blobs.move_to_end(key)
+                return content
+        content = self._read(key)
+        with self._lock:
+            return self._cache(key, content)
+
+    def _cache(self, key: str, content: str) -> str:
+        """Keep `content` in memory as the latest used blob & drop the least recently used ones beyond the limit"""
+        cached = self._blobs.get(key)
+        if cached is not None:
+            self._blobs.move_to_end(key)
+            return cached
+        self._blobs[key] = content
+        self._chars += len(content)
+        while self._chars > RD_AGENT_SETTINGS.workspace_blob_memory_chars and len(self._blobs) > 1:
+            old_key, old_content = next(iter(self._blobs.items()))
+            if old_key not in self._locations:
+                self._spill(old_key, old_content)
+            del self._blobs[old_key]
+            self._chars -= len(old_content)
+        return content
+
+    def _spill(self, key: str, content: str) -> None:
+        if self._spill_dir is None:
+            # removed with the store (or when the process exits)
+            self._spill_dir = tempfile.TemporaryDirectory(prefix="rdagent_blobs_")
+        folder = Path(self._spill_dir.name)
+        (folder / key).write_text(content, encoding="utf-8", errors="surrogatepass")
+        self._locations[key] = folder
+
+    def _read(self, key: str) -> str:
+        folder = self._locations.get(key)
+        folders = ([] if folder is None else [folder]) + list(reversed(self._folders))
+        for folder in folders:
+            if (folder / key).exists():
+                content = (folder / key).read_text(encoding="utf-8", errors="surrogatepass")
+                with self._lock:
+                    self._locations[key] = folder
+                return content
+        raise KeyError(f"Blob {key} is not found; please attach the folder it was saved to")
+
+    def attach(self, folder: str | Path) -> None:
+        """Read the missing blobs from `folder` (on demand)"""
+        folder = Path(folder)
+        with self._lock:
+            if folder not in self._folders:
+                self._folders.append(folder)
+
+    @contextmanager
+    def persist_to(self, folder: str | Path) -> Generator[Path, None, None]:
+        """The `FileDict`s pickled in the context are saved as keys and their blobs are written into `folder`"""
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        self.attach(folder)
+        token = self._sink.set(folder)
+        try:
+            yield folder
+        finally:
+            self._sink.reset(token)
+
+    def _persist(self, keys: list[str]) -> bool:
+        """Write the blobs to the active sink; return False if there is no sink"""
+        folder = self._sink.get()
+        if folder is None:
+            return False
+        persisted = self._persisted.setdefault(folder, set())
+        for key in keys:
+            if key in persisted:
+                continue
+            path = folder / key
+            if not path.exists():
+                tmp_path = folder / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+                tmp_path.write_text(self.get(key), encoding="utf-8", errors="surrogatepass")
+                os.replace(tmp_path, path)  # the blob is never seen half written
+            persisted.add(key)
+            with self._lock:
+                self._locations.setdefault(key, folder)
+        return True
+
+
+WORKSPACE_BLOB_STORE = BlobStore()
+
+
+def _file_dict_from_refs(refs: dict[str, Any]) -> FileDict:
+    file_dict = FileDict()
+    # the views sharing `refs` when they were pickled share it again after loading
+    file_dict._refs = refs
+    file_dict._shared = True
+    return file_dict
+
+
+class FileDict(MutableMapping[str, Any]):
+    """
+    A copy-on-write view of the files of a workspace: file name -> content.
+    The text contents are stored in `WORKSPACE_BLOB_STORE`; the other values are kept in the view as they are.
+    """
+
+    def __init__(self, files: Mapping[str, Any] | None = None) -> None:
+        # file name -> the key of the blob, or (value,) for the values which are not text
+        self._refs: dict[str, str | tuple[Any]] = {}
+        self._shared = False
+        if files:
+            self.update(files)
+
+    def _own(self) -> None:
+        if self._shared:
+            self._refs = dict(self._refs)
+            self._shared = False
+
+    def __getitem__(self, name: str) -> Any:
+        ref = self._refs[name]
+        return ref[0] if isinstance(ref, tuple) else WORKSPACE_BLOB_STORE.get(ref)
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        self._own()
+        self._refs[name] = WORKSPACE_BLOB_STORE.put(value) if isinstance(value, str) else (value,)
+
+    def __delitem__(self, name: str) -> None:
+        self._own()
+        del self._refs[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._refs)
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._refs
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def key(self, name: str) -> str | None:
+        """The blob key of the file (None if its content is not text); equal keys mean equal contents"""
+        ref = self._refs[name]
+        return None if isinstance(ref, tuple) else ref
+
+    def copy(self) -> FileDict:
+        """A copy sharing the view until either side is modified"""
+        file_dict = FileDict()
+        file_dict._refs = self._refs
+        file_dict._shared = self._shared = True
+        return file_dict
+
+    def __copy__(self) -> FileDict:
+        return self.copy()
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> FileDict:
+        # the text contents are immutable, sharing them is a deep copy
+        file_dict = self.copy()
+        if any(isinstance(ref, tuple) for ref in self._refs.values()):
+            file_dict._refs = {
+                name: deepcopy(ref, memo) if isinstance(ref, tuple) else ref for name, ref in self._refs.items()
+            }
+            file_dict._shared = False
+        return file_dict
+
+    def __reduce__(self) -> tuple:
+        if WORKSPACE_BLOB_STORE._persist([ref for ref in self._refs.values() if not isinstance(ref, tuple)]):
+            return (_file_dict_from_refs, (self._refs,))
+        return (FileDict, (dict(self),))
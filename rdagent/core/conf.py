@@ -3,8 +3,9 @@ from __future__ import annotations
 from __future__ import annotations
 
 # TODO: use pydantic for other modules in Qlib
+import weakref
 from pathlib import Path
-from typing import cast
+from typing import Any, Literal, cast
 
 from pydantic_settings import (
     BaseSettings,
@@ -13,8 +14,24 @@ from pydantic_settings import (
 )
 
 
+# the live settings instances (e.g. the module level singletons like `RD_AGENT_SETTINGS`) by their id
+_SETTINGS_INSTANCES: weakref.WeakValueDictionary[int, ExtendedBaseSettings] = weakref.WeakValueDictionary()
+
+
+def registered_settings() -> dict[int, ExtendedBaseSettings]:
+    """
+    The live settings instances by their id; the ids of the instances created before a fork are the same in the
+    forked processes.
+    """
+    return dict(_SETTINGS_INSTANCES.items())
+
+
 class ExtendedBaseSettings(BaseSettings):
 
+    def model_post_init(self, context: Any) -> None:
+        super().model_post_init(context)
+        _SETTINGS_INSTANCES[id(self)] = self
+
     @classmethod
     def settings_customise_sources(
         cls,
@@ -63,9 +80,19 @@ class RDAgentSettings(ExtendedBaseSettings):
 
     # workspace conf
     workspace_path: Path = Path.cwd() / "git_ignore_folder" / "RD-Agent_workspace"
+    workspace_blob_memory_chars: int = 500_000_000
+    """
+    The total length of the workspace file contents kept in memory. Beyond it, the least recently used contents are
+    dropped and read again from the folders they are saved to (the unsaved ones are spilled to a temporary folder).
+    """
 
     # multi processing conf
     multi_proc_n: int = 1
+    multi_proc_backend: Literal["process", "thread", "async"] = "process"
+    """
+    The backend of the persistent workers behind `multiprocessing_wrapper`.
+    The threads (or the async tasks) are much cheaper than the processes for the LLM-bound fan-out.
+    """
 
     # pickle cache conf
     cache_with_pickle: bool = True  # whether to use pickle cache
@@ -77,6 +104,22 @@ class RDAgentSettings(ExtendedBaseSettings):
         # executing the function multiple times
     )
 
+    # session conf
+    session_checkpoint_compact_interval: int = 20
+    """
+    The session snapshots only save the history appended since the former snapshot, and every so many snapshots
+    save the whole history again (0 to always save the whole history)
+    """
+
+    max_parallel_loops: int = 1
+    """
+    The number of loops of a workflow in flight at the same time; their steps overlap (e.g. the proposal of a loop
+    runs while the former loop is running its experiment). 1 runs the loops one by one.
+    """
+
+    enable_profiling: bool = True
+    """Record the timing spans of the sessions (the steps, the LLM calls, the runs ...) into `profile.json`"""
+
     # misc
     """The limitation of context stdout"""
     stdout_context_len: int = 400
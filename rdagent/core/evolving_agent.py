@@ -11,6 +11,7 @@ if TYPE_CHECKING:
 
 from rdagent.core.evaluation import EvaluableObj, Evaluator, Feedback
 from rdagent.core.evolving_framework import EvolvingStrategy, EvoStep
+from rdagent.core.profiling import PROFILER
 from rdagent.log import rdagent_logger as logger
 
 ASpecificEvaluator = TypeVar("ASpecificEvaluator", bound=Evaluator)
@@ -72,19 +73,22 @@ class RAGEvoAgent(EvoAgent[RAGEvaluator]):
             with logger.tag(f"evo_loop_{evo_loop_id}"):
                 # 1. knowledge self-evolving
                 if self.knowledge_self_gen and self.rag is not None and hasattr(self.rag,"generate_knowledge") :
-                    self.rag.generate_knowledge(self.evolving_trace)
+                    with PROFILER.span("generate_knowledge", cat="costeer"):
+                        self.rag.generate_knowledge(self.evolving_trace)
                 # 2. RAG
                 queried_knowledge = None
                 if self.with_knowledge and self.rag is not None:
                     # TODO: Putting the evolving trace in here doesn't actually work
-                    queried_knowledge = self.rag.query(evo, self.evolving_trace)
+                    with PROFILER.span("query_knowledge", cat="costeer"):
+                        queried_knowledge = self.rag.query(evo, self.evolving_trace)
 
                 # 3. evolve
-                evo = self.evolving_strategy.evolve(
-                    evo=evo,
-                    evolving_trace=self.evolving_trace,
-                    queried_knowledge=queried_knowledge,
-                )
+                with PROFILER.span("evolve", cat="costeer"):
+                    evo = self.evolving_strategy.evolve(
+                        evo=evo,
+                        evolving_trace=self.evolving_trace,
+                        queried_knowledge=queried_knowledge,
+                    )
 
                 # 4. Pack evolve results
                 es = EvoStep(evo, queried_knowledge)
@@ -94,7 +98,8 @@ class RAGEvoAgent(EvoAgent[RAGEvaluator]):
                     if isinstance(eva, Feedback):
                         es.feedback = eva
                     else:
-                        es.feedback = cast(RAGEvaluator, eva).evaluate(evo, queried_knowledge=queried_knowledge)
+                        with PROFILER.span("evaluate", cat="costeer"):
+                            es.feedback = cast(RAGEvaluator, eva).evaluate(evo, queried_knowledge=queried_knowledge)
 
                     logger.log_object(es.feedback, tag="evolving feedback")
 
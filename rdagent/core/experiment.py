@@ -7,13 +7,15 @@ import shutil
 import typing
 import uuid
 from abc import ABC, abstractmethod
-from collections.abc import Sequence
+from collections.abc import Iterable, Sequence
 from copy import deepcopy
 from pathlib import Path
 from typing import Any, Generic, TypeVar
 
+from rdagent.core.blob_store import FileDict
 from rdagent.core.conf import RD_AGENT_SETTINGS
 from rdagent.core.evaluation import Feedback
+from rdagent.core.profiling import PROFILER
 from rdagent.utils import filter_redundant_text
 from rdagent.utils.fmt import shrink_text
 
@@ -122,10 +124,22 @@ class FBWorkspace(Workspace):
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
-        self.file_dict: dict[str, Any] = (
-            {}
+        self.file_dict: FileDict = (
+            FileDict()
         )  # The code injected into the folder, store them in the variable to reproduce the former result
         self.workspace_path: Path = RD_AGENT_SETTINGS.workspace_path / uuid.uuid4().hex
+        self._injected: dict[str, tuple[str | None, int, int, int, int]] = {}
+        """
+        the path of the injected files -> (the blob key of the content, mtime_ns, size, inode, ctime_ns) after writing
+        them; it is not shared with the copies, which write the same files
+        """
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # the workspaces pickled by older versions hold plain dicts
+        if not isinstance(state.get("file_dict"), FileDict):
+            state["file_dict"] = FileDict(state.get("file_dict"))
+        state.setdefault("_injected", {})
+        self.__dict__.update(state)
 
     @staticmethod
     def _format_code_dict(code_dict: dict[str, str]) -> str:
@@ -165,6 +179,7 @@ class FBWorkspace(Workspace):
         self.workspace_path.mkdir(parents=True, exist_ok=True)
 
     @staticmethod
+    @PROFILER.profiled("link_data", cat="workspace")
     def link_all_files_in_folder_to_workspace(data_path: Path, workspace_path: Path) -> None:
         data_path = Path(data_path).absolute()  # in case of relative path that will be invalid when we change cwd.
         workspace_path = Path(workspace_path)
@@ -188,18 +203,54 @@ class FBWorkspace(Workspace):
             <file name2>: "__DEL__"  // indicate removing file name2. When we want to replace a file to a new one,
                           we usually use this
         }
+
+        The files are injected as a batch: their folders are scanned once, and a file is only written if its content
+        changed since it was injected last time or the file was changed on the disk. So injecting the same files
+        again (e.g. before every execution) writes nothing and keeps the mtime of the files.
         """
         self.prepare()
+        on_disk = self._stat_files(files)
         for k, v in files.items():
             target_file_path = self.workspace_path / k  # Define target_file_path before using it
             if v == self.DEL_KEY:
                 if target_file_path.exists():
                     target_file_path.unlink()
                 self.file_dict.pop(k, None)
+                self._injected.pop(str(target_file_path), None)
             else:  # Use self.DEL_KEY to access the class variable
-                self.file_dict[k] = v
+                if k not in self.file_dict or self.file_dict[k] is not v:  # skip hashing the content it holds
+                    self.file_dict[k] = v
+                key = self.file_dict.key(k)
+                if key is not None and k in on_disk and self._injected.get(str(target_file_path)) == (key, *on_disk[k]):
+                    continue
                 target_file_path.parent.mkdir(parents=True, exist_ok=True)
                 target_file_path.write_text(v)
+                st = target_file_path.stat()
+                self._injected[str(target_file_path)] = (key, *self._stat_record(st))
+
+    @staticmethod
+    def _stat_record(st: os.stat_result) -> tuple[int, int, int, int]:
+        return st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns
+
+    def _stat_files(self, names: Iterable[str]) -> dict[str, tuple[int, int, int, int]]:
+        """
+        (mtime_ns, size, inode, ctime_ns) of the existing files among `names`; each of their folders is scanned once
+        """
+        folders: dict[Path, dict[str, str]] = {}
+        for name in names:
+            path = self.workspace_path / name
+            folders.setdefault(path.parent, {})[path.name] = name
+        result = {}
+        for folder, names_in_folder in folders.items():
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        name = names_in_folder.get(entry.name)
+                        if name is not None and entry.is_file():
+                            result[name] = self._stat_record(entry.stat())
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return result
 
     def get_files(self) -> list[Path]:
         """
@@ -214,30 +265,38 @@ class FBWorkspace(Workspace):
         """
         Load the workspace from the folder
         """
+        files = {}
         for file_path in folder_path.rglob("*"):
             if file_path.suffix in (".py", ".yaml", ".md"):
                 relative_path = file_path.relative_to(folder_path)
-                self.inject_files(**{str(relative_path): file_path.read_text()})
+                files[str(relative_path)] = file_path.read_text()
+        self.inject_files(**files)
 
     def inject_code_from_file_dict(self, workspace: FBWorkspace) -> None:
         """
         Load the workspace from the file_dict
         """
-        for name, code in workspace.file_dict.items():
-            self.inject_files(**{name: code})
+        self.inject_files(**workspace.file_dict)
 
     def copy(self) -> FBWorkspace:
         """
         copy the workspace from the original one
+
+        The `file_dict` is copy-on-write, so the file contents are shared instead of being duplicated.
+        The copy writes all its files on its first injection: it shares the `workspace_path` of the original, whose
+        writes within the granularity of the mtime would not be noticed by the record of the injected files.
         """
-        return deepcopy(self)
+        workspace = deepcopy(self)
+        workspace._injected = {}
+        return workspace
 
     def clear(self) -> None:
         """
         Clear the workspace
         """
         shutil.rmtree(self.workspace_path, ignore_errors=True)
-        self.file_dict = {}
+        self.file_dict = FileDict()
+        self._injected = {}
 
     def before_execute(self) -> None:
         """
@@ -262,13 +321,15 @@ class FBWorkspace(Workspace):
         self.prepare()
         self.inject_files(**self.file_dict)
         stdout, return_code = env.run_ret_code(entry, str(self.workspace_path), env={"PYTHONPATH": "./"})
-        return (
-            shrink_text(
-                filter_redundant_text(stdout),
-                context_lines=RD_AGENT_SETTINGS.stdout_context_len,
-                line_len=RD_AGENT_SETTINGS.stdout_line_len,
-            ),
-            return_code,
+        return self.shrink_stdout(stdout), return_code
+
+    @staticmethod
+    def shrink_stdout(stdout: str) -> str:
+        """Remove the redundant text (e.g. progress bars) and the middle part of a long stdout"""
+        return shrink_text(
+            filter_redundant_text(stdout),
+            context_lines=RD_AGENT_SETTINGS.stdout_context_len,
+            line_len=RD_AGENT_SETTINGS.stdout_line_len,
         )
 
     def __str__(self) -> str:
@@ -1,28 +1,98 @@
-from pathlib import Path
+from __future__ import annotations
 
-import pickle  
+import os
+import pickle
+from pathlib import Path
+from typing import Any, TypeVar
 
 from rdagent.log import rdagent_logger as logger
 
+KB = TypeVar("KB", bound="KnowledgeBase")
+
 
 class KnowledgeBase:
+    """
+    The knowledge base is persisted in one of the two formats, decided by the `path`:
+
+    - a path ending with `SEGMENTED_SUFFIX` (opt-in): the segmented format, a directory. The subclasses may save
+      their large parts (e.g. the nodes of a graph) as append-only segments, so the later dumps only write what is
+      new. The rest of the state is pickled into `state.pkl` of the directory.
+    - any other path (the default): the whole `__dict__` is pickled into the file.
+    """
+
+    SEGMENTED_SUFFIX = ".segments"
+
+    # the attributes saved by `dump_segments` of the subclasses instead of `state.pkl`
+    segment_excluded_attributes: tuple[str, ...] = ()
+
     def __init__(self, path: str | Path | None = None) -> None:
         self.path = Path(path) if path else None
         self.load()
 
+    @classmethod
+    def is_segmented_path(cls, path: Path) -> bool:
+        return path.suffix == cls.SEGMENTED_SUFFIX
+
     def load(self) -> None:
         if self.path is not None and self.path.exists():
+            if self.is_segmented_path(self.path):
+                self.load_segments(self.path)
+                return
             with self.path.open("rb") as f:
                 loaded = pickle.load(f)
-                if isinstance(loaded, dict):                    
+                if isinstance(loaded, dict):
                     loaded_data = {k: v for k, v in loaded.items() if k != "path"}
-                else:                   
+                else:
                     loaded_data = {k: v for k, v in loaded.__dict__.items() if k != "path"}
                 self.__dict__.update(loaded_data)
 
     def dump(self) -> None:
         if self.path is not None:
+            if self.is_segmented_path(self.path):
+                self.dump_segments(self.path)
+                return
             self.path.parent.mkdir(parents=True, exist_ok=True)
             pickle.dump(self.__dict__, self.path.open("wb"))
         else:
             logger.warning("KnowledgeBase path is not set, dump failed.")
+
+    def dump_segments(self, path: Path) -> None:
+        """
+        Save the knowledge base into the segmented directory `path`.
+        The subclasses override it to save their large parts incrementally (and call the super method).
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        excluded = {"path", *self.segment_excluded_attributes}
+        state = {k: v for k, v in self.__dict__.items() if k not in excluded}
+        tmp_path = path / "state.pkl.tmp"
+        with tmp_path.open("wb") as f:
+            pickler = pickle.Pickler(f)
+            pickler.persistent_id = self.persistent_id  # type: ignore[method-assign]
+            pickler.dump(state)
+        os.replace(tmp_path, path / "state.pkl")  # a crash never leaves a broken file
+
+    def load_segments(self, path: Path) -> None:
+        state_path = path / "state.pkl"
+        if state_path.exists():
+            with state_path.open("rb") as f:
+                unpickler = pickle.Unpickler(f)
+                unpickler.persistent_load = self.persistent_load  # type: ignore[method-assign]
+                self.__dict__.update(unpickler.load())
+
+    def persistent_id(self, obj: Any) -> Any:
+        """
+        The objects saved in the segments (e.g. the nodes of a graph) are referred to by their ids in `state.pkl`
+        instead of being pickled again.
+        """
+        return None
+
+    def persistent_load(self, pid: Any) -> Any:
+        raise pickle.UnpicklingError(f"Unknown persistent id {pid}")
+
+    @classmethod
+    def from_segments(cls: type[KB], path: str | Path) -> KB:
+        """Load a knowledge base saved by `dump_segments` without running `__init__`"""
+        kb = cls.__new__(cls)
+        kb.path = None
+        kb.load_segments(Path(path))
+        return kb
@@ -0,0 +1,200 @@
+"""
+Hierarchical timing spans of a workflow session.
+
+`PROFILER.span(name, cat=...)` records how long the code in it takes, nested under the enclosing span of the same
+context (the loop step -> the coder -> the LLM calls ...). The spans are kept in memory and appended by `flush` to
+`PROFILER.output_path` in the Chrome trace event format (the JSON array format, whose closing `]` is optional), so the
+file of a session can be opened with `chrome://tracing` or https://ui.perfetto.dev, or summarized by `summarize`.
+
+The spans of the worker processes are appended to the same file after every task.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from rdagent.core.conf import RD_AGENT_SETTINGS
+
+PROFILE_FILE_NAME = "profile.json"
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "children_ns")
+
+    def __init__(self, name: str, cat: str, args: dict[str, Any]) -> None:
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.children_ns = 0  # the time spent in the child spans
+
+
+class Profiler:
+    # the events are dropped from the oldest if they are never flushed (e.g. no session is running)
+    MAX_BUFFERED_EVENTS = 100_000
+
+    def __init__(self) -> None:
+        self.output_path: Path | None = None
+        self._events: deque[dict[str, Any]] = deque(maxlen=self.MAX_BUFFERED_EVENTS)
+        self._lock = threading.Lock()
+        self._current: contextvars.ContextVar[_Span | None] = contextvars.ContextVar("profile_span", default=None)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork_in_child)
+
+    def _after_fork_in_child(self) -> None:
+        # the spans of the parent are flushed by the parent
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=self.MAX_BUFFERED_EVENTS)
+
+    def set_output(self, path: str | Path | None) -> None:
+        """The file that `flush` appends the spans to"""
+        self.output_path = None if path is None else Path(path)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "", **args: Any) -> Generator[None, None, None]:
+        """
+        Record the time spent in the context as a span named `name` of category `cat` with the extra `args`;
+        the args can be added later by `annotate`.
+        """
+        if not RD_AGENT_SETTINGS.enable_profiling:
+            yield
+            return
+        parent = self._current.get()
+        span = _Span(name, cat, args)
+        token = self._current.set(span)
+        ts = time.time_ns() // 1000
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            dur = time.perf_counter_ns() - start
+            try:
+                self._current.reset(token)
+            except ValueError:  # the context is left in another context (e.g. a generator resumed elsewhere)
+                self._current.set(parent)
+            if parent is not None:
+                parent.children_ns += dur
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": ts,
+                "dur": dur // 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                # the children of a span may run in parallel (e.g. in threads), so the self time is clipped at 0
+                "args": {**span.args, "self_dur": max(dur - span.children_ns, 0) // 1000},
+            }
+            if parent is not None:
+                event["args"]["parent"] = parent.name
+            with self._lock:
+                self._events.append(event)
+
+    def annotate(self, **args: Any) -> None:
+        """Add `args` to the current span (e.g. whether the cache is hit, which is known in the middle of it)"""
+        span = self._current.get()
+        if span is not None:
+            span.args.update(args)
+
+    def profiled(self, name: str | None = None, cat: str = "") -> Callable[[Callable], Callable]:
+        """Decorator version of `span`; the span is named after the function by default"""
+
+        def decorator(func: Callable) -> Callable:
+            span_name = func.__qualname__ if name is None else name
+
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.span(span_name, cat=cat):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def flush(self) -> None:
+        """Append the recorded spans to `output_path` (they are kept until there is one)"""
+        if self.output_path is None:
+            return
+        with self._lock:
+            events, self._events = self._events, deque(maxlen=self.MAX_BUFFERED_EVENTS)
+        if not events:
+            return
+        try:
+            self.output_path.parent.mkdir(parents=True, exist_ok=True)
+            lines = "".join(json.dumps(event, default=str) + ",\n" for event in events)
+            # a single write with O_APPEND, so the processes sharing the file do not interleave their events
+            fd = os.open(self.output_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    lines = "[\n" + lines
+                os.write(fd, lines.encode("utf-8"))
+            finally:
+                os.close(fd)
+        except OSError:
+            with self._lock:
+                self._events.extendleft(reversed(events))
+
+
+PROFILER = Profiler()
+
+
+def load_trace(path: str | Path) -> list[dict[str, Any]]:
+    """Load the events of a trace file written by `Profiler.flush` (or any Chrome trace file)"""
+    text = Path(path).read_text(encoding="utf-8").strip()
+    if text.startswith("{"):
+        return json.loads(text).get("traceEvents", [])
+    events = []
+    for line in text.lstrip("[").rstrip("]").splitlines():
+        line = line.strip().rstrip(",")
+        if line:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:  # a crash may leave the last line half written
+                continue
+    return events
+
+
+def summarize(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Aggregate the complete events by (category, name), sorted by the self time (the time not spent in the child spans).
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        the rows with the keys: cat, name, count, total_s, self_s, mean_s, max_s, and hit_rate if the spans are
+        annotated with `cache_hit`.
+    """
+    rows: dict[tuple[str, str], dict[str, Any]] = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        args = event.get("args", {})
+        cat = event.get("cat", "")
+        row = rows.setdefault(
+            (cat, event["name"]),
+            {"cat": cat, "name": event["name"], "count": 0, "total_s": 0.0, "self_s": 0.0, "max_s": 0.0},
+        )
+        dur = event.get("dur", 0) / 1e6
+        row["count"] += 1
+        row["total_s"] += dur
+        row["self_s"] += args.get("self_dur", event.get("dur", 0)) / 1e6
+        row["max_s"] = max(row["max_s"], dur)
+        if "cache_hit" in args:
+            row["hits"] = row.get("hits", 0) + bool(args["cache_hit"])
+            row["lookups"] = row.get("lookups", 0) + 1
+    result = []
+    for row in rows.values():
+        row["mean_s"] = row["total_s"] / row["count"]
+        if "lookups" in row:
+            row["hit_rate"] = row.pop("hits") / row.pop("lookups")
+        result.append(row)
+    return sorted(result, key=lambda row: row["self_s"], reverse=True)
@@ -1,19 +1,34 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
 import functools
 import importlib
+import inspect
+import itertools
 import json
-import multiprocessing as mp
+import os
 import pickle
 import random
-from collections.abc import Callable
+import threading
+from collections.abc import Callable, Coroutine
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from typing import Any, ClassVar, NoReturn, cast
 
 from filelock import FileLock
 from fuzzywuzzy import fuzz  # type: ignore[import-untyped]
 
-from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.core.conf import RD_AGENT_SETTINGS, registered_settings
+from rdagent.core.profiling import PROFILER
 from rdagent.oai.llm_conf import LLM_SETTINGS
 
 
@@ -96,32 +111,277 @@ class CacheSeedGen:
     NOTE:
     - This seed is specifically for the cache and is different from a regular seed.
     - If the cache is removed, setting the same seed will not produce the same QA trace.
+    - The tasks of the thread and async backends of `multiprocessing_wrapper` share the global `random` state, so
+      they get their own seed sequences (bound to the context of the task) with `set_seed(seed, scoped=True)`.
     """
 
     def __init__(self) -> None:
+        self._scoped_rng: contextvars.ContextVar[random.Random | None] = contextvars.ContextVar(
+            "cache_seed_rng", default=None
+        )
         self.set_seed(LLM_SETTINGS.init_chat_cache_seed)
 
-    def set_seed(self, seed: int) -> None:
-        random.seed(seed)
+    def set_seed(self, seed: int, scoped: bool = False) -> None:
+        if scoped:
+            self._scoped_rng.set(random.Random(seed))  # noqa: S311
+        else:
+            random.seed(seed)
 
     def get_next_seed(self) -> int:
-        """generate next random int""" 
-        return random.randint(0, 10000)  # noqa: S311
+        """generate next random int"""
+        rng = self._scoped_rng.get()
+        if rng is None:
+            return random.randint(0, 10000)  # noqa: S311
+        return rng.randint(0, 10000)  # noqa: S311
 
 
 LLM_CACHE_SEED_GEN = CacheSeedGen()
 
+_WORKER_TASK_DONE_HOOKS: list[Callable[[], Any]] = []
+_IN_WORKER: contextvars.ContextVar[bool] = contextvars.ContextVar("in_worker", default=False)
 
-def _subprocess_wrapper(f: Callable, seed: int, args: list) -> Any:
+
+def register_worker_task_done_hook(hook: Callable[[], Any]) -> None:
+    """
+    Register a hook called by the worker processes after every task.
+    The workers of `multiprocessing_wrapper` are persistent, they do not exit (and run their finalizers) after the
+    tasks; so the states which must be visible to the parent (e.g. the pending LLM cache writes) are flushed by hooks.
+    """
+    _WORKER_TASK_DONE_HOOKS.append(hook)
+
+
+def _mark_worker_process() -> None:
+    _IN_WORKER.set(True)
+
+
+def _call(f: Callable, args: tuple) -> Any:
+    result = f(*args)
+    if inspect.isawaitable(result):
+        result = asyncio.run(cast("Coroutine", result))
+    return result
+
+
+def _caller_context() -> dict[str, Any]:
+    """
+    The states of the caller followed by the persistent worker processes in every task: the log tag (which the model
+    selection & the usage accounting are keyed on) and the values of all the settings instances (e.g.
+    `LITELLM_SETTINGS`, `DS_RD_SETTING`), which may be changed after the workers were forked.
+    """
+    from rdagent.log import rdagent_logger  # rdagent.log depends on this module
+
+    return {
+        "tag": rdagent_logger.current_tag,
+        "settings": {
+            key: (type(settings).__qualname__, {name: getattr(settings, name) for name in type(settings).model_fields})
+            for key, settings in registered_settings().items()
+        },
+    }
+
+
+def _apply_caller_context(context: dict[str, Any]) -> None:
+    from rdagent.log import rdagent_logger
+
+    rdagent_logger._tag = context["tag"]
+    # the instances created before the fork have the same ids in the workers;
+    # the ones created later by the caller are created again from the environment by the workers
+    local_settings = registered_settings()
+    for key, (cls_name, values) in context["settings"].items():
+        settings = local_settings.get(key)
+        if settings is None or type(settings).__qualname__ != cls_name:
+            continue
+        for name, value in values.items():
+            if getattr(settings, name) != value:
+                setattr(settings, name, value)
+
+
+def _subprocess_wrapper(
+    f: Callable, seed: int, args: list, profile_path: Path | None = None, context: dict[str, Any] | None = None
+) -> Any:
     """
     It is a function wrapper. To ensure the subprocess has a fixed start seed.
+    The spans of the task are appended to the profile of the parent (`profile_path`), and the task runs with the log
+    tag & the settings of the caller (`context`).
     """
 
     LLM_CACHE_SEED_GEN.set_seed(seed)
-    return f(*args)
+    PROFILER.set_output(profile_path)
+    if context is not None:
+        _apply_caller_context(context)
+    try:
+        return _call(f, tuple(args))
+    finally:
+        for hook in _WORKER_TASK_DONE_HOOKS:
+            hook()
+        PROFILER.flush()
+
+
+def _thread_wrapper(f: Callable, seed: int, args: tuple) -> Any:
+    """The same as `_subprocess_wrapper`; it runs in a copied context, so the seed does not leak to other tasks"""
+    _IN_WORKER.set(True)
+    LLM_CACHE_SEED_GEN.set_seed(seed, scoped=True)
+    return _call(f, args)
+
+
+async def _async_wrapper(f: Callable, seed: int, args: tuple, semaphore: asyncio.Semaphore) -> Any:
+    async with semaphore:
+        # every task runs in its own copy of the context
+        _IN_WORKER.set(True)
+        LLM_CACHE_SEED_GEN.set_seed(seed, scoped=True)
+        if inspect.iscoroutinefunction(f):
+            return await f(*args)
+        return await asyncio.to_thread(_call, f, args)
 
 
-def multiprocessing_wrapper(func_calls: list[tuple[Callable, tuple]], n: int) -> list:
+class ExecutorService:
+    """
+    The long-lived executors behind `multiprocessing_wrapper`; they are started lazily and reused by all the calls.
+
+    - process: a `ProcessPoolExecutor`. The workers are forked once; the log tag & the settings of the caller are
+      passed with every task, but they do not see the changes of the other global states made by the parent after
+      they are started; call `shutdown` to restart them after such changes.
+    - thread: a `ThreadPoolExecutor`. It is cheap and suits the LLM-bound fan-out.
+    - async: an event loop running in a background thread. The coroutine functions are awaited on the loop and the
+      other functions run in threads.
+
+    The executors are sized once for `max(RD_AGENT_SETTINGS.multi_proc_n, n)` workers, and every call keeps at most
+    its own `n` tasks in flight. A call needing more workers gets a larger executor; the former one is retired, and it
+    is shut down only after the calls still submitting to it are finished.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+        self._executors: dict[str, tuple[int, Executor]] = {}
+        self._users: dict[Executor, int] = {}  # the number of the calls using each executor
+        self._retired: set[Executor] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _reset_if_forked(self) -> None:
+        # the threads & the processes of the executors are not inherited by the forked processes
+        if self._pid != os.getpid():
+            self._executors, self._users, self._retired = {}, {}, set()
+            self._loop, self._pid = None, os.getpid()
+
+    def _acquire_executor(self, backend: str, n: int) -> Executor:
+        with self._lock:
+            self._reset_if_forked()
+            size, executor = self._executors.get(backend, (0, None))
+            if executor is None or size < n:
+                if executor is not None:
+                    self._retire(executor)
+                size = max(RD_AGENT_SETTINGS.multi_proc_n, n)
+                if backend == "process":
+                    executor = ProcessPoolExecutor(max_workers=size, initializer=_mark_worker_process)
+                else:
+                    executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"rdagent-{backend}")
+                self._executors[backend] = (size, executor)
+            self._users[executor] = self._users.get(executor, 0) + 1
+            return executor
+
+    def _release_executor(self, executor: Executor) -> None:
+        with self._lock:
+            if executor not in self._users:  # e.g. forgotten by a fork
+                return
+            self._users[executor] -= 1
+            if self._users[executor] == 0:
+                del self._users[executor]
+                if executor in self._retired:
+                    self._retired.discard(executor)
+                    executor.shutdown(wait=False)
+
+    def _retire(self, executor: Executor) -> None:
+        """Shut down `executor` once it is not in use (the lock is held by the caller)"""
+        if self._users.get(executor, 0) == 0:
+            executor.shutdown(wait=False)
+        else:
+            self._retired.add(executor)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            self._reset_if_forked()
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="rdagent-async", daemon=True).start()
+            return self._loop
+
+    def map(self, func_calls: list[tuple[Callable, tuple]], seeds: list[int], n: int, backend: str) -> list:
+        if backend == "async":
+            return self._map_async(func_calls, seeds, n)
+        executor = self._acquire_executor(backend, n)
+        try:
+            return self._map(executor, func_calls, seeds, n, backend)
+        finally:
+            self._release_executor(executor)
+
+    def _map(
+        self, executor: Executor, func_calls: list[tuple[Callable, tuple]], seeds: list[int], n: int, backend: str
+    ) -> list:
+        if backend == "process":
+            wrapper = _subprocess_wrapper
+        else:
+            wrapper = _thread_wrapper
+        # the context is the same for all the tasks of the call
+        context = _caller_context() if backend == "process" else None
+        futures: dict[Future, int] = {}
+        results: list[Any] = [None] * len(func_calls)
+        calls = iter(enumerate(zip(func_calls, seeds)))
+        try:
+            for i, ((f, args), seed) in itertools.islice(calls, n):
+                futures[self._submit(executor, wrapper, f, seed, args, context)] = i
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[futures.pop(future)] = future.result()
+                for i, ((f, args), seed) in itertools.islice(calls, len(done)):
+                    futures[self._submit(executor, wrapper, f, seed, args, context)] = i
+        except BaseException as e:
+            for future in futures:
+                future.cancel()
+            if isinstance(e, (KeyboardInterrupt, BrokenProcessPool)):
+                self.shutdown(backend)
+            raise
+        return results
+
+    @staticmethod
+    def _submit(
+        executor: Executor, wrapper: Callable, f: Callable, seed: int, args: tuple, context: dict[str, Any] | None
+    ) -> Future:
+        if isinstance(executor, ThreadPoolExecutor):
+            return executor.submit(contextvars.copy_context().run, wrapper, f, seed, args)
+        return executor.submit(wrapper, f, seed, args, PROFILER.output_path, context)
+
+    def _map_async(self, func_calls: list[tuple[Callable, tuple]], seeds: list[int], n: int) -> list:
+        async def gather() -> list:
+            semaphore = asyncio.Semaphore(n)
+            return await asyncio.gather(
+                *(_async_wrapper(f, seed, args, semaphore) for (f, args), seed in zip(func_calls, seeds))
+            )
+
+        future = asyncio.run_coroutine_threadsafe(gather(), self._get_loop())
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def shutdown(self, backend: str | None = None) -> None:
+        """Shut down the executors of `backend` (all the backends by default); they are restarted on demand"""
+        with self._lock:
+            self._reset_if_forked()
+            for name in [backend] if backend is not None else list(self._executors):
+                if name in self._executors:
+                    executor = self._executors.pop(name)[1]
+                    self._retired.discard(executor)
+                    executor.shutdown(wait=False, cancel_futures=True)
+            if backend in (None, "async") and self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+
+
+EXECUTOR_SERVICE = ExecutorService()
+
+
+def multiprocessing_wrapper(func_calls: list[tuple[Callable, tuple]], n: int, backend: str | None = None) -> list:
     """It will use multiprocessing to call the functions in func_calls with the given parameters.
     The results equals to `return  [f(*args) for f, args in func_calls]`
     It will not call multiprocessing if `n=1`
@@ -133,24 +393,25 @@ def multiprocessing_wrapper(func_calls: list[tuple[Callable, tuple]], n: int) ->
     Parameters
     ----------
     func_calls : List[Tuple[Callable, Tuple]]
-        the list of functions and their parameters
+        the list of functions and their parameters; the coroutine functions are awaited
     n : int
-        the number of subprocesses
+        the number of concurrent workers
+    backend : str | None
+        "process", "thread" or "async"; `RD_AGENT_SETTINGS.multi_proc_backend` by default
 
     Returns
     -------
     list
 
     """
-    if n == 1 or max(1, min(n, len(func_calls))) == 1:
-        return [f(*args) for f, args in func_calls]
+    # the nested calls from the workers run sequentially instead of waiting for the workers occupied by themselves.
+    if n == 1 or max(1, min(n, len(func_calls))) == 1 or _IN_WORKER.get():
+        return [_call(f, args) for f, args in func_calls]
 
-    with mp.Pool(processes=max(1, min(n, len(func_calls)))) as pool:
-        results = [
-            pool.apply_async(_subprocess_wrapper, args=(f, LLM_CACHE_SEED_GEN.get_next_seed(), args))
-            for f, args in func_calls
-        ] 
-        return [result.get() for result in results]
+    seeds = [LLM_CACHE_SEED_GEN.get_next_seed() for _ in func_calls]
+    return EXECUTOR_SERVICE.map(
+        func_calls, seeds, n=min(n, len(func_calls)), backend=backend or RD_AGENT_SETTINGS.multi_proc_backend
+    )
 
 
 def cache_with_pickle(hash_func: Callable, post_process_func: Callable | None = None, force: bool = False) -> Callable:
@@ -189,21 +450,25 @@ def cache_with_pickle(hash_func: Callable, post_process_func: Callable | None =
             cache_file = target_folder / f"{hash_key}.pkl"
             lock_file = target_folder / f"{hash_key}.lock"
 
-            if cache_file.exists():
-                with cache_file.open("rb") as f:
-                    cached_res = pickle.load(f)
-                return post_process_func(*args, cached_res=cached_res, **kwargs) if post_process_func else cached_res
-
-            if RD_AGENT_SETTINGS.use_file_lock:
-                with FileLock(lock_file):
+            cache_hit = cache_file.exists()
+            with PROFILER.span(func.__qualname__, cat="pickle_cache", cache_hit=cache_hit):
+                if cache_hit:
+                    with cache_file.open("rb") as f:
+                        cached_res = pickle.load(f)
+                    if post_process_func:
+                        return post_process_func(*args, cached_res=cached_res, **kwargs)
+                    return cached_res
+
+                if RD_AGENT_SETTINGS.use_file_lock:
+                    with FileLock(lock_file):
+                        result = func(*args, **kwargs)
+                else:
                     result = func(*args, **kwargs)
-            else:
-                result = func(*args, **kwargs)
 
-            with cache_file.open("wb") as f:
-                pickle.dump(result, f)
+                with cache_file.open("wb") as f:
+                    pickle.dump(result, f)
 
-            return result
+                return result
 
         return cache_wrapper
 
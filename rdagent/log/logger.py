@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import contextvars
 import json
 import os
 import pickle
@@ -26,6 +27,10 @@ from rdagent.core.utils import SingletonBaseClass
 from rdagent.log.storage import FileStorage
 from .utils import LogColors, get_caller_info
 
+# the tag is local to the context, so the threads & the coroutines (e.g. the concurrent loops) have their own tags
+_TAG: contextvars.ContextVar[str] = contextvars.ContextVar("rdagent_log_tag", default="")
+
+
 # add async support to avoid block
 class RDAgentLog(SingletonBaseClass):
     """
@@ -57,7 +62,19 @@ class RDAgentLog(SingletonBaseClass):
     #   logger = PipeLog()
     #   logger.info("<code>")
     #   feedback = logger.get_reps()
-    _tag: str = ""
+
+    @property
+    def _tag(self) -> str:
+        return _TAG.get()
+
+    @_tag.setter
+    def _tag(self, tag: str) -> None:
+        _TAG.set(tag)
+
+    @property
+    def current_tag(self) -> str:
+        """The tag of the current context (e.g. `Loop_0.coding.evo_loop_1`), set by `tag`"""
+        return self._tag
 
     def __init__(self, log_trace_path: Union[str, None] = RD_AGENT_SETTINGS.log_trace_path) -> None:
         if log_trace_path is None:
@@ -83,12 +100,12 @@ class RDAgentLog(SingletonBaseClass):
         if self._tag != "":
             tag = "." + tag
 
-        # TODO: It may result in error in mutithreading or co-routine
-        self._tag = self._tag + tag
+        prev_tag = self._tag
+        self._tag = prev_tag + tag
         try:
             yield
         finally:
-            self._tag = self._tag[: -len(tag)]
+            self._tag = prev_tag
 
     def get_pids(self) -> str:
         """
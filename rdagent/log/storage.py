@@ -5,6 +5,8 @@ from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Generator, Literal, Union, cast
 
+from rdagent.core.profiling import PROFILER
+
 from .base import Message, Storage
 
 LOG_LEVEL = Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
@@ -21,6 +23,7 @@ class FileStorage(Storage):
         self.path = Path(path)
         self.path.mkdir(parents=True, exist_ok=True)
 
+    @PROFILER.profiled(cat="storage")
     def log(
         self,
         obj: object,
@@ -11,6 +11,7 @@ import streamlit as st
 from streamlit import session_state as state
 
 from rdagent.app.data_science.loop import DataScienceRDLoop
+from rdagent.core.profiling import PROFILE_FILE_NAME, load_trace, summarize
 from rdagent.log.mle_summary import extract_mle_json, is_valid_session
 from rdagent.log.storage import FileStorage
 from rdagent.utils import remove_ansi_codes
@@ -62,6 +63,15 @@ def load_times(log_path: Path):
     return rd_times
 
 
+@st.cache_data(persist=True)
+def load_profile(log_path: Path):
+    """加载 profiling 的统计数据"""
+    profile_path = log_path / PROFILE_FILE_NAME
+    if not profile_path.exists():
+        return pd.DataFrame()
+    return pd.DataFrame(summarize(load_trace(profile_path)))
+
+
 @st.cache_data(persist=True)
 def load_data(log_path: Path):
     data = defaultdict(lambda: defaultdict(dict))
@@ -559,6 +569,12 @@ def summarize_data():
         time_stat_df = time_stat_df.map(lambda x: str(x).split(".")[0] if pd.notnull(x) else "0:00:00")
         st1.dataframe(time_stat_df)
 
+        # the hot paths recorded by the profiling spans
+        profile_df = load_profile(state.log_folder / state.log_path)
+        if not profile_df.empty:
+            st.markdown("### Profile (sorted by self time)")
+            st.dataframe(profile_df.set_index(["cat", "name"]).round(3))
+
 
 def stdout_win(loop_id: int):
     stdout = load_stdout(state.log_folder / f"{state.log_path}.stdout")
@@ -1,123 +1,408 @@
 from __future__ import annotations
 
 
+import asyncio
+import contextvars
+import functools
 import json
+import os
 import re
 import sqlite3
+import threading
 import time
 import uuid
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
-from pathlib import Path
-from typing import Any, Optional, cast
+from multiprocessing.util import Finalize
+from typing import Any, ClassVar, Optional, cast
 
+import numpy as np
 from pydantic import TypeAdapter
 
-from rdagent.core.utils import LLM_CACHE_SEED_GEN, SingletonBaseClass
+from rdagent.core.profiling import PROFILER
+from rdagent.core.utils import (
+    LLM_CACHE_SEED_GEN,
+    SingletonBaseClass,
+    register_worker_task_done_hook,
+)
 from rdagent.log import LogColors
 from rdagent.log import rdagent_logger as logger
 from rdagent.log.timer import RD_Agent_TIMER_wrapper
+from rdagent.oai.backend.rate_limit import (
+    CHAT_RATE_LIMITER,
+    EMBEDDING_RATE_LIMITER,
+    estimate_token_num,
+)
+from rdagent.oai.backend.retry import (
+    LLM_CIRCUIT_BREAKER,
+    RetryBudgetExceeded,
+    RetryState,
+)
 from rdagent.oai.llm_conf import LLM_SETTINGS
 from rdagent.utils import md5_hash
-from typing import Any, cast
-try:
-    import openai
 
-    openai_imported = True
-except ImportError:
-    openai_imported = False
+
+_ASYNC_EXECUTOR: tuple[int, ThreadPoolExecutor] | None = None
+
+
+async def run_in_thread(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Run the blocking `func` in the thread pool shared by the async request path.
+    The pool is sized by `LLM_SETTINGS.async_max_workers` instead of the (small) default executor of asyncio.
+    """
+    global _ASYNC_EXECUTOR
+    if _ASYNC_EXECUTOR is None or _ASYNC_EXECUTOR[0] != os.getpid():
+        # the threads of the executor are not inherited by the forked processes
+        _ASYNC_EXECUTOR = (os.getpid(), ThreadPoolExecutor(max_workers=LLM_SETTINGS.async_max_workers))
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _ASYNC_EXECUTOR[1], functools.partial(ctx.run, func, *args, **kwargs)
+    )
+
+
+class LRUCache:
+    """A thread-safe bounded in-memory LRU cache with hit/miss counters"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def reset_lock(self) -> None:
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
 
 
 class SQliteLazyCache(SingletonBaseClass):
+    """
+    A sqlite based cache for chat completions, embeddings and chat sessions.
+
+    It is designed to be shared by many threads and (forked) processes at the same time:
+    - The database runs in WAL mode, so readers never block the writer and vice versa.
+    - Every thread of every process owns its own connection (sqlite connections must not cross fork or threads).
+    - Writes are put into an in-process write queue and committed in groups (one transaction per group)
+      instead of one fsync per call. Pending writes are visible to the readers of the same process.
+
+    Embeddings are stored as float32 BLOBs. Rows written by older versions (JSON encoded float lists)
+    are still readable and are rewritten as BLOBs the first time they are read.
+
+    The recently used chat completions and embeddings are also kept in bounded in-memory LRU tiers
+    (`chat_lru` and `embedding_lru`), so the repeated requests of a process never touch the disk.
+
+    The chat sessions are stored in the append-only `message_log` table (one row per message), so a new turn
+    only writes the new messages. Sessions in the legacy `message_cache` table (one JSON blob per conversation)
+    are migrated when they are loaded.
+    """
+
+    # sqlite limits the number of host parameters of a statement (999 in older versions)
+    MAX_QUERY_PARAMS: ClassVar[int] = 900
+
+    TABLES: ClassVar[dict[str, tuple[tuple[str, ...], str]]] = {
+        # table name: (key columns, value column)
+        "chat_cache": (("md5_key",), "chat"),
+        "embedding_cache": (("md5_key",), "embedding"),
+        "message_cache": (("conversation_id",), "message"),
+        "message_log": (("conversation_id", "turn"), "message"),
+    }
+    COLUMN_TYPES: ClassVar[dict[str, str]] = {"turn": "INTEGER"}
+    """the types of the columns other than TEXT"""
+
     def __init__(self, cache_location: str) -> None:
         super().__init__()
+        if getattr(self, "_initialized", False):
+            # the singleton is constructed by every APIBackend; keep the connections and the write queue alive.
+            return
         self.cache_location = cache_location
-        db_file_exist = Path(cache_location).exists()
-        # TODO: sqlite3 does not support multiprocessing.
-        self.conn = sqlite3.connect(cache_location, timeout=20)
-        self.c = self.conn.cursor()
-        if not db_file_exist:
-            self.c.execute(
-                """
-                CREATE TABLE chat_cache (
-                    md5_key TEXT PRIMARY KEY,
-                    chat TEXT
-                )
-                """,
-            )
-            self.c.execute(
-                """
-                CREATE TABLE embedding_cache (
-                    md5_key TEXT PRIMARY KEY,
-                    embedding TEXT
-                )
-                """,
-            )
-            self.c.execute(
-                """
-                CREATE TABLE message_cache (
-                    conversation_id TEXT PRIMARY KEY,
-                    message TEXT
-                )
-                """,
-            )
-            self.conn.commit()
+        self.commit_batch_size = max(1, LLM_SETTINGS.prompt_cache_commit_batch_size)
+        self.commit_interval = LLM_SETTINGS.prompt_cache_commit_interval
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._pending: dict[str, dict[Any, Any]] = {table: {} for table in self.TABLES}
+        self._pending_count = 0
+        self._pending_since: float | None = None
+        self.chat_lru = LRUCache(maxsize=LLM_SETTINGS.prompt_cache_lru_size)
+        """keyed by `ChatCacheKey.front_key`; it is maintained by APIBackend, which builds the keys"""
+        self.embedding_lru = LRUCache(maxsize=LLM_SETTINGS.prompt_cache_lru_size)
+        """keyed by the content itself, so no hashing is needed on hits"""
 
-    def chat_get(self, key: str) -> str | None:
-        md5_key = md5_hash(key)
-        self.c.execute("SELECT chat FROM chat_cache WHERE md5_key=?", (md5_key,))
-        result = self.c.fetchone()
+        conn = self._get_conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for table, (key_cols, value_col) in self.TABLES.items():
+            columns = ", ".join(f"{col} {self.COLUMN_TYPES.get(col, 'TEXT')}" for col in (*key_cols, value_col))
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns}, PRIMARY KEY ({', '.join(key_cols)}))")
+        conn.commit()
+
+        # flush before forking so the children do not inherit (and write twice) the pending writes.
+        os.register_at_fork(before=self.flush, after_in_child=self._after_fork_in_child)
+        # the persistent workers of `multiprocessing_wrapper` commit the writes of every task before returning it.
+        register_worker_task_done_hook(self.flush)
+        self._finalizer_pid: int | None = None
+        self._initialized = True
+
+    def _after_fork_in_child(self) -> None:
+        # the lock may be held by another thread of the parent when forking.
+        self._write_lock = threading.Lock()
+        self.chat_lru.reset_lock()
+        self.embedding_lru.reset_lock()
+
+    def _register_finalizer(self) -> None:
+        """
+        Flush the pending writes when current process exits.
+        `multiprocessing` clears the finalizers inherited from the parent in its worker processes,
+        so the finalizer is registered once per process when the first write is queued.
+        """
+        if self._finalizer_pid != os.getpid():
+            Finalize(self, self.flush, exitpriority=10)
+            self._finalizer_pid = os.getpid()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """get the connection owned by current thread & process"""
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != pid:
+            conn = sqlite3.connect(self.cache_location, timeout=20, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL + NORMAL is safe against corruption and avoids fsync per commit
+            conn.execute("PRAGMA busy_timeout=20000")
+            self._local.conn, self._local.pid = conn, pid
+        return conn
+
+    def _get(self, table: str, key: str) -> Any:
+        with self._write_lock:
+            if key in self._pending[table]:
+                return self._pending[table][key]
+        self._maybe_flush()
+        (key_col,), value_col = self.TABLES[table]
+        result = self._get_conn().execute(f"SELECT {value_col} FROM {table} WHERE {key_col}=?", (key,)).fetchone()
         return None if result is None else result[0]
 
-    def embedding_get(self, key: str) -> list | dict | str | None:
-        md5_key = md5_hash(key)
-        self.c.execute("SELECT embedding FROM embedding_cache WHERE md5_key=?", (md5_key,))
-        result = self.c.fetchone()
-        return None if result is None else json.loads(result[0])
-
-    def chat_set(self, key: str, value: str):
-        md5_key = md5_hash(key)
-        self.c.execute(
-            "INSERT OR REPLACE INTO chat_cache (md5_key, chat) VALUES (?, ?)",
-            (md5_key, value),
-        )
-        self.conn.commit()        
-        return None
+    def _set(self, table: str, items: dict[Any, Any]) -> None:
+        """queue the writes; the keys of the tables with multiple key columns are tuples"""
+        self._register_finalizer()
+        with self._write_lock:
+            self._pending[table].update(items)
+            self._pending_count += len(items)
+            if self._pending_since is None:
+                self._pending_since = time.time()
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        if self._pending_count >= self.commit_batch_size or (
+            self._pending_since is not None and time.time() - self._pending_since >= self.commit_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Commit all the pending writes of current process in a single transaction."""
+        with self._write_lock:
+            if self._pending_count == 0:
+                return
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table, items in self._pending.items():
+                    if items:
+                        key_cols, value_col = self.TABLES[table]
+                        placeholders = ", ".join("?" * (len(key_cols) + 1))
+                        conn.executemany(
+                            f"INSERT OR REPLACE INTO {table} ({', '.join(key_cols)}, {value_col}) VALUES ({placeholders})",
+                            [(*key, value) if isinstance(key, tuple) else (key, value) for key, value in items.items()],
+                        )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._pending = {table: {} for table in self.TABLES}
+            self._pending_count = 0
+            self._pending_since = None
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """the hit/miss counters of the in-memory tiers"""
+        return {"chat": self.chat_lru.stats(), "embedding": self.embedding_lru.stats()}
+
+    def chat_get(self, key: str) -> str | None:
+        return cast("str | None", self._get("chat_cache", md5_hash(key)))
+
+    def _decode_embeddings(self, rows: dict[str, bytes | str]) -> dict[str, np.ndarray]:
+        """Decode the embedding rows and queue the rows in the legacy JSON format for migration"""
+        decoded, legacy = {}, {}
+        for md5_key, value in rows.items():
+            if isinstance(value, str):
+                decoded[md5_key] = np.asarray(json.loads(value), dtype=np.float32)
+                legacy[md5_key] = decoded[md5_key].tobytes()
+            else:
+                decoded[md5_key] = np.frombuffer(value, dtype=np.float32)
+        if legacy:
+            self._set("embedding_cache", legacy)
+        return decoded
+
+    def embedding_get(self, key: str) -> list[float] | None:
+        embeddings, mask = self.embedding_get_many([key])
+        return embeddings[0].tolist() if mask[0] else None
+
+    def embedding_get_many(self, keys: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Fetch the cached embeddings of a batch of contents with as few queries as possible.
+
+        Parameters
+        ----------
+        keys : list[str]
+            the contents to look up.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            - a float32 array of shape (number of hits, embedding dim) with the embeddings of the cached contents,
+              stacked in the order of `keys`.
+            - a boolean mask of shape (len(keys),) telling which of the `keys` are cached.
+        """
+        found: dict[str, np.ndarray] = {}
+        for key in keys:
+            if key not in found and (embedding := self.embedding_lru.get(key)) is not None:
+                found[key] = embedding
+        missing = {md5_hash(key): key for key in keys if key not in found}
+        if missing:
+            rows: dict[str, bytes | str] = {}
+            with self._write_lock:
+                pending = self._pending["embedding_cache"]
+                rows.update({k: pending[k] for k in missing if k in pending})
+            self._maybe_flush()
+            to_query = [k for k in missing if k not in rows]
+            conn = self._get_conn()
+            for i in range(0, len(to_query), self.MAX_QUERY_PARAMS):
+                batch = to_query[i : i + self.MAX_QUERY_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows.update(
+                    conn.execute(
+                        f"SELECT md5_key, embedding FROM embedding_cache WHERE md5_key IN ({placeholders})", batch
+                    ).fetchall()
+                )
+            for md5_key, embedding in self._decode_embeddings(rows).items():
+                found[missing[md5_key]] = embedding
+                self.embedding_lru.set(missing[md5_key], embedding)
+        mask = np.array([key in found for key in keys], dtype=bool)
+        if not mask.any():
+            return np.empty((0, 0), dtype=np.float32), mask
+        return np.stack([found[key] for key in keys if key in found]), mask
+
+    def chat_set(self, key: str, value: str) -> None:
+        self._set("chat_cache", {md5_hash(key): value})
 
     def embedding_set(self, content_to_embedding_dict: dict) -> None:
-        for key, value in content_to_embedding_dict.items():
-            md5_key = md5_hash(key)
-            self.c.execute(
-                "INSERT OR REPLACE INTO embedding_cache (md5_key, embedding) VALUES (?, ?)",
-                (md5_key, json.dumps(value)),
+        embeddings = {key: np.asarray(value, dtype=np.float32) for key, value in content_to_embedding_dict.items()}
+        for key, embedding in embeddings.items():
+            self.embedding_lru.set(key, embedding)
+        self._set("embedding_cache", {md5_hash(key): embedding.tobytes() for key, embedding in embeddings.items()})
+
+    def message_get(self, conversation_id: str, start_turn: int = 0) -> list[dict[str, Any]]:
+        """get the messages of the conversation from `start_turn` (the index of the message) on"""
+        with self._write_lock:
+            rows = {
+                key[1]: value
+                for key, value in self._pending["message_log"].items()
+                if key[0] == conversation_id and key[1] >= start_turn
+            }
+        self._maybe_flush()
+        rows.update(
+            self._get_conn().execute(
+                "SELECT turn, message FROM message_log WHERE conversation_id=? AND turn>=?", (conversation_id, start_turn)
             )
-        self.conn.commit()
+        )
+        if not rows and start_turn == 0:
+            legacy = self._get("message_cache", conversation_id)
+            if legacy is not None:
+                messages = cast(list[dict[str, Any]], json.loads(legacy))
+                self.message_append(conversation_id, 0, messages)
+                return messages
+        return [json.loads(rows[turn]) for turn in sorted(rows)]
 
-    def message_get(self, conversation_id: str) -> list[dict[str, Any]]:
-        self.c.execute("SELECT message FROM message_cache WHERE conversation_id=?", (conversation_id,))
-        result = self.c.fetchone()
-        return [] if result is None else cast(list[dict[str, Any]], json.loads(result[0]))
-
-    def message_set(self, conversation_id: str, message_value: list[dict[str, Any]]):
-        self.c.execute(
-            "INSERT OR REPLACE INTO message_cache (conversation_id, message) VALUES (?, ?)",
-            (conversation_id, json.dumps(message_value)),
+    def message_append(self, conversation_id: str, start_turn: int, messages: list[dict[str, Any]]) -> None:
+        """append the messages to the conversation; `start_turn` is the number of the existing messages"""
+        self._set(
+            "message_log",
+            {(conversation_id, start_turn + i): json.dumps(message) for i, message in enumerate(messages)},
         )
-        self.conn.commit()
-        return None
+
+    def message_delete(self, conversation_id: str) -> None:
+        with self._write_lock:
+            for table in ("message_log", "message_cache"):
+                for key in [k for k in self._pending[table] if (k[0] if isinstance(k, tuple) else k) == conversation_id]:
+                    del self._pending[table][key]
+                    self._pending_count -= 1
+        conn = self._get_conn()
+        conn.execute("DELETE FROM message_log WHERE conversation_id=?", (conversation_id,))
+        conn.execute("DELETE FROM message_cache WHERE conversation_id=?", (conversation_id,))
+
+    def message_set(self, conversation_id: str, message_value: list[dict[str, Any]]) -> None:
+        """replace the whole conversation"""
+        self.message_delete(conversation_id)
+        self.message_append(conversation_id, 0, message_value)
 
 
 class SessionChatHistoryCache(SingletonBaseClass):
     def __init__(self) -> None:
-        """load all history conversation json file from self.session_cache_location"""
+        """
+        The histories of the conversations are loaded lazily from the cache and kept in memory; only the latest used
+        `LLM_SETTINGS.session_history_cache_size` ones are kept (every message is written into the cache anyway).
+        """
         self.cache = SQliteLazyCache(cache_location=LLM_SETTINGS.prompt_cache_path)
+        if not hasattr(self, "_histories"):
+            self._histories: OrderedDict[str, list[dict[str, Any]]] = OrderedDict()
+            self._lock = threading.Lock()
+
+    def _load(self, conversation_id: str) -> list[dict[str, Any]]:
+        if conversation_id in self._histories:
+            self._histories.move_to_end(conversation_id)
+        else:
+            self._histories[conversation_id] = self.cache.message_get(conversation_id)
+            while len(self._histories) > max(1, LLM_SETTINGS.session_history_cache_size):
+                self._histories.popitem(last=False)
+        return self._histories[conversation_id]
 
     def message_get(self, conversation_id: str) -> list[dict[str, Any]]:
-        return self.cache.message_get(conversation_id)
+        with self._lock:
+            return list(self._load(conversation_id))
+
+    def message_append(self, conversation_id: str, messages: list[dict[str, Any]]) -> None:
+        """only the new messages are written into the cache"""
+        with self._lock:
+            history = self._load(conversation_id)
+            self.cache.message_append(conversation_id, len(history), messages)
+            history.extend(messages)
 
     def message_set(self, conversation_id: str, message_value: list[dict[str, Any]]) -> None:
-        self.cache.message_set(conversation_id, message_value)
+        with self._lock:
+            history = self._load(conversation_id)
+            if message_value[: len(history)] == history:
+                self.cache.message_append(conversation_id, len(history), message_value[len(history) :])
+            else:
+                self.cache.message_set(conversation_id, message_value)
+            self._histories[conversation_id] = list(message_value)
 
 
 class ChatSession:
@@ -126,18 +411,32 @@ class ChatSession:
         self.system_prompt = system_prompt if system_prompt is not None else LLM_SETTINGS.default_system_prompt
         self.api_backend = api_backend
 
-    def build_chat_completion_message(self, user_prompt: str) -> list[dict[str, Any]]:
+    def _build_new_messages(self, user_prompt: str) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """return the history messages and the new messages of this turn"""
         history_message = SessionChatHistoryCache().message_get(self.conversation_id)
-        messages = history_message
-        if not messages:
-            messages.append({"role": LLM_SETTINGS.system_prompt_role, "content": self.system_prompt})
-        messages.append(
+        new_messages = []
+        if not history_message:
+            new_messages.append({"role": LLM_SETTINGS.system_prompt_role, "content": self.system_prompt})
+        new_messages.append(
             {
                 "role": "user",  # type: ignore
                 "content": user_prompt,
             },
         )
-        return messages
+        return history_message, new_messages
+
+    @staticmethod
+    def _truncate(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """keep the system prompt and the latest `max_session_history_messages` messages"""
+        max_n = LLM_SETTINGS.max_session_history_messages
+        if max_n is None or len(messages) <= max_n + 1:
+            return messages
+        system = [m for m in messages[:1] if m["role"] == LLM_SETTINGS.system_prompt_role]
+        return system + messages[-max_n:]
+
+    def build_chat_completion_message(self, user_prompt: str) -> list[dict[str, Any]]:
+        history_message, new_messages = self._build_new_messages(user_prompt)
+        return self._truncate(history_message + new_messages)
 
     def build_chat_completion_message_and_calculate_token(self, user_prompt: str) -> Any:
         messages = self.build_chat_completion_message(user_prompt)
@@ -148,7 +447,8 @@ class ChatSession:
         this function is to build the session messages
         user prompt should always be provided
         """
-        messages = self.build_chat_completion_message(user_prompt)
+        history_message, new_messages = self._build_new_messages(user_prompt)
+        messages = self._truncate(history_message + new_messages)
 
         with logger.tag(f"session_{self.conversation_id}"):
             response: str = self.api_backend._try_create_chat_completion_or_embedding(  # noqa: SLF001
@@ -159,13 +459,13 @@ class ChatSession:
             )
             logger.log_object({"user": user_prompt, "resp": response}, tag="debug_llm")
 
-        messages.append(
+        new_messages.append(
             {
                 "role": "assistant",  # type: ignore
                 "content": response,
             },
         )
-        SessionChatHistoryCache().message_set(self.conversation_id, messages)
+        SessionChatHistoryCache().message_append(self.conversation_id, new_messages)
         return response
 
     def get_conversation_id(self) -> str:
@@ -176,6 +476,34 @@ class ChatSession:
         pass
 
 
+class ChatCacheKey:
+    """
+    The cache key of a chat completion request.
+
+    - `front_key` is a tuple of the message strings, used by the in-memory LRU tier. Hashing it is cheap because
+      python caches the hash of every str object, and comparing the tuples by equality makes it collision free.
+    - `input_content_json` is the key of the sqlite cache. The JSON serialization (and md5 hashing in the cache)
+      of the whole conversation only happens when the LRU tier misses.
+    """
+
+    def __init__(self, messages: list[dict[str, Any]], chat_cache_prefix: str, seed: Optional[int]) -> None:
+        self.messages = messages
+        self.chat_cache_prefix = chat_cache_prefix
+        self.seed = seed
+        self.front_key: Hashable | None
+        try:
+            self.front_key = (chat_cache_prefix, seed, tuple(tuple(m.items()) for m in messages))
+            hash(self.front_key)
+        except TypeError:  # e.g. multimodal contents are lists
+            self.front_key = None
+
+    @functools.cached_property
+    def input_content_json(self) -> str:
+        return (
+            self.chat_cache_prefix + json.dumps(self.messages) + f"<seed={self.seed}/>"
+        )  # FIXME this is a hack to make sure the cache represents the round index
+
+
 class APIBackend(ABC):
     """
     Abstract base class for LLM API backends
@@ -202,8 +530,6 @@ class APIBackend(ABC):
             self.cache_file_location = LLM_SETTINGS.prompt_cache_path
             self.cache = SQliteLazyCache(cache_location=self.cache_file_location)
 
-        self.retry_wait_seconds = LLM_SETTINGS.retry_wait_seconds
-
     def build_chat_session(
         self,
         conversation_id: str | None = None,
@@ -282,13 +608,14 @@ class APIBackend(ABC):
             shrink_multiple_break=shrink_multiple_break,
         )
 
-        resp = self._try_create_chat_completion_or_embedding(  # type: ignore[misc]
-            *args,
-            messages=messages,
-            chat_completion=True,
-            chat_cache_prefix=chat_cache_prefix,
-            **kwargs,
-        )
+        with PROFILER.span("chat_completion", cat="llm"):
+            resp = self._try_create_chat_completion_or_embedding(  # type: ignore[misc]
+                *args,
+                messages=messages,
+                chat_completion=True,
+                chat_cache_prefix=chat_cache_prefix,
+                **kwargs,
+            )
         if isinstance(resp, list):
             raise ValueError(f"The response of _try_create_chat_completion_or_embedding should be a string. {resp} resp ")
         logger.log_object({"system": system_prompt, "user": user_prompt, "resp": resp}, tag="debug_llm")
@@ -296,12 +623,13 @@ class APIBackend(ABC):
 
     def create_embedding(self, input_content: str | list[str], *args, **kwargs) -> list[float] | list[list[float]]:  # type: ignore[no-untyped-def]
         input_content_list = [input_content] if isinstance(input_content, str) else input_content
-        resp = self._try_create_chat_completion_or_embedding(  # type: ignore[misc]
-            input_content_list=input_content_list,
-            embedding=True,
-            *args,
-            **kwargs,
-        )
+        with PROFILER.span("embedding", cat="llm", n=len(input_content_list)):
+            resp = self._try_create_chat_completion_or_embedding(  # type: ignore[misc]
+                input_content_list=input_content_list,
+                embedding=True,
+                *args,
+                **kwargs,
+            )
         if isinstance(input_content, str):
             return resp[0]  # type: ignore[return-value]
         return resp  # type: ignore[return-value]
@@ -330,48 +658,71 @@ class APIBackend(ABC):
         **kwargs,
     ) -> str | list[list[float]]:
         assert not (chat_completion and embedding), "chat_completion and embedding cannot be True at the same time"
+        assert chat_completion or embedding, "one of chat_completion and embedding should be True"
         max_retry = LLM_SETTINGS.max_retry if LLM_SETTINGS.max_retry is not None else max_retry
-        timeout_count = 0
+        retry_state = RetryState()
         for i in range(max_retry):
+            time.sleep(LLM_CIRCUIT_BREAKER.wait_time())
             API_start_time = datetime.now()
             try:
                 if embedding:
-                    return self._create_embedding_with_cache(*args, **kwargs)
-                if chat_completion:
-                    return self._create_chat_completion_auto_continue(*args, **kwargs)
-            except Exception as e:  # noqa: BLE001
-                if hasattr(e, "message") and (
-                    "'messages' must contain the word 'json' in some form" in e.message
-                    or "\\'messages\\' must contain the word \\'json\\' in some form" in e.message
-                ):
-                    kwargs["add_json_in_prompt"] = True
-                elif hasattr(e, "message") and embedding and "maximum context length" in e.message:
-                    kwargs["input_content_list"] = [
-                        content[: len(content) // 2] for content in kwargs.get("input_content_list", [])
-                    ]
+                    resp = self._create_embedding_with_cache(*args, **kwargs)
                 else:
-                    if (
-                        openai_imported
-                        and isinstance(e, openai.APITimeoutError)
-                        or (
-                            isinstance(e, openai.APIError)
-                            and hasattr(e, "message")
-                            and "Your resource has been temporarily blocked because we detected behavior that may violate our content policy."
-                            in e.message
-                        )
-                    ):
-                        timeout_count += 1
-                        if timeout_count >= 3:
-                            logger.warning("Timeout error, please check your network connection.")
-                            raise e
-                    time.sleep(self.retry_wait_seconds)
-                    if RD_Agent_TIMER_wrapper.timer.started and not isinstance(e, json.decoder.JSONDecodeError):
-                        RD_Agent_TIMER_wrapper.timer.add_duration(datetime.now() - API_start_time)
+                    resp = self._create_chat_completion_auto_continue(*args, **kwargs)
+                retry_state.on_finish(success=True)
+                return resp
+            except Exception as e:  # noqa: BLE001
+                if not self._adjust_request_on_error(e, kwargs, embedding=embedding):
+                    time.sleep(self._get_retry_wait(retry_state, e))
+                    self._record_retry_duration(e, API_start_time)
                 logger.warning(str(e))
                 logger.warning(f"Retrying {i+1}th time...")
+        retry_state.on_finish(success=False)
         error_message = f"Failed to create chat completion after {max_retry} retries."
         raise RuntimeError(error_message)
 
+    @staticmethod
+    def _adjust_request_on_error(e: Exception, kwargs: dict[str, Any], *, embedding: bool) -> bool:
+        """
+        Fix the request (i.e. `kwargs`) in place according to the error.
+        Return False if the error can't be fixed by adjusting the request, so the caller should wait before retrying.
+        """
+        if hasattr(e, "message") and (
+            "'messages' must contain the word 'json' in some form" in e.message
+            or "\\'messages\\' must contain the word \\'json\\' in some form" in e.message
+        ):
+            kwargs["add_json_in_prompt"] = True
+            return True
+        if hasattr(e, "message") and embedding and "maximum context length" in e.message:
+            kwargs["input_content_list"] = [
+                content[: len(content) // 2] for content in kwargs.get("input_content_list", [])
+            ]
+            return True
+        return False
+
+    @staticmethod
+    def _get_retry_wait(retry_state: RetryState, e: Exception) -> float:
+        """get the seconds to wait before retrying; re-raise the error if its retry budget is used up"""
+        try:
+            return retry_state.on_error(e)
+        except RetryBudgetExceeded as budget_error:
+            logger.warning(f"{budget_error} Please check your network connection or the API quota.")
+            retry_state.on_finish(success=False)
+            raise e from budget_error
+
+    @staticmethod
+    def _record_retry_duration(e: Exception, api_start_time: datetime) -> None:
+        if RD_Agent_TIMER_wrapper.timer.started and not isinstance(e, json.decoder.JSONDecodeError):
+            RD_Agent_TIMER_wrapper.timer.add_duration(datetime.now() - api_start_time)
+
+    @staticmethod
+    def _add_json_in_prompt(messages: list[dict[str, Any]]) -> None:
+        for message in messages[::-1]:
+            message["content"] = message["content"] + "\nPlease respond in json format."
+            if message["role"] == LLM_SETTINGS.system_prompt_role:
+                # NOTE: assumption: systemprompt is always the first message
+                break
+
     def _create_chat_completion_add_json_in_prompt(
         self,
         messages: list[dict[str, Any]],
@@ -384,13 +735,49 @@ class APIBackend(ABC):
         add json related content in the prompt if add_json_in_prompt is True
         """
         if json_mode and add_json_in_prompt:
-            for message in messages[::-1]:
-                message["content"] = message["content"] + "\nPlease respond in json format."
-                if message["role"] == LLM_SETTINGS.system_prompt_role:
-                    # NOTE: assumption: systemprompt is always the first message
-                    break
+            self._add_json_in_prompt(messages)
         return self._create_chat_completion_inner_function(messages=messages, json_mode=json_mode, *args, **kwargs)  # type: ignore[misc]
 
+    def _get_chat_cache_key(
+        self, messages: list[dict[str, Any]], chat_cache_prefix: str, seed: Optional[int]
+    ) -> ChatCacheKey:
+        if seed is None and LLM_SETTINGS.use_auto_chat_cache_seed_gen:
+            seed = LLM_CACHE_SEED_GEN.get_next_seed()
+        return ChatCacheKey(messages, chat_cache_prefix, seed)
+
+    def _get_chat_cache(self, messages: list[dict[str, Any]], cache_key: ChatCacheKey) -> str | None:
+        if not self.use_chat_cache:
+            return None
+        cache_result = None if cache_key.front_key is None else self.cache.chat_lru.get(cache_key.front_key)
+        if cache_result is None:
+            cache_result = self.cache.chat_get(cache_key.input_content_json)
+            if cache_result is not None and cache_key.front_key is not None:
+                self.cache.chat_lru.set(cache_key.front_key, cache_result)
+        PROFILER.annotate(cache_hit=cache_result is not None)
+        if cache_result is not None and LLM_SETTINGS.log_llm_chat_content:
+            logger.info(self._build_log_messages(messages), tag="llm_messages")
+            logger.info(f"{LogColors.CYAN}Response:{cache_result}{LogColors.END}", tag="llm_messages")
+        return cache_result
+
+    def _finalize_chat_response(
+        self, all_response: str, cache_key: ChatCacheKey, json_mode: bool, json_target_type: Optional[str]
+    ) -> str:
+        """validate the complete response and dump it into the cache"""
+        if json_mode:
+            try:
+                json.loads(all_response)
+            except:
+                match = re.search(r"```json(.*)```", all_response, re.DOTALL)
+                all_response = match.groups()[0] if match else all_response
+                json.loads(all_response)
+        if json_target_type is not None:
+            TypeAdapter(json_target_type).validate_json(all_response)
+        if self.dump_chat_cache:
+            self.cache.chat_set(cache_key.input_content_json, all_response)
+            if cache_key.front_key is not None:
+                self.cache.chat_lru.set(cache_key.front_key, all_response)
+        return all_response
+
     def _create_chat_completion_auto_continue(
         self,
         messages: list[dict[str, Any]],
@@ -404,19 +791,10 @@ class APIBackend(ABC):
         """
         Call the chat completion function and automatically continue the conversation if the finish_reason is length.
         """
-        if seed is None and LLM_SETTINGS.use_auto_chat_cache_seed_gen:
-            seed = LLM_CACHE_SEED_GEN.get_next_seed()
-        input_content_json = json.dumps(messages)
-        input_content_json = (
-            chat_cache_prefix + input_content_json + f"<seed={seed}/>"
-        )  # FIXME this is a hack to make sure the cache represents the round index
-        if self.use_chat_cache:
-            cache_result = self.cache.chat_get(input_content_json)
-            if cache_result is not None:
-                if LLM_SETTINGS.log_llm_chat_content:
-                    logger.info(self._build_log_messages(messages), tag="llm_messages")
-                    logger.info(f"{LogColors.CYAN}Response:{cache_result}{LogColors.END}", tag="llm_messages")
-                return cache_result
+        cache_key = self._get_chat_cache_key(messages, chat_cache_prefix, seed)
+        cache_result = self._get_chat_cache(messages, cache_key)
+        if cache_result is not None:
+            return cache_result
 
         all_response = ""
         new_messages = deepcopy(messages)
@@ -424,49 +802,253 @@ class APIBackend(ABC):
         for _ in range(try_n):  # for some long code, 3 times may not enough for reasoning models
             if "json_mode" in kwargs:
                 del kwargs["json_mode"]
-            response, finish_reason = self._create_chat_completion_add_json_in_prompt(
-                new_messages, json_mode=json_mode, *args, **kwargs
-            )  # type: ignore[misc]
+            CHAT_RATE_LIMITER.acquire(estimate_token_num(new_messages))
+            with PROFILER.span("chat_request", cat="llm"):
+                response, finish_reason = self._create_chat_completion_add_json_in_prompt(
+                    new_messages, json_mode=json_mode, *args, **kwargs
+                )  # type: ignore[misc]
             all_response += response
             if finish_reason is None or finish_reason != "length":
-                if json_mode:
-                    try:
-                        json.loads(all_response)
-                    except:
-                        match = re.search(r"```json(.*)```", all_response, re.DOTALL)
-                        all_response = match.groups()[0] if match else all_response
-                        json.loads(all_response)
-                if json_target_type is not None:
-                    TypeAdapter(json_target_type).validate_json(all_response)
-                if self.dump_chat_cache:
-                    self.cache.chat_set(input_content_json, all_response)
-                return all_response
+                return self._finalize_chat_response(all_response, cache_key, json_mode, json_target_type)
             new_messages.append({"role": "assistant", "content": response})
         raise RuntimeError(f"Failed to continue the conversation after {try_n} retries.")
 
+    def _get_embedding_cache(self, input_content_list: list[str]) -> tuple[dict[str, list[float]], list[str]]:
+        """
+        Returns
+        -------
+        tuple[dict[str, list[float]], list[str]]
+            the cached embeddings and the contents missing in the cache.
+        """
+        if not self.use_embedding_cache:
+            return {}, input_content_list
+        content_to_embedding_dict = {}
+        filtered_input_content_list = []
+        cached_embeddings, cached_mask = self.cache.embedding_get_many(input_content_list)
+        cached_iter = iter(cached_embeddings.tolist())
+        for content, cached in zip(input_content_list, cached_mask):
+            if cached:
+                content_to_embedding_dict[content] = next(cached_iter)
+            else:
+                filtered_input_content_list.append(content)
+        return content_to_embedding_dict, filtered_input_content_list
+
+    def _set_embedding_cache(
+        self, content_to_embedding_dict: dict[str, list[float]], input_content_list: list[str], resp: list[list[float]]
+    ) -> None:
+        new_content_to_embedding_dict = dict(zip(input_content_list, resp))
+        content_to_embedding_dict.update(new_content_to_embedding_dict)
+        if self.dump_embedding_cache:
+            self.cache.embedding_set(new_content_to_embedding_dict)
+
+    @staticmethod
+    def _split_embedding_chunks(input_content_list: list[str]) -> list[list[str]]:
+        """
+        Split the contents into requests bounded by both the number of strings (`embedding_max_str_num`)
+        and the estimated number of tokens (`embedding_max_tokens_per_request`).
+        """
+        chunks: list[list[str]] = []
+        chunk: list[str] = []
+        chunk_tokens = 0
+        for content in input_content_list:
+            tokens = estimate_token_num(content)
+            if chunk and (
+                len(chunk) >= LLM_SETTINGS.embedding_max_str_num
+                or chunk_tokens + tokens > LLM_SETTINGS.embedding_max_tokens_per_request
+            ):
+                chunks.append(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(content)
+            chunk_tokens += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _create_embedding_chunk(self, chunk: list[str]) -> list[list[float]]:
+        EMBEDDING_RATE_LIMITER.acquire(estimate_token_num(chunk))
+        with PROFILER.span("embedding_request", cat="llm", n=len(chunk)):
+            return self._create_embedding_inner_function(input_content_list=chunk)
+
     def _create_embedding_with_cache(
         self, input_content_list: list[str], *args: Any, **kwargs: Any
     ) -> list[list[float]]:
-        content_to_embedding_dict = {}
-        filtered_input_content_list = []
-        if self.use_embedding_cache:
-            for content in input_content_list:
-                cache_result = self.cache.embedding_get(content)
-                if cache_result is not None:
-                    content_to_embedding_dict[content] = cache_result
+        """
+        The embedding pipeline:
+        deduplicate the contents -> look up the cache in bulk -> split the rest into chunks
+        -> request the chunks concurrently (within the rate limits) -> write the results into the cache in bulk
+        """
+        unique_content_list = list(dict.fromkeys(input_content_list))
+        content_to_embedding_dict, filtered_input_content_list = self._get_embedding_cache(unique_content_list)
+        if len(filtered_input_content_list) > 0:
+            chunks = self._split_embedding_chunks(filtered_input_content_list)
+            if len(chunks) == 1:
+                resp = self._create_embedding_chunk(chunks[0])
+            else:
+                with ThreadPoolExecutor(max_workers=min(len(chunks), LLM_SETTINGS.embedding_max_concurrency)) as pool:
+                    resp = [embedding for chunk_resp in pool.map(self._create_embedding_chunk, chunks) for embedding in chunk_resp]
+            self._set_embedding_cache(content_to_embedding_dict, filtered_input_content_list, resp)
+        return [content_to_embedding_dict[content] for content in input_content_list]  # type: ignore[misc]
+
+    # async request path
+    # - It mirrors the sync request path above (cache, retry, auto continue and json handling are shared).
+    # - The network calls are awaited, so one process can issue many concurrent requests;
+    #   they are throttled by the rate limiters shared with the sync path.
+    async def abuild_messages_and_create_chat_completion(  # type: ignore[no-untyped-def]
+        self,
+        user_prompt: str,
+        system_prompt: str | None = None,
+        former_messages: list | None = None,
+        chat_cache_prefix: str = "",
+        shrink_multiple_break: bool = False,
+        *args,
+        **kwargs,
+    ) -> str:
+        """The async version of `build_messages_and_create_chat_completion`"""
+        if former_messages is None:
+            former_messages = []
+        messages = self._build_messages(
+            user_prompt,
+            system_prompt,
+            former_messages,
+            shrink_multiple_break=shrink_multiple_break,
+        )
+
+        with PROFILER.span("chat_completion", cat="llm"):
+            resp = await self._atry_create_chat_completion_or_embedding(  # type: ignore[misc]
+                *args,
+                messages=messages,
+                chat_completion=True,
+                chat_cache_prefix=chat_cache_prefix,
+                **kwargs,
+            )
+        if isinstance(resp, list):
+            raise ValueError(f"The response of _atry_create_chat_completion_or_embedding should be a string. {resp} resp ")
+        logger.log_object({"system": system_prompt, "user": user_prompt, "resp": resp}, tag="debug_llm")
+        return resp
+
+    async def acreate_embedding(self, input_content: str | list[str], *args, **kwargs) -> list[float] | list[list[float]]:  # type: ignore[no-untyped-def]
+        """The async version of `create_embedding`"""
+        input_content_list = [input_content] if isinstance(input_content, str) else input_content
+        with PROFILER.span("embedding", cat="llm", n=len(input_content_list)):
+            resp = await self._atry_create_chat_completion_or_embedding(  # type: ignore[misc]
+                input_content_list=input_content_list,
+                embedding=True,
+                *args,
+                **kwargs,
+            )
+        if isinstance(input_content, str):
+            return resp[0]  # type: ignore[return-value]
+        return resp  # type: ignore[return-value]
+
+    async def _atry_create_chat_completion_or_embedding(  # type: ignore[no-untyped-def]
+        self,
+        max_retry: int = 10,
+        chat_completion: bool = False,
+        embedding: bool = False,
+        *args,
+        **kwargs,
+    ) -> str | list[list[float]]:
+        assert not (chat_completion and embedding), "chat_completion and embedding cannot be True at the same time"
+        assert chat_completion or embedding, "one of chat_completion and embedding should be True"
+        max_retry = LLM_SETTINGS.max_retry if LLM_SETTINGS.max_retry is not None else max_retry
+        retry_state = RetryState()
+        for i in range(max_retry):
+            await asyncio.sleep(LLM_CIRCUIT_BREAKER.wait_time())
+            API_start_time = datetime.now()
+            try:
+                if embedding:
+                    resp = await self._acreate_embedding_with_cache(*args, **kwargs)
                 else:
-                    filtered_input_content_list.append(content)
-        else:
-            filtered_input_content_list = input_content_list
+                    resp = await self._acreate_chat_completion_auto_continue(*args, **kwargs)
+                retry_state.on_finish(success=True)
+                return resp
+            except Exception as e:  # noqa: BLE001
+                if not self._adjust_request_on_error(e, kwargs, embedding=embedding):
+                    await asyncio.sleep(self._get_retry_wait(retry_state, e))
+                    self._record_retry_duration(e, API_start_time)
+                logger.warning(str(e))
+                logger.warning(f"Retrying {i+1}th time...")
+        retry_state.on_finish(success=False)
+        error_message = f"Failed to create chat completion after {max_retry} retries."
+        raise RuntimeError(error_message)
+
+    async def _acreate_chat_completion_auto_continue(
+        self,
+        messages: list[dict[str, Any]],
+        *args: Any,
+        json_mode: bool = False,
+        chat_cache_prefix: str = "",
+        seed: Optional[int] = None,
+        json_target_type: Optional[str] = None,
+        add_json_in_prompt: bool = False,
+        **kwargs: Any,
+    ) -> str:
+        cache_key = self._get_chat_cache_key(messages, chat_cache_prefix, seed)
+        cache_result = self._get_chat_cache(messages, cache_key)
+        if cache_result is not None:
+            return cache_result
 
+        all_response = ""
+        new_messages = deepcopy(messages)
+        if json_mode and add_json_in_prompt:
+            self._add_json_in_prompt(new_messages)
+        try_n = 6
+        for _ in range(try_n):
+            kwargs.pop("json_mode", None)
+            await CHAT_RATE_LIMITER.aacquire(estimate_token_num(new_messages))
+            with PROFILER.span("chat_request", cat="llm"):
+                response, finish_reason = await self._acreate_chat_completion_inner_function(
+                    new_messages, json_mode, *args, **kwargs
+                )
+            all_response += response
+            if finish_reason is None or finish_reason != "length":
+                return self._finalize_chat_response(all_response, cache_key, json_mode, json_target_type)
+            new_messages.append({"role": "assistant", "content": response})
+        raise RuntimeError(f"Failed to continue the conversation after {try_n} retries.")
+
+    async def _acreate_embedding_with_cache(
+        self, input_content_list: list[str], *args: Any, **kwargs: Any
+    ) -> list[list[float]]:
+        unique_content_list = list(dict.fromkeys(input_content_list))
+        content_to_embedding_dict, filtered_input_content_list = self._get_embedding_cache(unique_content_list)
         if len(filtered_input_content_list) > 0:
-            resp = self._create_embedding_inner_function(input_content_list=filtered_input_content_list)
-            for index, data in enumerate(resp):
-                content_to_embedding_dict[filtered_input_content_list[index]] = data
-            if self.dump_embedding_cache:
-                self.cache.embedding_set(content_to_embedding_dict)
+            semaphore = asyncio.Semaphore(LLM_SETTINGS.embedding_max_concurrency)
+
+            async def create_embedding_chunk(chunk: list[str]) -> list[list[float]]:
+                async with semaphore:
+                    await EMBEDDING_RATE_LIMITER.aacquire(estimate_token_num(chunk))
+                    with PROFILER.span("embedding_request", cat="llm", n=len(chunk)):
+                        return await self._acreate_embedding_inner_function(input_content_list=chunk)
+
+            chunk_resps = await asyncio.gather(
+                *[create_embedding_chunk(chunk) for chunk in self._split_embedding_chunks(filtered_input_content_list)]
+            )
+            resp = [embedding for chunk_resp in chunk_resps for embedding in chunk_resp]
+            self._set_embedding_cache(content_to_embedding_dict, filtered_input_content_list, resp)
         return [content_to_embedding_dict[content] for content in input_content_list]  # type: ignore[misc]
 
+    async def _acreate_embedding_inner_function(  # type: ignore[no-untyped-def]
+        self, input_content_list: list[str], *args, **kwargs
+    ) -> list[list[float]]:
+        """
+        Call the embedding function asynchronously.
+        By default, the sync version runs in a thread; backends with async clients should override it.
+        """
+        return await run_in_thread(self._create_embedding_inner_function, input_content_list, *args, **kwargs)
+
+    async def _acreate_chat_completion_inner_function(  # type: ignore[no-untyped-def]
+        self,
+        messages: list[dict[str, Any]],
+        json_mode: bool = False,
+        *args,
+        **kwargs,
+    ) -> tuple[str, str | None]:
+        """
+        Call the chat completion function asynchronously.
+        By default, the sync version runs in a thread; backends with async clients should override it.
+        """
+        return await run_in_thread(self._create_chat_completion_inner_function, messages, json_mode, *args, **kwargs)
+
     @abstractmethod
     def _calculate_token_from_messages(self, messages: list[dict[str, Any]]) -> int:
         """
@@ -263,25 +263,15 @@ class DeprecBackend(APIBackend):
     def _create_embedding_inner_function(  # type: ignore[no-untyped-def]
         self, input_content_list: list[str], *args, **kwargs
     ) -> list[list[float]]:  # noqa: ARG002
-        content_to_embedding_dict = {}
-        for sliced_filtered_input_content_list in [
-            input_content_list[i : i + LLM_SETTINGS.embedding_max_str_num]
-            for i in range(0, len(input_content_list), LLM_SETTINGS.embedding_max_str_num)
-        ]:
-            if self.embedding_use_azure:
-                response = self.embedding_client.embeddings.create(
-                    model=self.embedding_model,
-                    input=sliced_filtered_input_content_list,
-                )
-            else:
-                response = self.embedding_client.embeddings.create(
-                    model=self.embedding_model,
-                    input=sliced_filtered_input_content_list,
-                )
-            for index, data in enumerate(response.data):
-                content_to_embedding_dict[sliced_filtered_input_content_list[index]] = data.embedding
-
-        return [content_to_embedding_dict[content] for content in input_content_list]
+        """
+        Create the embeddings of the contents in one request.
+        The chunking & concurrency are handled by `APIBackend._create_embedding_with_cache`.
+        """
+        response = self.embedding_client.embeddings.create(
+            model=self.embedding_model,
+            input=input_content_list,
+        )
+        return [data.embedding for data in response.data]
 
     def _create_chat_completion_inner_function(  # type: ignore[no-untyped-def] # noqa: C901, PLR0912, PLR0915
         self,
@@ -1,9 +1,18 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from typing import Any, Literal, cast, List, Tuple, Dict
 
 from litellm import (
+    acompletion,
+    aembedding,
     completion,
-    completion_cost,
+    cost_per_token,
     embedding,
+    get_llm_provider,
+    get_supported_openai_params,
     supports_response_schema,
     token_counter,
 )
@@ -11,6 +20,7 @@ from litellm import (
 from rdagent.log import LogColors
 from rdagent.log import rdagent_logger as logger
 from rdagent.oai.backend.base import APIBackend
+from rdagent.oai.backend.usage import LLM_USAGE_LEDGER, UsageRecord
 from rdagent.oai.llm_conf import LLMSettings
 
 
@@ -20,12 +30,67 @@ class LiteLLMSettings(LLMSettings):
         env_prefix = "LITELLM_"
         """Use `LITELLM_` as prefix for environment variables"""
 
-    # Placeholder for LiteLLM specific settings, so far it's empty
+    enable_prompt_cache: bool = False
+    """
+    Make the most of the provider side prompt caching. For the providers which need explicit markers (e.g. Anthropic):
+    - the system messages (the stable prefix) are moved to the front of the messages;
+    - the end of the stable prefix (the system prompt and the conversation history) is marked with `cache_control`.
+    The other providers (e.g. OpenAI) cache the prefixes automatically, so their messages are sent as they are.
+    The cached token count is reported in the `token_cost` log.
+    """
 
 
 LITELLM_SETTINGS = LiteLLMSettings()
 logger.info(f"{LITELLM_SETTINGS}")
-ACC_COST = 0.0
+
+
+_TOKEN_COUNTS: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+_TOKEN_COUNTS_LOCK = threading.Lock()
+_TOKEN_COUNTS_MAX_SIZE = 1024
+
+
+def _count_text_tokens(model: str, text: str) -> int:
+    """
+    The token count of the text, memoized by the digest of the text (so the memo does not keep the long prompts
+    alive) for the latest `_TOKEN_COUNTS_MAX_SIZE` texts.
+    """
+    key = (model, hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest())
+    with _TOKEN_COUNTS_LOCK:
+        if key in _TOKEN_COUNTS:
+            _TOKEN_COUNTS.move_to_end(key)
+            return _TOKEN_COUNTS[key]
+    n_tokens = token_counter(model=model, text=text)
+    with _TOKEN_COUNTS_LOCK:
+        _TOKEN_COUNTS[key] = n_tokens
+        while len(_TOKEN_COUNTS) > _TOKEN_COUNTS_MAX_SIZE:
+            _TOKEN_COUNTS.popitem(last=False)
+    return n_tokens
+
+
+def count_message_tokens(model: str, messages: List[Dict[str, Any]]) -> int:
+    """
+    Count the tokens of the messages in the OpenAI chat format (every message is wrapped by 3 tokens and
+    every reply is primed with 3 tokens). The tokens of every string are memoized, so the stable system
+    prompts and the conversation history are only tokenized once.
+    """
+    num_tokens = 3
+    for message in messages:
+        num_tokens += 3
+        for key, value in message.items():
+            if isinstance(value, str):
+                num_tokens += _count_text_tokens(model, value)
+                if key == "name":
+                    num_tokens += 1
+    return num_tokens
+
+
+@functools.lru_cache(maxsize=128)
+def _supports_stream_usage(model: str) -> bool:
+    """whether the usage can be asked for in the last chunk of the streaming response"""
+    try:
+        return "stream_options" in (get_supported_openai_params(model=model) or [])
+    except Exception:  # noqa: BLE001 # unknown models
+        return False
 
 
 class LiteLLMAPIBackend(APIBackend):
@@ -38,10 +103,7 @@ class LiteLLMAPIBackend(APIBackend):
         """
         Calculate the token count from messages
         """
-        num_tokens = token_counter(
-            model=LITELLM_SETTINGS.chat_model,
-            messages=messages,
-        )
+        num_tokens = count_message_tokens(LITELLM_SETTINGS.chat_model, messages)
         logger.info(f"{LogColors.CYAN}Token count: {LogColors.END} {num_tokens}", tag="debug_litellm_token")
         return num_tokens
 
@@ -51,11 +113,8 @@ class LiteLLMAPIBackend(APIBackend):
         """ 
         Call the embedding function
         """
-        model_name = LITELLM_SETTINGS.embedding_model
-        logger.info(f"{LogColors.GREEN}Using emb model{LogColors.END} {model_name}", tag="debug_litellm_emb")
-        logger.info(f"Creating embedding for: {input_content_list}", tag="debug_litellm_emb")
         response = embedding(
-            model=model_name,
+            model=self._embedding_model(input_content_list),
             input=input_content_list,
             *args,
             **kwargs,
@@ -63,6 +122,26 @@ class LiteLLMAPIBackend(APIBackend):
         response_list = [data["embedding"] for data in response.data]
         return response_list
 
+    async def _acreate_embedding_inner_function(
+        self, input_content_list: List[str], *args: Any, **kwargs: Any
+    ) -> List[List[float]]:
+        """
+        Call the embedding function asynchronously
+        """
+        response = await aembedding(
+            model=self._embedding_model(input_content_list),
+            input=input_content_list,
+            *args,
+            **kwargs,
+        )
+        return [data["embedding"] for data in response.data]
+
+    def _embedding_model(self, input_content_list: List[str]) -> str:
+        model_name = LITELLM_SETTINGS.embedding_model
+        logger.info(f"{LogColors.GREEN}Using emb model{LogColors.END} {model_name}", tag="debug_litellm_emb")
+        logger.info(f"Creating embedding for: {input_content_list}", tag="debug_litellm_emb")
+        return model_name
+
     def _create_chat_completion_inner_function(
         self,
         messages: List[Dict[str, Any]],
@@ -73,11 +152,67 @@ class LiteLLMAPIBackend(APIBackend):
         """ 
         Call the chat completion function
         """
+        completion_kwargs = self._build_completion_kwargs(messages, json_mode, **kwargs)
+        start_time = time.monotonic()
+        response = completion(**completion_kwargs)
+        logger.info(f"{LogColors.GREEN}Using chat model{LogColors.END} {completion_kwargs['model']}", tag="llm_messages")
+
+        if LITELLM_SETTINGS.chat_stream:
+            logger.info(f"{LogColors.BLUE}assistant:{LogColors.END}", tag="llm_messages")
+            content = ""
+            finish_reason = None
+            usage = None
+            for message in response:
+                chunk, finish_reason = self._parse_stream_chunk(message, finish_reason)
+                content += chunk
+                usage = getattr(message, "usage", None) or usage
+            logger.info("\n", raw=True, tag="llm_messages")
+        else:
+            content, finish_reason = self._parse_response(response)
+            usage = getattr(response, "usage", None)
+        return self._log_cost(
+            completion_kwargs["model"], messages, content, finish_reason, usage, time.monotonic() - start_time
+        )
+
+    async def _acreate_chat_completion_inner_function(
+        self,
+        messages: List[Dict[str, Any]],
+        json_mode: bool = False,
+        *args,
+        **kwargs,
+    ) -> Tuple[str, str | None]:
+        """
+        Call the chat completion function asynchronously
+        """
+        completion_kwargs = self._build_completion_kwargs(messages, json_mode, **kwargs)
+        start_time = time.monotonic()
+        response = await acompletion(**completion_kwargs)
+        logger.info(f"{LogColors.GREEN}Using chat model{LogColors.END} {completion_kwargs['model']}", tag="llm_messages")
+
+        if LITELLM_SETTINGS.chat_stream:
+            # NOTE: the chunks of concurrent requests are not logged one by one to avoid interleaving.
+            content = ""
+            finish_reason = None
+            usage = None
+            async for message in response:
+                chunk, finish_reason = self._parse_stream_chunk(message, finish_reason, log=False)
+                content += chunk
+                usage = getattr(message, "usage", None) or usage
+            logger.info(f"{LogColors.BLUE}assistant:{LogColors.END}\n{content}", tag="llm_messages")
+        else:
+            content, finish_reason = self._parse_response(response)
+            usage = getattr(response, "usage", None)
+        return self._log_cost(
+            completion_kwargs["model"], messages, content, finish_reason, usage, time.monotonic() - start_time
+        )
+
+    def _build_completion_kwargs(
+        self, messages: List[Dict[str, Any]], json_mode: bool, **kwargs: Any
+    ) -> Dict[str, Any]:
         if json_mode and supports_response_schema(model=LITELLM_SETTINGS.chat_model):
             kwargs["response_format"] = {"type": "json_object"}
 
         logger.info(self._build_log_messages(messages), tag="llm_messages")
-        # Call LiteLLM completion
         model = LITELLM_SETTINGS.chat_model
         temperature = LITELLM_SETTINGS.chat_temperature
         max_tokens = LITELLM_SETTINGS.chat_max_tokens
@@ -97,7 +232,12 @@ class LiteLLMAPIBackend(APIBackend):
                         else:
                             reasoning_effort = None
                     break
-        response = completion(
+        if LITELLM_SETTINGS.enable_prompt_cache:
+            messages = self._prepare_prompt_cache_messages(messages, model)
+        if LITELLM_SETTINGS.chat_stream and _supports_stream_usage(model):
+            # the usage is only sent in the last chunk of the stream when it is asked for
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        return dict(
             model=model,
             messages=messages,
             stream=LITELLM_SETTINGS.chat_stream,
@@ -106,48 +246,123 @@ class LiteLLMAPIBackend(APIBackend):
             reasoning_effort=reasoning_effort,
             **kwargs,
         )
-        logger.info(f"{LogColors.GREEN}Using chat model{LogColors.END} {model}", tag="llm_messages")
 
-        if LITELLM_SETTINGS.chat_stream:
-            logger.info(f"{LogColors.BLUE}assistant:{LogColors.END}", tag="llm_messages")
-            content = ""
-            finish_reason = None
-            for message in response:
-                if message["choices"][0]["finish_reason"]:
-                    finish_reason = message["choices"][0]["finish_reason"]
-                if "content" in message["choices"][0]["delta"]:
-                    chunk = (
-                        message["choices"][0]["delta"]["content"] or ""
-                    )  # when finish_reason is "stop", content is None
-                    content += chunk
-                    logger.info(LogColors.CYAN + chunk + LogColors.END, raw=True, tag="llm_messages")
+    EXPLICIT_PROMPT_CACHE_PROVIDERS = ("anthropic", "bedrock", "vertex_ai")
+    """The providers only caching the prompt prefixes marked by `cache_control`"""
 
-            logger.info("\n", raw=True, tag="llm_messages")
+    def _prepare_prompt_cache_messages(self, messages: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+        """
+        Return the messages reordered (and marked) for the provider side prompt caching.
+        The original messages are not modified, so the logs and the local cache keys stay the same.
+        """
+        try:
+            provider = get_llm_provider(model)[1]
+        except Exception:  # noqa: BLE001 # unknown models
+            provider = ""
+        if provider not in self.EXPLICIT_PROMPT_CACHE_PROVIDERS and "claude" not in model:
+            # the providers caching the prefixes automatically (e.g. OpenAI) get the conversation as it is
+            return messages
+
+        # stable sort: the system messages first while the order of the conversation is kept
+        messages = sorted(messages, key=lambda m: m["role"] != LITELLM_SETTINGS.system_prompt_role)
+        # the breakpoints: the end of the system prompt and the end of the history (i.e. before the new prompt)
+        n_system = sum(m["role"] == LITELLM_SETTINGS.system_prompt_role for m in messages)
+        breakpoints = {n_system - 1, len(messages) - 2} - {-1}
+        marked_messages = []
+        for i, message in enumerate(messages):
+            if i in breakpoints and isinstance(message.get("content"), str):
+                message = {
+                    **message,
+                    "content": [
+                        {"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}
+                    ],
+                }
+            marked_messages.append(message)
+        return marked_messages
+
+    @staticmethod
+    def _get_cached_tokens(usage: Any) -> int:
+        """get the number of prompt tokens read from the provider side cache"""
+        if usage is None:
+            return 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None)
+        if cached_tokens is None:  # Anthropic style usage
+            cached_tokens = getattr(usage, "cache_read_input_tokens", None)
+        return int(cached_tokens or 0)
+
+    @staticmethod
+    def _parse_stream_chunk(message: Any, finish_reason: str | None, log: bool = True) -> Tuple[str, str | None]:
+        if not message["choices"]:  # e.g. the chunk only carrying the usage
+            return "", finish_reason
+        if message["choices"][0]["finish_reason"]:
+            finish_reason = message["choices"][0]["finish_reason"]
+        chunk = ""
+        if "content" in message["choices"][0]["delta"]:
+            chunk = message["choices"][0]["delta"]["content"] or ""  # when finish_reason is "stop", content is None
+            if log:
+                logger.info(LogColors.CYAN + chunk + LogColors.END, raw=True, tag="llm_messages")
+        return chunk, finish_reason
+
+    @staticmethod
+    def _parse_response(response: Any) -> Tuple[str, str | None]:
+        content = str(response.choices[0].message.content)
+        finish_reason = response.choices[0].finish_reason
+        finish_reason_str = (
+            f"({LogColors.RED}Finish reason: {finish_reason}{LogColors.END})"
+            if finish_reason and finish_reason != "stop"
+            else ""
+        )
+        logger.info(f"{LogColors.BLUE}assistant:{LogColors.END} {finish_reason_str}\n{content}", tag="llm_messages")
+        return content, finish_reason
+
+    def _log_cost(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        content: str,
+        finish_reason: str | None,
+        usage: Any = None,
+        latency: float = 0.0,
+    ) -> Tuple[str, str | None]:
+        """
+        Record the usage of the call into the ledger and the `token_cost` log.
+        The token counts returned by the provider are preferred; otherwise, the tokens are counted locally
+        (the prompt tokens are memoized).
+        """
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            prompt_tokens = int(usage.prompt_tokens)
+            completion_tokens = int(usage.completion_tokens or 0)
         else:
-            content = str(response.choices[0].message.content)
-            finish_reason = response.choices[0].finish_reason
-            finish_reason_str = (
-                f"({LogColors.RED}Finish reason: {finish_reason}{LogColors.END})"
-                if finish_reason and finish_reason != "stop"
-                else ""
-            )
-            logger.info(f"{LogColors.BLUE}assistant:{LogColors.END} {finish_reason_str}\n{content}", tag="llm_messages")
-
-        global ACC_COST
-        cost = completion_cost(model=model, messages=messages, completion=content)
-        ACC_COST += cost
+            prompt_tokens = count_message_tokens(model, messages)
+            completion_tokens = token_counter(model=model, text=content)
+        try:
+            cost = sum(cost_per_token(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+        except Exception:  # noqa: BLE001 # e.g. the price of the model is unknown
+            cost = 0.0
+        record = UsageRecord(
+            calls=1,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_prompt_tokens=self._get_cached_tokens(usage),
+            cost=cost,
+            latency=latency,
+        )
+        LLM_USAGE_LEDGER.record(logger.current_tag, record)
+        accumulated_cost = LLM_USAGE_LEDGER.total().cost
         logger.info(
-            f"Current Cost: ${float(cost):.10f}; Accumulated Cost: ${float(ACC_COST):.10f}; {finish_reason=}",
+            f"Current Cost: ${float(cost):.10f}; Accumulated Cost: ${float(accumulated_cost):.10f}; {finish_reason=}",
         )
-        prompt_tokens = token_counter(model=model, messages=messages)
-        completion_tokens = token_counter(model=model, text=content)
         logger.log_object(
             {
                 "model": model,
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
+                "prompt_tokens": record.prompt_tokens,
+                "completion_tokens": record.completion_tokens,
+                "cached_prompt_tokens": record.cached_prompt_tokens,
                 "cost": cost,
-                "accumulated_cost": ACC_COST,
+                "accumulated_cost": accumulated_cost,
+                "latency": latency,
+                "tag": logger.current_tag,
             },
             tag="token_cost",
         )
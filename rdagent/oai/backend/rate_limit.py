@@ -0,0 +1,84 @@
+"""
+Client side rate limiting of the LLM API calls.
+
+The limiters are shared by all the API backends (and all the threads & coroutines) of a process,
+so the concurrent requests issued by the sync and the async request paths are throttled together.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Any
+
+from rdagent.oai.llm_conf import LLM_SETTINGS
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at `limit_per_minute / 60` tokens per second.
+
+    The caller reserves tokens first and then waits for the returned duration. The bucket may go
+    into debt, so the waiting callers are served in the order of their reservations.
+    """
+
+    def __init__(self, limit_per_minute: float | None) -> None:
+        self.capacity = limit_per_minute
+        self.tokens = float(limit_per_minute or 0)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """Reserve `amount` tokens and return the seconds to wait before they are available"""
+        if not self.capacity:
+            return 0.0
+        rate = self.capacity / 60
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * rate)
+            self.updated_at = now
+            # a single request larger than the bucket would never be satisfied otherwise
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / rate
+
+
+class RateLimiter:
+    """Limit the requests per minute and the tokens per minute of an API"""
+
+    def __init__(self, rpm: int | None = None, tpm: int | None = None) -> None:
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+
+    def _reserve(self, tokens: int) -> float:
+        return max(self.request_bucket.reserve(1), self.token_bucket.reserve(tokens))
+
+    def acquire(self, tokens: int = 0) -> None:
+        """block current thread until the request is allowed"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """wait without blocking the event loop until the request is allowed"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def estimate_token_num(content: Any) -> int:
+    """
+    A cheap estimation of the token number (about 4 characters per token) for rate limiting.
+    Accurate tokenizers are too slow to run before every request.
+    """
+    if isinstance(content, str):
+        return len(content) // 4 + 1
+    if isinstance(content, dict):
+        return sum(estimate_token_num(v) for v in content.values())
+    if isinstance(content, (list, tuple)):
+        return sum(estimate_token_num(c) for c in content)
+    return 0
+
+
+CHAT_RATE_LIMITER = RateLimiter(rpm=LLM_SETTINGS.chat_rpm_limit, tpm=LLM_SETTINGS.chat_tpm_limit)
+EMBEDDING_RATE_LIMITER = RateLimiter(rpm=LLM_SETTINGS.embedding_rpm_limit, tpm=LLM_SETTINGS.embedding_tpm_limit)
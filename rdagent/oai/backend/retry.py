@@ -0,0 +1,213 @@
+"""
+Retry policy of the LLM API calls.
+
+- The errors are classified (rate limit, timeout, connection, server, other); each class has its own retry budget.
+- The waiting time grows exponentially with jitter; the `Retry-After` hint of the server wins when it is given.
+- A circuit breaker shared by all the backends of a process pauses every request after consecutive
+  transient failures, so concurrent callers do not keep hammering an endpoint which is down or throttling.
+- The statistics of the retries are logged to tune the throughput.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any
+
+from rdagent.log import rdagent_logger as logger
+from rdagent.oai.llm_conf import LLM_SETTINGS
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER = "server"
+OTHER = "other"
+
+TRANSIENT_ERROR_CLASSES = (RATE_LIMIT, TIMEOUT, CONNECTION, SERVER)
+"""The errors caused by the endpoint instead of the request; they trigger the backoff and the circuit breaker"""
+
+
+def classify_error(e: BaseException) -> str:
+    """
+    Classify the error by its status code & class name, so the exceptions of openai, litellm and
+    azure clients are handled in the same way without importing all of them.
+    """
+    if isinstance(e, json.decoder.JSONDecodeError):
+        return OTHER
+    status_code = getattr(e, "status_code", None)
+    name = type(e).__name__
+    message = str(getattr(e, "message", ""))
+    if status_code == 429 or "RateLimit" in name:
+        return RATE_LIMIT
+    if (
+        isinstance(e, TimeoutError)
+        or "Timeout" in name
+        # it looks like a content policy error, but it is temporary and behaves like a timeout
+        or "Your resource has been temporarily blocked because we detected behavior that may violate our content policy."
+        in message
+    ):
+        return TIMEOUT
+    if isinstance(e, ConnectionError) or "Connection" in name:
+        return CONNECTION
+    if (isinstance(status_code, int) and status_code >= 500) or name in (
+        "InternalServerError",
+        "ServiceUnavailableError",
+    ):
+        return SERVER
+    return OTHER
+
+
+def parse_retry_after(e: BaseException) -> float | None:
+    """Get the seconds to wait from the `Retry-After`(`-ms`) header of the error response"""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if headers is None:
+        return None
+    try:
+        if (retry_after_ms := headers.get("retry-after-ms")) is not None:
+            return max(0.0, float(retry_after_ms) / 1000)
+        if (retry_after := headers.get("retry-after")) is None:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            # HTTP-date format
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker shared by all the requests of the process.
+
+    - closed: requests go through.
+    - open: after `threshold` consecutive transient failures, requests wait until `cooldown` seconds passed.
+    - half open: after the cooldown, requests go through again; a success closes the circuit while
+      another failure opens it again immediately.
+    """
+
+    def __init__(self, threshold: int, cooldown: float) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """seconds to wait before the next request is allowed"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.threshold > 0 and self.consecutive_failures >= self.threshold:
+                if self.opened_at is None or time.monotonic() >= self.opened_at + self.cooldown:
+                    logger.warning(
+                        f"{self.consecutive_failures} consecutive LLM API failures, "
+                        f"pausing all the requests for {self.cooldown}s."
+                    )
+                    self.opened_at = time.monotonic()
+
+
+class RetryStats:
+    """process level statistics of the retries"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.retried_requests = 0
+        self.failed_requests = 0
+        self.errors: Counter[str] = Counter()
+        self.wait_seconds: defaultdict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, retry_state: RetryState, *, success: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.retried_requests += bool(retry_state.errors)
+            self.failed_requests += not success
+            self.errors.update(retry_state.errors)
+            for error_class, seconds in retry_state.wait_seconds.items():
+                self.wait_seconds[error_class] += seconds
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retried_requests": self.retried_requests,
+                "failed_requests": self.failed_requests,
+                "errors": dict(self.errors),
+                "wait_seconds": dict(self.wait_seconds),
+            }
+
+
+class RetryBudgetExceeded(Exception):  # noqa: N818
+    """The retry budget of an error class is used up"""
+
+
+class RetryState:
+    """The retry state of a single request"""
+
+    def __init__(self) -> None:
+        self.errors: Counter[str] = Counter()
+        self.wait_seconds: defaultdict[str, float] = defaultdict(float)
+
+    def on_error(self, e: BaseException) -> float:
+        """
+        Record the error and return the seconds to wait before the next attempt.
+
+        Raises
+        ------
+        RetryBudgetExceeded
+            if the budget of the error class is used up.
+        """
+        error_class = classify_error(e)
+        self.errors[error_class] += 1
+        n = self.errors[error_class]
+        if error_class in TRANSIENT_ERROR_CLASSES:
+            LLM_CIRCUIT_BREAKER.record_failure()
+        budget = LLM_SETTINGS.retry_budgets.get(error_class)
+        if budget is not None and n >= budget:
+            raise RetryBudgetExceeded(f"{n} {error_class} errors, retry budget ({budget}) is used up.")
+
+        if error_class in TRANSIENT_ERROR_CLASSES:
+            wait = min(LLM_SETTINGS.retry_max_wait_seconds, LLM_SETTINGS.retry_wait_seconds * 2 ** (n - 1))
+            wait = wait / 2 + random.uniform(0, wait / 2)  # noqa: S311 # equal jitter to spread the retries of concurrent requests
+            retry_after = parse_retry_after(e)
+            if retry_after is not None:
+                wait = min(LLM_SETTINGS.retry_max_wait_seconds, max(wait, retry_after))
+        else:
+            wait = LLM_SETTINGS.retry_wait_seconds
+        self.wait_seconds[error_class] += wait
+        return wait
+
+    def on_finish(self, *, success: bool) -> None:
+        """record a success to the circuit breaker and log the statistics when the request needed retries"""
+        if success:
+            LLM_CIRCUIT_BREAKER.record_success()
+        LLM_RETRY_STATS.record(self, success=success)
+        if self.errors:
+            logger.info(
+                f"LLM request {'succeeded' if success else 'failed'} after {sum(self.errors.values())} errors "
+                f"{dict(self.errors)}; waited {sum(self.wait_seconds.values()):.1f}s",
+                tag="llm_retry",
+            )
+            logger.log_object(LLM_RETRY_STATS.to_dict(), tag="llm_retry_stats")
+
+
+LLM_CIRCUIT_BREAKER = CircuitBreaker(
+    threshold=LLM_SETTINGS.circuit_breaker_threshold, cooldown=LLM_SETTINGS.circuit_breaker_cooldown_seconds
+)
+LLM_RETRY_STATS = RetryStats()
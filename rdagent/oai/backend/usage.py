@@ -0,0 +1,63 @@
+"""
+Accounting of the LLM usage (tokens, cost and latency).
+
+The usage is attributed to the logger tag of the call (e.g. `Loop_3.coding`), so the spend and the time
+of every loop step can be found in the ledger.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class UsageRecord:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    cost: float = 0.0
+    latency: float = 0.0
+    """the accumulated seconds spent waiting for the responses"""
+
+    def add(self, other: UsageRecord) -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_prompt_tokens += other.cached_prompt_tokens
+        self.cost += other.cost
+        self.latency += other.latency
+
+
+class UsageLedger:
+    """A thread-safe ledger of the LLM usage grouped by tag"""
+
+    def __init__(self) -> None:
+        self.records: defaultdict[str, UsageRecord] = defaultdict(UsageRecord)
+        self._lock = threading.Lock()
+
+    def record(self, tag: str, usage: UsageRecord) -> None:
+        with self._lock:
+            self.records[tag].add(usage)
+
+    def total(self, tag_prefix: str = "") -> UsageRecord:
+        """the usage of all the tags starting with `tag_prefix`"""
+        total = UsageRecord()
+        with self._lock:
+            for tag, usage in self.records.items():
+                if tag.startswith(tag_prefix):
+                    total.add(usage)
+        return total
+
+    def to_dict(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {tag: asdict(usage) for tag, usage in self.records.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.records.clear()
+
+
+LLM_USAGE_LEDGER = UsageLedger()
@@ -30,13 +30,45 @@ class LLMSettings(ExtendedBaseSettings):
     embedding_use_azure_token_provider: bool = False
     managed_identity_client_id: str | None = None
     max_retry: int = 10
-    retry_wait_seconds: int = 1
+    retry_wait_seconds: float = 1
+    """The base waiting time of the exponential backoff"""
+    retry_max_wait_seconds: float = 60
+    retry_budgets: Dict[str, int] = {"rate_limit": 10, "timeout": 3, "connection": 5, "server": 5}
+    """
+    The maximum number of errors of each class (rate_limit, timeout, connection, server, other) in one request.
+    The classes not listed are only limited by `max_retry`.
+    """
+    circuit_breaker_threshold: int = 5
+    """All the requests of the process are paused after so many consecutive transient failures (0 to disable)"""
+    circuit_breaker_cooldown_seconds: float = 30
+
+    # client side rate limits shared by all the requests of a process; None means unlimited
+    chat_rpm_limit: int | None = None
+    chat_tpm_limit: int | None = None
+    embedding_rpm_limit: int | None = None
+    embedding_tpm_limit: int | None = None
+    async_max_workers: int = 32
+    """The number of threads used by the async request path to run the backends without native async support"""
+
     dump_chat_cache: bool = False
     use_chat_cache: bool = False
     dump_embedding_cache: bool = False
     use_embedding_cache: bool = False
     prompt_cache_path: str = str(Path.cwd() / "prompt_cache.db")
+    prompt_cache_commit_batch_size: int = 32
+    """Pending cache writes are committed in one transaction once the write queue reaches this size"""
+    prompt_cache_commit_interval: float = 1.0
+    """Pending cache writes older than this many seconds are committed on the next cache access"""
+    prompt_cache_lru_size: int = 4096
+    """The number of chat completions (and embeddings) kept in the in-memory LRU tier of the cache (0 to disable)"""
     max_past_message_include: int = 10
+    max_session_history_messages: int | None = None
+    """Only send the system prompt and the latest messages of a chat session to the LLM (None to send all)"""
+    session_history_cache_size: int = 64
+    """
+    The number of the chat session histories kept in memory; the least recently used ones are read again from the
+    `message_log` table of the cache when they are needed
+    """
 
     # Behavior of returning answers to the same question when caching is enabled
     use_auto_chat_cache_seed_gen: bool = False
@@ -74,6 +106,10 @@ class LLMSettings(ExtendedBaseSettings):
     embedding_azure_api_base: str = ""
     embedding_azure_api_version: str = ""
     embedding_max_str_num: int = 50
+    embedding_max_tokens_per_request: int = 100000
+    """The contents are split into requests by both the number of strings and the (estimated) number of tokens"""
+    embedding_max_concurrency: int = 8
+    """The number of embedding requests sent concurrently"""
 
     # offline llama2 related config
     use_llama2: bool = False
@@ -83,26 +83,39 @@ class DSTrace(Trace[DataScienceScen, KnowledgeBase]):
         leaves = list(sorted(all_indices - parent_indices))
         return leaves
 
+    def resolve_selection(self, selection: tuple[int, ...] | None = None) -> tuple[int, ...]:
+        """
+        The parent of the node proposed on `selection` (the current selection by default) in the current hist;
+        -1 is resolved to the latest node, so the parent stays the same when other nodes are added to the hist.
+        () represents no parent (the root node of a new sub-trace).
+        """
+        if selection is None:
+            selection = self.get_current_selection()
+        if len(self.hist) == 0 or not selection:
+            return ()
+        if selection[0] == -1:
+            return (len(self.hist) - 1,)
+        return (selection[0],)
+
     def sync_dag_parent_and_hist(
         self,
+        selection: tuple[int, ...] | None = None,
     ) -> None:
         """
         Adding corresponding parent index to the dag_parent when the hist is going to be changed.
         Should be called when the hist is changed.
-        """
 
-        if len(self.hist) == 0 or len(self.get_current_selection()) == 0:
-            # the node we are going to add is the first node of hist / root node of a new sub-trace
-            self.dag_parent.append(())
-
-        else:
-            current_node_idx = self.current_selection[0]
-
-            if current_node_idx == -1:
-                # the current selection is the latest one
-                current_node_idx = len(self.hist) - 1
-
-            self.dag_parent.append((current_node_idx,))
+        Parameters
+        ----------
+        selection : tuple[int, ...] | None
+            The parent resolved (by `resolve_selection`) when the node was proposed; the current selection by default.
+            A parent out of the hist (e.g. the trace is restarted after the node was proposed) is ignored.
+        """
+        parent = self.resolve_selection(selection)
+        if len(parent) > 0 and parent[0] >= len(self.hist):
+            parent = ()
+        # () means the node we are going to add is the first node of hist / root node of a new sub-trace
+        self.dag_parent.append(parent)
 
     def retrieve_search_list(
         self,
@@ -67,35 +67,28 @@ class DSKnowledgeBase(UndirectedGraph):
         else:
             idea_list = idea
 
-        node_list = []
         add_pairs = []
         for one_idea in idea_list:
             idea_name = one_idea.idea
             idea_node = UndirectedNode(content=idea_name, label="IDEA", appendix=str(one_idea))
-            node_list.append(idea_node)
 
             competition = one_idea.competition
             if competition is not None:
                 competition_node = UndirectedNode(content=competition, label="competition")
-                node_list.append(competition_node)
                 add_pairs.append((idea_node, [competition_node]))
 
             data = one_idea.hypothesis.get("SCENARIO_PROBLEM", None)
             problem = one_idea.hypothesis.get("FEEDBACK_PROBLEM", None)
             if data is not None:
                 sp_node = UndirectedNode(content=data, label="SCENARIO_PROBLEM")
-                node_list.append(sp_node)
                 add_pairs.append((idea_node, [sp_node]))
             if problem is not None:
                 fp_node = UndirectedNode(content=problem, label="FEEDBACK_PROBLEM")
-                node_list.append(fp_node)
                 add_pairs.append((idea_node, [fp_node]))
-        self.batch_embedding(node_list)
-        for idea_node, neighbor_list in add_pairs:
-            self.add_nodes(idea_node, neighbor_list)
+        self.add_nodes_bulk(add_pairs)
 
     def build_idea_pool(self, idea_pool_json_path: str | Path):
-        if len(self.vector_base.vector_df) > 0:
+        if self.vector_base.shape()[0] > 0:
             logger.warning("Knowledge graph is not empty, please clear it first. Ignore reading from json file.")
             return
         else:
@@ -3,7 +3,6 @@ from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Union
 import typing
-import pandas as pd
 from jinja2 import Environment, StrictUndefined
 
 from rdagent.components.knowledge_management.vector_base import Document, PDVectorBase
@@ -159,7 +158,7 @@ class KaggleExperienceBase(PDVectorBase):
                     for trunk, trunk_embedding in zip(document.trunks, document.trunks_embedding)
                 ]
             )
-        self.vector_df = pd.concat([self.vector_df, pd.DataFrame(docs)], ignore_index=True)
+        self._pending_rows.extend(docs)
 
     def load_kaggle_experience(self, kaggle_experience_path: Union[str, Path]):
         """
@@ -2,7 +2,7 @@ import pickle
 from pathlib import Path
 from typing import List
 
-import pandas as pd, multiprocessing
+import pandas as pd
 from pandarallel import pandarallel
 
 from rdagent.components.coder.CoSTEER.evaluators import CoSTEERMultiFeedback
@@ -142,13 +142,14 @@ class QlibFactorRunner(CachedRunner[QlibFactorExperiment]):
                 # otherwise, it is developed with designed task. So it should have feedback.
                 assert isinstance(exp.prop_dev_feedback, CoSTEERMultiFeedback)
                 # Iterate over sub-implementations and execute them to get each factor data
-                message_and_df_list = multiprocessing.Pool(processes=RD_AGENT_SETTINGS.multi_proc_n).map(multiprocessing_wrapper,
+                message_and_df_list = multiprocessing_wrapper(
                     [
-                        (implementation.execute, ("All",)) if implementation and fb else None
+                        (implementation.execute, ("All",))
                         for implementation, fb in zip(exp.sub_workspace_list, exp.prop_dev_feedback)
-                    ] # only execute successfully feedback
+                        if implementation and fb
+                    ],  # only execute successfully feedback
+                    n=RD_AGENT_SETTINGS.multi_proc_n,
                 )
-                message_and_df_list = [item for item in message_and_df_list if item is not None]
                 for message, df in message_and_df_list:
                     # Check if factor generation was successful
                     if df is not None and "datetime" in df.index.names:
@@ -75,25 +75,35 @@ def remove_ansi_codes(s: str) -> str:
     return ansi_escape.sub("", s)
 
 
+# the progress bars of keras & tqdm
+PROGRESS_BAR_RE = re.compile(
+    r"(\d+/\d+\s+[━]+\s+\d+s?\s+\d+ms/step.*?\u0008+|"
+    r"\d+/\d+\s+[━]+\s+\d+s?\s+\d+ms/step|"
+    r"\d+/\d+\s+[━]+\s+\d+s?\s+\d+ms/step.*|"
+    r"\d+/\d+\s+[━]+.*?\u0008+|"
+    r"\d+/\d+\s+[━]+.*|[ ]*\u0008+|"
+    r"\d+%\|[█▏▎▍▌▋▊▉]+\s+\|\s+\d+/\d+\s+\[\d{2}:\d{2}<\d{2}:\d{2},\s+\d+\.\d+it/s\]|"
+    r"\d+%\|[█]+\|\s+\d+/\d+\s+\[\d{2}:\d{2}<\d{2}:\d{2},\s*\d+\.\d+it/s\])"
+)
+
+
+def remove_progress_bars(stdout: str) -> str:
+    """
+    Remove the ansi ctrl characters and the progress bars (the regex part of `filter_redundant_text`).
+    The patterns do not span lines, so it can be applied line by line.
+    """
+    if not any(mark in stdout for mark in ("\x1b", "\u0008", "━", "%|")):
+        return stdout  # every pattern needs one of the marks, and most of the lines have none
+    return PROGRESS_BAR_RE.sub("", remove_ansi_codes(stdout))
+
+
 def filter_redundant_text(stdout: str) -> str:
     """
     Filter out progress bars from stdout using regex.
     """
     from rdagent.oai.llm_utils import APIBackend  # avoid circular import
 
-    # Initial progress bar regex pattern
-    progress_bar_re = (
-        r"(\d+/\d+\s+[━]+\s+\d+s?\s+\d+ms/step.*?\u0008+|"
-        r"\d+/\d+\s+[━]+\s+\d+s?\s+\d+ms/step|"
-        r"\d+/\d+\s+[━]+\s+\d+s?\s+\d+ms/step.*|"
-        r"\d+/\d+\s+[━]+.*?\u0008+|"
-        r"\d+/\d+\s+[━]+.*|[ ]*\u0008+|"
-        r"\d+%\|[█▏▎▍▌▋▊▉]+\s+\|\s+\d+/\d+\s+\[\d{2}:\d{2}<\d{2}:\d{2},\s+\d+\.\d+it/s\]|"
-        r"\d+%\|[█]+\|\s+\d+/\d+\s+\[\d{2}:\d{2}<\d{2}:\d{2},\s*\d+\.\d+it/s\])"
-    )
-
-    filtered_stdout = remove_ansi_codes(stdout)
-    filtered_stdout = re.sub(progress_bar_re, "", filtered_stdout)
+    filtered_stdout = remove_progress_bars(stdout)
     filtered_stdout = re.sub(r"\s*\n\s*", "\n", filtered_stdout)
 
     needs_sub = True
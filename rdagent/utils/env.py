@@ -7,19 +7,24 @@ Tries to create uniform environment for the agent to run;
 
 # TODO: move the scenario specific docker env into other folders.
 
+import atexit
 import json
 import os
 import pickle
 import re
 import shutil
+import socket
 import subprocess
+import tempfile
+import threading
 import time
 import uuid
 import zipfile
 from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable
 from pathlib import Path
 from types import MappingProxyType
-from typing import Any, Generic, Mapping, Optional, TypeVar
+from typing import Any, ClassVar, Generic, Mapping, Optional, TypeVar
 
 import docker  # type: ignore[import-untyped]
 import docker.models  # type: ignore[import-untyped]
@@ -36,8 +41,11 @@ from tqdm import tqdm
 
 from rdagent.core.conf import ExtendedBaseSettings
 from rdagent.core.experiment import RD_AGENT_SETTINGS
+from rdagent.core.profiling import PROFILER
 from rdagent.log import rdagent_logger as logger
 from rdagent.oai.llm_utils import md5_hash
+from rdagent.utils.log_capture import LogCapture, prune_logs
+from rdagent.utils.run_cache import RunCache, scan
 from rdagent.utils.workflow import wait_retry
 
 
@@ -212,12 +220,13 @@ class Env(Generic[ASpecificEnvConf], ABC):
             + "exit $entry_exit_code'"
         )
 
-        if self.conf.enable_cache:
-            stdout, return_code = self.cached_run(entry_add_timeout, local_path, env, running_extra_volume)
-        else:
-            stdout, return_code = self.__run_ret_code_with_retry(
-                entry_add_timeout, local_path, env, running_extra_volume, remove_timestamp=False
-            )
+        with PROFILER.span("Env.run", cat="env", env=type(self).__name__):
+            if self.conf.enable_cache:
+                stdout, return_code = self.cached_run(entry_add_timeout, local_path, env, running_extra_volume)
+            else:
+                stdout, return_code = self.__run_ret_code_with_retry(
+                    entry_add_timeout, local_path, env, running_extra_volume, remove_timestamp=False
+                )
 
         return stdout, return_code
 
@@ -233,41 +242,31 @@ class Env(Generic[ASpecificEnvConf], ABC):
         Run the folder under the environment.
         Will cache the output and the folder diff for next round of running.
         Use the python codes and the parameters(entry, running_extra_volume) as key to hash the input.
+
+        The runs are cached as the files they change (see `rdagent.utils.run_cache`), and a hit only restores them.
         """
-        target_folder = Path(RD_AGENT_SETTINGS.pickle_cache_folder_path_str) / f"utils.env.run"
-        target_folder.mkdir(parents=True, exist_ok=True)
+        run_cache = RunCache(Path(RD_AGENT_SETTINGS.pickle_cache_folder_path_str) / "utils.env.run")
+        run_cache.folder.mkdir(parents=True, exist_ok=True)
 
+        # the digests of the unchanged files are memoized, so listing a workspace does not read them again
+        manifest = scan(local_path)
         # we must add the information of data (beyond code) into the key.
         # Otherwise, all commands operating on data will become invalid (e.g. rm -r submission.csv)
-        # So we recursively walk in the folder and add the sorted relative filename list as part of the key.
-        data_key = []
-        for path in Path(local_path).rglob("*"):
-            p = str(path.relative_to(Path(local_path)))
-            if p.startswith("__pycache__"):
-                continue
-            data_key.append(p)
-        data_key = sorted(data_key)
-
+        # So we add the sorted relative filename list as part of the key.
         key = md5_hash(
-            json.dumps(
-                [
-                    [str(path.relative_to(Path(local_path))), path.read_text()]
-                    for path in sorted(Path(local_path).rglob("*.py"))
-                ]
-            )
+            json.dumps([[name, digest] for name, (_, digest) in sorted(manifest.items()) if name.endswith(".py")])
             + json.dumps({"entry": entry, "running_extra_volume": dict(running_extra_volume)})
             + json.dumps({"extra_volumes": self.conf.extra_volumes})
-            + json.dumps(data_key)
+            + json.dumps(sorted(manifest))
         )
-        if Path(target_folder / f"{key}.pkl").exists() and Path(target_folder / f"{key}.zip").exists():
-            with open(target_folder / f"{key}.pkl", "rb") as f:
-                ret: tuple[str, int] = pickle.load(f)
-            self.unzip_a_file_into_a_folder(str(target_folder / f"{key}.zip"), local_path)
+        record = run_cache.load(key)
+        PROFILER.annotate(cache_hit=record is not None)
+        if record is not None:
+            ret: tuple[str, int] = record["ret"]
+            run_cache.restore(record, local_path)
         else:
             ret = self.__run_ret_code_with_retry(entry, local_path, env, running_extra_volume, remove_timestamp)
-            with open(target_folder / f"{key}.pkl", "wb") as f:
-                pickle.dump(ret, f)
-            self.zip_a_folder_into_a_file(local_path, str(target_folder / f"{key}.zip"))
+            run_cache.save(key, ret, local_path, manifest)
         return ret
 
     @abstractmethod
@@ -431,6 +430,19 @@ class DockerConf(EnvConf):
     retry_count: int = 5  # retry count for the docker run
     retry_wait_seconds: int = 10  # retry wait seconds for the docker run
 
+    # run the entries by `exec` in long-lived containers instead of starting a container per run (see `ContainerPool`)
+    container_pool: bool = False
+    container_pool_size: int = 4  # the max number of idle containers kept in the pool (of all the workspaces)
+    container_max_reuse: int = 50  # a container is replaced after running so many entries
+
+    # the capture of the logs of the runs (see `rdagent.utils.log_capture`)
+    log_folder: str | None = None  # the folder of the logs of the runs; a temporary folder per process by default
+    log_keep_files: int = 100  # only the latest log files are kept in the folder
+    log_max_bytes: int = 100 * 1024 * 1024  # a log file is rolled over beyond the size
+    log_head_lines: int = 1000  # the lines kept at the beginning of the returned logs
+    log_tail_lines: int = 1000  # the lines kept at the end of the returned logs; the middle part is only in the file
+    log_echo: bool = True  # print the logs to the console (the lines are dropped if the console falls behind)
+
 
 class QlibDockerConf(DockerConf):
     model_config = SettingsConfigDict(env_prefix="QLIB_DOCKER_")
@@ -518,10 +530,198 @@ class MLEBDockerConf(DockerConf):
     enable_cache: bool = False
 
 
+_DOCKER_CLIENTS: dict[int, docker.DockerClient] = {}  # type: ignore[no-any-unimported]
+
+
+def get_docker_client() -> docker.DockerClient:  # type: ignore[no-any-unimported]
+    """The docker client is created once per process (the connections are not shared with the forked processes)"""
+    pid = os.getpid()
+    if pid not in _DOCKER_CLIENTS:
+        _DOCKER_CLIENTS[pid] = docker.from_env()
+    return _DOCKER_CLIENTS[pid]
+
+
+class ContainerPoolUnavailable(Exception):
+    """The entries of a container configuration can not run in the pooled containers"""
+
+
+class ContainerPool:
+    """
+    The long-lived containers of `DockerEnv` (`DockerConf.container_pool`).
+
+    A pooled container runs an idle command with the same configuration (image, volumes, limits ...) as the one-shot
+    containers; the entries are run in it by `exec`, so the container startup is paid once per configuration
+    instead of once per run. The configuration includes the volume of the workspace, so every workspace gets its own
+    idle containers; the least recently used ones are removed beyond `DockerConf.container_pool_size`.
+
+    - Reset: the processes left by a run are killed after it; the files in the volumes are kept, like the one-shot
+      containers do. A container is replaced after `DockerConf.container_max_reuse` runs, so the changes outside the
+      volumes (e.g. in `/tmp`) do not pile up.
+    - Health check: an idle container is reused only if it is still running; the broken ones are removed.
+    - The configurations whose containers fail to stay up (e.g. the images without `sleep`) fall back to the
+      one-shot containers.
+    - The pooled containers are labelled with their owner process (`LABEL`), so the containers left by the crashed
+      processes on the same host are removed when a new process starts pooling.
+    """
+
+    IDLE_COMMAND = "sleep infinity"
+    RESET_COMMAND = "sh -c 'kill -9 -1 2>/dev/null; true'"  # kill all the processes except the idle command (PID 1)
+    LABEL = "rdagent.container_pool"  # the value is "<host>:<pid>" of the owner process
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # the idle containers in LRU order: (configuration key, container, the number of runs)
+        self._idle: list[tuple[tuple, Any, int]] = []
+        self._uses: dict[str, int] = {}  # container id -> the number of runs of the containers in use
+        self._unsupported: set[tuple] = set()
+        self._orphans_removed = False
+        atexit.register(self.close)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork_in_child)
+
+    def _after_fork_in_child(self) -> None:
+        # the containers belong to the parent process
+        self._lock = threading.Lock()
+        self._idle, self._uses = [], {}
+
+    @staticmethod
+    def owner() -> str:
+        """The value of `LABEL` of the containers started by the current process"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def remove_orphans(self, client: docker.DockerClient) -> None:  # type: ignore[no-any-unimported]
+        """Remove the pooled containers whose owner processes on this host are gone (once per process)"""
+        with self._lock:
+            if self._orphans_removed:
+                return
+            self._orphans_removed = True
+        try:
+            containers = client.containers.list(all=True, filters={"label": self.LABEL})
+        except docker.errors.APIError as e:
+            logger.warning(f"Failed to list the pooled containers: {e}")
+            return
+        host = socket.gethostname()
+        for container in containers:
+            owner_host, _, pid = container.labels.get(self.LABEL, "").rpartition(":")
+            if owner_host == host and pid.isdigit() and not _is_process_alive(int(pid)):
+                self._remove(container)
+
+    def acquire(self, key: tuple, create: Callable[[], Any]) -> Any:
+        """Take an idle healthy container of the configuration `key`, or start one by `create`"""
+        while True:
+            with self._lock:
+                if key in self._unsupported:
+                    raise ContainerPoolUnavailable(f"The containers of {key} can not be pooled.")
+                # the most recently used first
+                item = next((item for item in reversed(self._idle) if item[0] == key), None)
+                if item is None:
+                    break
+                self._idle.remove(item)
+            _, container, uses = item
+            if self._is_healthy(container):
+                with self._lock:
+                    self._uses[container.id] = uses
+                return container
+            self._remove(container)
+
+        container = None
+        try:
+            container = create()
+            container.reload()
+            if container.status != "running":
+                raise ContainerPoolUnavailable(f"The idle container exits with status {container.status}.")
+        except (docker.errors.APIError, ContainerPoolUnavailable) as e:
+            if container is not None:
+                self._remove(container)
+            with self._lock:
+                self._unsupported.add(key)
+            raise ContainerPoolUnavailable(str(e)) from e
+        with self._lock:
+            self._uses[container.id] = 0
+        return container
+
+    def release(self, key: tuple, container: Any, conf: DockerConf, healthy: bool) -> None:
+        """Reset the container and put it back to the pool (or remove it)"""
+        with self._lock:
+            uses = self._uses.pop(container.id, 0) + 1
+        if healthy and uses < conf.container_max_reuse:
+            try:
+                healthy = container.exec_run(self.RESET_COMMAND).exit_code == 0
+            except docker.errors.APIError:
+                healthy = False
+        if not healthy or uses >= conf.container_max_reuse:
+            self._remove(container)
+            return
+        with self._lock:
+            self._idle.append((key, container, uses))
+            evicted = self._idle[: max(len(self._idle) - conf.container_pool_size, 0)]
+            del self._idle[: len(evicted)]
+        for _, old_container, _ in evicted:
+            self._remove(old_container)
+
+    @staticmethod
+    def _is_healthy(container: Any) -> bool:
+        try:
+            container.reload()
+        except docker.errors.APIError:
+            return False
+        return container.status == "running"
+
+    @staticmethod
+    def _remove(container: Any) -> None:
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            logger.warning(f"Failed to remove the pooled container {container.id}: {e}")
+
+    def close(self) -> None:
+        """Remove all the idle containers"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, container, _ in idle:
+            self._remove(container)
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # the process of another user
+    return True
+
+
+CONTAINER_POOL = ContainerPool()
+
+
+_DEFAULT_LOG_FOLDERS: dict[int, Path] = {}
+
+
+def _default_log_folder() -> Path:
+    """
+    The default log folder of the current process (`<tmp>/rdagent_docker_logs/<pid>`), so the processes never prune
+    the logs of each other; the folders of the gone processes are removed when it is created.
+    """
+    pid = os.getpid()
+    if pid not in _DEFAULT_LOG_FOLDERS:
+        root = Path(tempfile.gettempdir()) / "rdagent_docker_logs"
+        if root.is_dir():
+            for folder in root.iterdir():
+                if folder.is_dir() and folder.name.isdigit() and not _is_process_alive(int(folder.name)):
+                    shutil.rmtree(folder, ignore_errors=True)
+        _DEFAULT_LOG_FOLDERS[pid] = root / str(pid)
+    return _DEFAULT_LOG_FOLDERS[pid]
+
+
 # physionet.org/files/mimic-eicu-fiddle-feature/1.0.0/FIDDLE_mimic3
 class DockerEnv(Env[DockerConf]):
     # TODO: Save the output into a specific file
 
+    # image -> the gpu kwargs; the availability of the GPUs is checked once per image
+    _gpu_kwargs_cache: ClassVar[dict[str, dict]] = {}
+
+    @PROFILER.profiled("docker.prepare", cat="env")
     def prepare(self, *args, **kwargs) -> None:  # type: ignore[no-untyped-def]
         """
         Download image if it doesn't exist
@@ -592,6 +792,11 @@ class DockerEnv(Env[DockerConf]):
         """get gpu kwargs based on its availability"""
         if not self.conf.enable_gpu:
             return {}
+        if self.conf.image not in self._gpu_kwargs_cache:
+            self._gpu_kwargs_cache[self.conf.image] = self._check_gpu_kwargs(client)
+        return self._gpu_kwargs_cache[self.conf.image]
+
+    def _check_gpu_kwargs(self, client: docker.DockerClient) -> dict:  # type: ignore[no-any-unimported]
         gpu_kwargs = {
             "device_requests": (
                 [docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]])] if self.conf.enable_gpu else None
@@ -616,11 +821,12 @@ class DockerEnv(Env[DockerConf]):
 
         return _f()
 
+    DATETIME_RE: ClassVar[re.Pattern] = re.compile(r"\b\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?\b")
+
     def replace_time_info(self, input_string: str) -> str:
         """To remove any time related information from the logs since it will destroy the cache mechanism"""
         """We currently set this function as default, but it can be changed in the future"""
-        datetime_pattern = r"\b\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?\b"
-        output_string = re.sub(datetime_pattern, "[DATETIME]", input_string)
+        output_string = self.DATETIME_RE.sub("[DATETIME]", input_string)
         return output_string
 
     def _run_ret_code(
@@ -637,7 +843,7 @@ class DockerEnv(Env[DockerConf]):
         env["PYTHONWARNINGS"] = "ignore"
         env["TF_CPP_MIN_LOG_LEVEL"] = "2"
         env["PYTHONUNBUFFERED"] = "1"
-        client = docker.from_env()
+        client = get_docker_client()
 
         volumes = {}
         if local_path is not None:
@@ -653,43 +859,28 @@ class DockerEnv(Env[DockerConf]):
         for lp, rp in running_extra_volume.items():
             volumes[lp] = {"bind": rp, "mode": self.conf.extra_volume_mode}
 
-        log_output = ""
-
         try:
-            container: docker.models.containers.Container = client.containers.run(  # type: ignore[no-any-unimported]
-                image=self.conf.image,
-                command=entry,
-                volumes=volumes,
-                environment=env,
-                detach=True,
-                working_dir=self.conf.mount_path,
-                # auto_remove=True, # remove too fast might cause the logs not to be get
-                network=self.conf.network,
-                shm_size=self.conf.shm_size,
-                mem_limit=self.conf.mem_limit,  # Set memory limit
-                cpu_count=self.conf.cpu_count,  # Set CPU limit
-                **self._gpu_kwargs(client),
-            )
-            logs = container.logs(stream=True)
-            print(Rule("[bold green]Docker Logs Begin[/bold green]", style="dark_orange"))
-            table = Table(title="Run Info", show_header=False)
-            table.add_column("Key", style="bold cyan")
-            table.add_column("Value", style="bold magenta")
-            table.add_row("Image", self.conf.image)
-            table.add_row("Container ID", container.id)
-            table.add_row("Container Name", container.name)
-            table.add_row("Entry", entry)
-            table.add_row("Env", "\n".join(f"{k}:{v}" for k, v in env.items()))
-            table.add_row("Volumes", "\n".join(f"{k}:{v}" for k, v in volumes.items()))
-            print(table)
-            for log in logs:
-                decoded_log = log.strip().decode()
-                decoded_log = self.replace_time_info(decoded_log) if remove_timestamp else decoded_log
-                Console().print(decoded_log, markup=False)
-                log_output += decoded_log + "\n"
-            exit_status = container.wait()["StatusCode"]
-            container.stop()
-            container.remove()
+            if self.conf.container_pool:
+                try:
+                    return self._run_in_pooled_container(client, entry, volumes, env, remove_timestamp)
+                except ContainerPoolUnavailable as e:
+                    logger.warning(f"Fall back to the one-shot containers: {e}")
+            with PROFILER.span("docker.start", cat="env"):
+                container: docker.models.containers.Container = client.containers.run(  # type: ignore[no-any-unimported]
+                    command=entry,
+                    environment=env,
+                    detach=True,
+                    # auto_remove=True, # remove too fast might cause the logs not to be get
+                    **self._container_kwargs(client, volumes),
+                )
+            log_path = self._new_log_path(container)
+            self._print_run_info(container, entry, env, volumes, log_path)
+            with PROFILER.span("docker.run", cat="env"):
+                log_output = self._collect_logs(container.logs(stream=True), remove_timestamp, log_path)
+                exit_status = container.wait()["StatusCode"]
+            with PROFILER.span("docker.remove", cat="env"):
+                container.stop()
+                container.remove()
             print(Rule("[bold green]Docker Logs End[/bold green]", style="dark_orange"))
             return log_output, exit_status
         except docker.errors.ContainerError as e:
@@ -699,6 +890,95 @@ class DockerEnv(Env[DockerConf]):
         except docker.errors.APIError as e:
             raise RuntimeError(f"Error while running the container: {e}")
 
+    def _container_kwargs(self, client: docker.DockerClient, volumes: dict) -> dict:  # type: ignore[no-any-unimported]
+        """The configuration of the containers (shared by the one-shot & the pooled containers)"""
+        return dict(
+            image=self.conf.image,
+            volumes=volumes,
+            working_dir=self.conf.mount_path,
+            network=self.conf.network,
+            shm_size=self.conf.shm_size,
+            mem_limit=self.conf.mem_limit,  # Set memory limit
+            cpu_count=self.conf.cpu_count,  # Set CPU limit
+            **self._gpu_kwargs(client),
+        )
+
+    def _run_in_pooled_container(
+        self,
+        client: docker.DockerClient,  # type: ignore[no-any-unimported]
+        entry: str | None,
+        volumes: dict,
+        env: dict,
+        remove_timestamp: bool,
+    ) -> tuple[str, int]:
+        """Run the entry by `exec` in a container of `CONTAINER_POOL`"""
+        kwargs = self._container_kwargs(client, volumes)
+        # the volumes (so the workspace) are a part of the key, so every workspace has its own containers
+        key = (json.dumps(kwargs, sort_keys=True, default=str),)
+        CONTAINER_POOL.remove_orphans(client)
+        with PROFILER.span("docker.start", cat="env", pooled=True):
+            container = CONTAINER_POOL.acquire(
+                key,
+                lambda: client.containers.run(
+                    command=ContainerPool.IDLE_COMMAND,
+                    detach=True,
+                    labels={ContainerPool.LABEL: ContainerPool.owner()},
+                    **kwargs,
+                ),
+            )
+        healthy = False
+        try:
+            log_path = self._new_log_path(container)
+            self._print_run_info(container, entry, env, volumes, log_path)
+            with PROFILER.span("docker.run", cat="env", pooled=True):
+                exec_id = client.api.exec_create(
+                    container.id, entry, environment=env, workdir=self.conf.mount_path
+                )["Id"]
+                log_output = self._collect_logs(
+                    client.api.exec_start(exec_id, stream=True), remove_timestamp, log_path
+                )
+                exit_status = client.api.exec_inspect(exec_id)["ExitCode"]
+            healthy = True
+        finally:
+            CONTAINER_POOL.release(key, container, self.conf, healthy)
+        print(Rule("[bold green]Docker Logs End[/bold green]", style="dark_orange"))
+        return log_output, exit_status
+
+    def _print_run_info(self, container: Any, entry: str | None, env: dict, volumes: dict, log_path: Path) -> None:
+        print(Rule("[bold green]Docker Logs Begin[/bold green]", style="dark_orange"))
+        table = Table(title="Run Info", show_header=False)
+        table.add_column("Key", style="bold cyan")
+        table.add_column("Value", style="bold magenta")
+        table.add_row("Image", self.conf.image)
+        table.add_row("Container ID", container.id)
+        table.add_row("Container Name", container.name)
+        table.add_row("Entry", entry)
+        table.add_row("Env", "\n".join(f"{k}:{v}" for k, v in env.items()))
+        table.add_row("Volumes", "\n".join(f"{k}:{v}" for k, v in volumes.items()))
+        table.add_row("Log File", str(log_path))
+        print(table)
+
+    def _new_log_path(self, container: Any) -> Path:
+        """The file of the whole log of a run (the pooled containers run many entries, so a suffix is added)"""
+        log_folder = _default_log_folder() if self.conf.log_folder is None else Path(self.conf.log_folder)
+        prune_logs(log_folder, self.conf.log_keep_files - 1)
+        return log_folder / f"{container.name}-{uuid.uuid4().hex[:8]}.log"
+
+    def _collect_logs(self, chunks: Iterable[bytes], remove_timestamp: bool, log_path: Path) -> str:
+        """Capture the streamed logs with a bounded memory (the hidden middle part is only in `log_path`)"""
+        with LogCapture(
+            log_path,
+            head_lines=self.conf.log_head_lines,
+            tail_lines=self.conf.log_tail_lines,
+            line_len=RD_AGENT_SETTINGS.stdout_line_len,
+            transform=self.replace_time_info if remove_timestamp else None,
+            echo=self.conf.log_echo,
+            max_file_bytes=self.conf.log_max_bytes,
+        ) as capture:
+            for chunk in chunks:
+                capture.feed(chunk)
+        return capture.text()
+
     def dump_python_code_run_and_get_results(
         self,
         code: str,
@@ -0,0 +1,302 @@
+"""
+The bounded-memory capture of the streamed logs of the runs (e.g. `DockerEnv`).
+
+The logs of a long run (e.g. the epochs of a training) may have hundreds of thousands of lines, so `LogCapture`
+processes the stream chunk by chunk instead of building the whole string:
+
+- every line is cleaned once when it arrives: a line redrawn by carriage returns (e.g. tqdm) is reduced to its last
+  state, `transform` (e.g. `DockerEnv.replace_time_info`) and `remove_progress_bars` (the regex part of
+  `filter_redundant_text`) are applied, and the long lines are cut like `shrink_text` does;
+- the whole cleaned log is written to a rolling file, and only its head & tail are kept in memory; `LogCapture.text`
+  hides the middle part like `shrink_text`;
+- the lines are echoed to the console by a background thread, so a slow terminal never blocks the reading (the lines
+  are dropped from the console if it falls behind), and `follow` tails the log file for the live displays.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+from types import TracebackType
+
+from rich.console import Console
+
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.utils import remove_progress_bars
+
+_CONSOLE = Console()  # one console for all the echoed lines
+
+# the log files being written by the captures of this process, which `prune_logs` keeps
+_OPEN_LOGS: set[Path] = set()
+_OPEN_LOGS_LOCK = threading.Lock()
+
+
+class LogCapture:
+    """
+    Feed the streamed chunks with `feed`, then get the (shrunk) log by `text` after `close`.
+
+    Parameters
+    ----------
+    log_path :
+        the rolling file of the whole log (it is not written if None)
+    head_lines, tail_lines :
+        the number of the lines kept in memory at the beginning & the end of the log
+    line_len :
+        the lines longer than it are cut in the middle
+    transform :
+        the extra processing of the lines (it is applied to the lines of a chunk at once, so it must work line by
+        line, like `DockerEnv.replace_time_info`)
+    echo :
+        print the lines to the console
+    max_file_bytes :
+        the log file is rolled over to `<log_path>.1` beyond the size (so at most twice the size is kept, and the
+        beginning of a longer log is lost)
+    """
+
+    ECHO_MAX_LINES = 5_000  # the lines waiting for the console
+    ECHO_BATCH_SIZE = 1_000
+
+    def __init__(
+        self,
+        log_path: str | Path | None = None,
+        head_lines: int = 1000,
+        tail_lines: int = 1000,
+        line_len: int = RD_AGENT_SETTINGS.stdout_line_len,
+        transform: Callable[[str], str] | None = None,
+        echo: bool = True,
+        max_file_bytes: int = 100 * 1024 * 1024,
+    ) -> None:
+        self.log_path = None if log_path is None else Path(log_path)
+        self.head: list[str] = []
+        self.tail: deque[str] = deque(maxlen=tail_lines)
+        self.head_lines = head_lines
+        self.line_len = line_len
+        self.transform = transform
+        self.max_file_bytes = max_file_bytes
+        self.n_lines = 0
+        self.n_echo_dropped = 0
+
+        self._pending = b""  # the last line, which is not complete yet
+        self._pending_cut = 0  # the bytes cut from the middle of the pending line
+        self._max_pending = max(line_len * 4, 1 << 16)
+        self._file_bytes = 0
+        self._rollovers = 0
+        self._file = None
+        if self.log_path is not None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with _OPEN_LOGS_LOCK:
+                _OPEN_LOGS.add(self.log_path.absolute())
+            self._file = self.log_path.open("wb")
+        self._echo_queue: queue.Queue[list[str] | None] | None = None
+        self._echo_thread: threading.Thread | None = None
+        self._echo_lock = threading.Lock()
+        if echo:
+            self._echo_queue = queue.Queue()
+            self._echo_lines = 0  # the lines in the queue
+            self._echo_thread = threading.Thread(target=self._echo_loop, name="log-echo", daemon=True)
+            self._echo_thread.start()
+
+    def __enter__(self) -> LogCapture:
+        return self
+
+    def __exit__(
+        self, exc_type: type[BaseException] | None, exc: BaseException | None, tb: TracebackType | None
+    ) -> None:
+        self.close()
+
+    def feed(self, chunk: bytes) -> None:
+        """Process a chunk of the stream (it may hold parts of lines or several lines)"""
+        lines = (self._pending + chunk).split(b"\n")
+        self._pending = lines.pop()
+        if lines:
+            self._output(self._process_lines(lines, self._pending_cut))
+            self._pending_cut = 0
+        if len(self._pending) > self._max_pending:
+            # a line redrawn again and again (e.g. a progress bar) only needs its last state
+            redraw = self._pending.rfind(b"\r", 0, -1)
+            if redraw >= 0:
+                self._pending = self._pending[redraw + 1 :]
+                self._pending_cut = 0
+            if len(self._pending) > self._max_pending:
+                half = self._max_pending // 2
+                self._pending_cut += len(self._pending) - 2 * half
+                self._pending = self._pending[:half] + self._pending[-half:]
+
+    def _process_lines(self, raw_lines: list[bytes], first_cut: int = 0) -> list[str]:
+        """
+        The cleaned lines; the lines with nothing left (e.g. the progress bars) are dropped.
+        `first_cut` is the number of the bytes cut from the middle of the first line.
+        """
+        text = b"\n".join(raw_lines).decode("utf-8", errors="replace")
+        if "\r" in text:
+            lines = []
+            for i, line in enumerate(text.split("\n")):
+                line = line.rstrip("\r")
+                redraw = line.rfind("\r")
+                if redraw >= 0:
+                    line = line[redraw + 1 :]
+                    first_cut = 0 if i == 0 else first_cut
+                lines.append(line)
+            text = "\n".join(lines)
+        if self.transform is not None:
+            text = self.transform(text)  # one call per chunk instead of per line
+        result = []
+        for i, line in enumerate(text.split("\n")):
+            cleaned = remove_progress_bars(line).strip()
+            if not cleaned and line.strip():
+                continue
+            total_len = len(cleaned) + (first_cut if i == 0 else 0)
+            if total_len > self.line_len:
+                half = self.line_len // 2
+                cleaned = (
+                    f"{cleaned[:half]}... ({total_len - self.line_len} chars are hidden) ..."
+                    f"{cleaned[-(self.line_len - half):]}"
+                )
+            result.append(cleaned)
+        return result
+
+    def _output(self, lines: list[str]) -> None:
+        if not lines:
+            return
+        for line in lines:
+            if len(self.head) < self.head_lines:
+                self.head.append(line)
+            else:
+                self.tail.append(line)
+        self.n_lines += len(lines)
+        if self._file is not None:
+            self._write("".join(line + "\n" for line in lines).encode("utf-8"))
+        if self._echo_queue is not None:
+            with self._echo_lock:
+                if self._echo_lines + len(lines) > self.ECHO_MAX_LINES:
+                    self.n_echo_dropped += len(lines)
+                    return
+                self._echo_lines += len(lines)
+            self._echo_queue.put(lines)
+
+    def _write(self, data: bytes) -> None:
+        assert self._file is not None and self.log_path is not None
+        if self._file_bytes and self._file_bytes + len(data) > self.max_file_bytes:
+            self._file.close()
+            os.replace(self.log_path, f"{self.log_path}.1")
+            self._file = self.log_path.open("wb")
+            self._file_bytes = 0
+            self._rollovers += 1
+        self._file.write(data)
+        self._file.flush()  # visible to `follow` chunk by chunk
+        self._file_bytes += len(data)
+
+    def _echo_loop(self) -> None:
+        assert self._echo_queue is not None
+        stop = False
+        while not stop:
+            lines = self._echo_queue.get()
+            if lines is None:
+                return
+            # print what has piled up in one go
+            while len(lines) < self.ECHO_BATCH_SIZE:
+                try:
+                    more = self._echo_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    stop = True
+                    break
+                lines = lines + more
+            # the highlighting of rich costs several times more than the printing
+            _CONSOLE.print("\n".join(lines), markup=False, highlight=False)
+            with self._echo_lock:
+                self._echo_lines -= len(lines)
+
+    def close(self) -> None:
+        """Process the last line, close the log file and wait for the console"""
+        if self._pending or self._pending_cut:
+            self._output(self._process_lines([self._pending], self._pending_cut))
+            self._pending, self._pending_cut = b"", 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            with _OPEN_LOGS_LOCK:
+                _OPEN_LOGS.discard(self.log_path.absolute())
+        if self._echo_thread is not None and self._echo_queue is not None:
+            self._echo_queue.put(None)
+            self._echo_thread.join()
+            self._echo_thread = None
+            if self.n_echo_dropped:
+                _CONSOLE.print(f"... ({self.n_echo_dropped} lines are not printed, see the log file) ...", markup=False)
+
+    def text(self) -> str:
+        """The log, whose middle part is hidden if it has more lines than the head & the tail"""
+        lines = self.head + list(self.tail)
+        hidden = self.n_lines - len(lines)
+        if hidden > 0:
+            if self.log_path is None:
+                where = ""
+            elif self._rollovers == 0:
+                where = f", the whole log is in {self.log_path}"
+            else:
+                what = "whole log" if self._rollovers == 1 else "last part of the log"
+                where = f", the {what} is in {self.log_path}.1 & {self.log_path}"
+            lines.insert(len(self.head), f"... ({hidden} lines are hidden{where}) ...")
+        return "".join(line + "\n" for line in lines)
+
+
+def prune_logs(folder: str | Path, keep: int) -> None:
+    """Remove the log files in `folder` except the latest `keep` ones and the ones still being written"""
+    folder = Path(folder)
+    if not folder.is_dir():
+        return
+    with _OPEN_LOGS_LOCK:
+        open_logs = set(_OPEN_LOGS)
+    mtimes = {}
+    for path in folder.glob("*.log*"):
+        if path.absolute() in open_logs or path.with_suffix("").absolute() in open_logs:
+            continue  # a long & quiet run (or its rolled over part)
+        try:
+            mtimes[path] = path.stat().st_mtime
+        except FileNotFoundError:
+            pass  # removed by a concurrent run
+    logs = sorted(mtimes, key=mtimes.__getitem__, reverse=True)
+    for path in logs[keep:]:
+        path.unlink(missing_ok=True)
+
+
+async def follow(
+    path: str | Path, done: Callable[[], bool], poll_interval: float = 0.2, read_size: int = 1 << 20
+) -> AsyncIterator[str]:
+    """
+    Yield the lines appended to the log file `path` (like `tail -f`) until `done()` is true and the file is read up.
+    A rolled over file is followed from its beginning.
+    """
+    path = Path(path)
+    pos, inode, rest = 0, None, b""
+    while True:
+        finished = done()  # checked before reading, so all the lines written before the end are yielded
+        data = b""
+        try:
+            st = path.stat()
+            if st.st_ino != inode or st.st_size < pos:
+                pos, inode = 0, st.st_ino
+            if st.st_size > pos:
+                with path.open("rb") as f:
+                    f.seek(pos)
+                    data = f.read(read_size)
+                    pos = f.tell()
+        except FileNotFoundError:
+            pass
+        if data:
+            lines = (rest + data).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line.decode("utf-8", errors="replace")
+            continue
+        if finished:
+            if rest:
+                yield rest.decode("utf-8", errors="replace")
+            return
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,151 @@
+"""
+The cache of the runs of `Env.cached_run`.
+
+A run is cached as the changes it makes to the workspace instead of an archive of the whole workspace:
+
+- `scan` lists the workspace as a manifest (relative path -> the sha256 of the file, or the target of the symlink).
+  The digests are memoized by (mtime, size, inode), so the unchanged files are not read again; the symlinks (e.g. the
+  linked data) are never followed.
+- `RunCache.save` stores the files added or changed by the run into a content-addressed store (one file per
+  content, shared by all the runs) and the manifest diff beside the result of the run.
+- `RunCache.restore` applies the diff to the workspace: the files are cloned from the store (copy-on-write where the
+  file system supports it, otherwise copied; they are never hard linked, as the workspace files may be rewritten in
+  place later).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+from pathlib import Path
+from typing import Any
+
+try:
+    import fcntl
+
+    _FICLONE: int | None = 0x40049409  # the ioctl of the reflinks on linux (btrfs, xfs ...)
+except ImportError:  # windows
+    _FICLONE = None
+
+# a file entry of a manifest: ("file", digest) or ("link", target)
+Entry = tuple[str, str]
+
+_DIGEST_MEMO: dict[str, tuple[int, int, int, str]] = {}  # path -> (mtime_ns, size, inode, digest)
+_DIGEST_MEMO_MAX_SIZE = 200_000
+_DIGEST_MEMO_LOCK = threading.Lock()
+
+
+def file_digest(path: str | Path, st: os.stat_result | None = None) -> str:
+    """The sha256 of the content of the file; it is read again only if its mtime, size or inode changes"""
+    path = os.fspath(path)
+    st = os.stat(path) if st is None else st
+    memo = _DIGEST_MEMO.get(path)
+    if memo is not None and memo[:3] == (st.st_mtime_ns, st.st_size, st.st_ino):
+        return memo[3]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    with _DIGEST_MEMO_LOCK:
+        if len(_DIGEST_MEMO) >= _DIGEST_MEMO_MAX_SIZE:
+            _DIGEST_MEMO.clear()
+        _DIGEST_MEMO[path] = (st.st_mtime_ns, st.st_size, st.st_ino, digest)
+    return digest
+
+
+def scan(folder: str | Path, skip_dirs: tuple[str, ...] = ("__pycache__",)) -> dict[str, Entry]:
+    """The manifest of the files under `folder` (the symlinked files & folders are listed, but not followed)"""
+    manifest: dict[str, Entry] = {}
+    root = os.fspath(folder)
+
+    def walk(path: str, prefix: str) -> None:
+        with os.scandir(path) as it:
+            for entry in it:
+                name = prefix + entry.name
+                if entry.is_symlink():
+                    manifest[name] = ("link", os.readlink(entry.path))
+                elif entry.is_dir():
+                    if entry.name not in skip_dirs:
+                        walk(entry.path, name + "/")
+                elif entry.is_file():
+                    manifest[name] = ("file", file_digest(entry.path, entry.stat()))
+
+    if os.path.isdir(root):
+        walk(root, "")
+    return manifest
+
+
+def _clone_file(src: Path, dst: Path) -> None:
+    """Copy `src` to `dst` by a reflink where the file system supports it"""
+    if _FICLONE is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+class RunCache:
+    """The cached runs in `folder`: `<key>.run.pkl` holds the result & the diff, `blobs/` holds the contents"""
+
+    def __init__(self, folder: str | Path) -> None:
+        self.folder = Path(folder)
+        self.blob_folder = self.folder / "blobs"
+
+    def _run_path(self, key: str) -> Path:
+        return self.folder / f"{key}.run.pkl"
+
+    def load(self, key: str) -> dict[str, Any] | None:
+        path = self._run_path(key)
+        if not path.exists():
+            return None
+        with path.open("rb") as f:
+            record: dict[str, Any] = pickle.load(f)
+        # the cached run is unusable if any of its blobs is lost
+        if any(
+            kind == "file" and not (self.blob_folder / value).exists() for kind, value in record["changed"].values()
+        ):
+            return None
+        return record
+
+    def save(self, key: str, ret: Any, folder: str | Path, before: dict[str, Entry]) -> None:
+        """Save the result `ret` of the run and the changes it made to `folder` (`before` is the manifest before it)"""
+        after = scan(folder)
+        changed = {name: entry for name, entry in after.items() if before.get(name) != entry}
+        deleted = [name for name in before if name not in after]
+        self.blob_folder.mkdir(parents=True, exist_ok=True)
+        for name, (kind, value) in changed.items():
+            blob = self.blob_folder / value
+            if kind == "file" and not blob.exists():
+                tmp = self.blob_folder / f"{value}.{os.getpid()}.{threading.get_ident()}.tmp"
+                shutil.copyfile(Path(folder) / name, tmp)
+                os.replace(tmp, blob)  # the blob is never seen half written
+        tmp = self._run_path(key).with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with tmp.open("wb") as f:
+            pickle.dump({"ret": ret, "changed": changed, "deleted": deleted}, f)
+        os.replace(tmp, self._run_path(key))
+
+    def restore(self, record: dict[str, Any], folder: str | Path) -> None:
+        """Apply the changes of the cached run to `folder`"""
+        folder = Path(folder)
+        for name in record["deleted"]:
+            path = folder / name
+            if path.is_symlink() or path.is_file():
+                path.unlink()
+        for name, (kind, value) in record["changed"].items():
+            path = folder / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if path.is_symlink() or path.is_file():
+                path.unlink()
+            elif path.is_dir():
+                shutil.rmtree(path)
+            if kind == "link":
+                os.symlink(value, path)
+            else:
+                _clone_file(self.blob_folder / value, path)
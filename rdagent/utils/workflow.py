@@ -8,11 +8,16 @@ Postscripts:
 
 """
 
+import contextvars
 import datetime
+import functools
 import os
 import pickle
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Callable, Optional, TypeVar, Union, cast
@@ -20,7 +25,9 @@ from typing import Any, Callable, Optional, TypeVar, Union, cast
 import pytz
 from tqdm.auto import tqdm
 
+from rdagent.core.blob_store import WORKSPACE_BLOB_STORE
 from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.core.profiling import PROFILE_FILE_NAME, PROFILER
 from rdagent.log import rdagent_logger as logger
 from rdagent.log.timer import RD_Agent_TIMER_wrapper, RDAgentTimer
 
@@ -90,11 +97,26 @@ class LoopBase:
     skip_loop_error: tuple[type[BaseException], ...] = ()  # you can define a list of error that will skip current loop
 
     EXCEPTION_KEY = "_EXCEPTION"
+    BLOB_FOLDER = "blobs"  # the folder of the file contents shared by the snapshots, in the session folder
+    CHECKPOINT_VERSION = 1
+
+    # the dotted paths of the list attributes (e.g. `trace.hist`) which are only appended to.
+    # The session snapshots save each of their items once, so the items must not be modified after being appended.
+    checkpoint_append_only_attributes: tuple[str, ...] = ()
+    # the dotted paths of the attributes (e.g. `trace.knowledge_base`) saved as None in the snapshots, so they must be
+    # rebuilt by `load`; the live objects are left untouched while the other loops are using them.
+    # The objects of the builtin containers (e.g. dict, list) can not be excluded.
+    checkpoint_excluded_attributes: tuple[str, ...] = ()
+
+    # the scheduling rules of the loops running concurrently (`RD_AGENT_SETTINGS.max_parallel_loops` > 1)
+    ordered_steps: tuple[str, ...] = ()  # the steps run one at a time in the order of the loops (e.g. the recording)
+    step_concurrency: dict[str, int] = {}  # step -> the max number of loops running it at the same time
 
     def __init__(self) -> None:
         self.loop_idx = 0  # current loop index
         self.step_idx = 0  # the index of next step to be run
         self.loop_prev_out: dict[str, Any] = {}  # the step results of current loop
+        self.running_loops: dict[int, dict[str, Any]] = {}  # the loops in flight when running concurrently
         self.loop_trace = defaultdict(list[LoopTrace])  # the key is the number of loop
         self.session_folder = logger.log_trace_path / "__session__"
         self.timer: RDAgentTimer = RD_Agent_TIMER_wrapper.timer
@@ -110,10 +132,19 @@ class LoopBase:
         loop_n: int | None
             How many steps to run; if current loop is incomplete, it will be counted as the first loop for completion
             `None` indicates to run forever until error or KeyboardInterrupt
+
+        The loops run one by one unless `RD_AGENT_SETTINGS.max_parallel_loops` > 1 (see `_run_concurrently`).
         """
 
         if all_duration is not None and not self.timer.started:
             self.timer.reset(all_duration=all_duration)
+        # the spans of the session are saved beside its snapshots (see `rdagent.core.profiling`)
+        PROFILER.set_output(self.session_folder.parent / PROFILE_FILE_NAME)
+
+        n_parallel = RD_AGENT_SETTINGS.max_parallel_loops
+        if n_parallel > 1 or self.__dict__.get("running_loops"):
+            self._run_concurrently(step_n=step_n, loop_n=loop_n, n_parallel=max(1, n_parallel))
+            return
 
         with tqdm(total=len(self.steps), desc="Workflow Progress", unit="step") as pbar:
             while True:
@@ -125,65 +156,27 @@ class LoopBase:
                     if loop_n <= 0:
                         break
 
-                if RD_AGENT_SETTINGS.enable_mlflow:
-                    mlflow.log_metric("loop_index", self.loop_idx)
-                    mlflow.log_metric("step_index", self.step_idx)
-                    current_local_datetime = datetime.datetime.now(pytz.timezone("Asia/Shanghai"))  # type: ignore
-                    float_like_datetime = (
-                        current_local_datetime.second
-                        + current_local_datetime.minute * 1e2
-                        + current_local_datetime.hour * 1e4
-                        + current_local_datetime.day * 1e6
-                        + current_local_datetime.month * 1e8
-                        + current_local_datetime.year * 1e10
-                    )
-                    mlflow.log_metric("current_datetime", float_like_datetime)
-
-                if self.timer.started:
-                    if RD_AGENT_SETTINGS.enable_mlflow:
-                        mlflow.log_metric("remain_time", self.timer.remain_time().seconds)  # type: ignore[union-attr]
-                        if self.timer.all_duration:
-                            mlflow.log_metric(
-                                "remain_percent", self.timer.remain_time() / self.timer.all_duration * 100  # type: ignore[operator]
-                            )
-                    if self.timer.is_timeout():
-                        logger.warning("Timeout, exiting the loop.")
-                        break
-                    else:
-                        logger.info(f"Timer remaining time: {self.timer.remain_time()}")
+                self._log_progress(self.loop_idx, self.step_idx)
+                if self._is_timeout():
+                    break
 
                 li, si = self.loop_idx, self.step_idx
                 name = self.steps[si]
-                logger.info(f"Start Loop {li}, Step {si}: {name}")
-                with logger.tag(f"Loop_{li}.{name}"):
-                    start = datetime.datetime.now(datetime.timezone.utc)
-                    func: Callable[..., Any] = cast(Callable[..., Any], getattr(self, name))
-                    try:
-                        self.loop_prev_out[name] = func(self.loop_prev_out)
-                        # TODO: Fix the error logger.exception(f"Skip loop {li} due to {e}")
-                    except Exception as e:
-                        if isinstance(e, self.skip_loop_error):
-                            # FIXME: This does not support previous demo (due to their last step is not for recording)
-                            logger.warning(f"Skip loop {li} due to {e}")
-                            # NOTE: strong assumption!  The last step is responsible for recording information
-                            self.step_idx = len(self.steps) - 1  # directly jump to the last step.
-                            self.loop_prev_out[self.EXCEPTION_KEY] = e # type: ignore
-                            continue
-                        else:
-                            raise
-                    finally:
-                        # make sure failure steps are displayed correclty
-                        end = datetime.datetime.now(datetime.timezone.utc)
-                        self.loop_trace[li].append(LoopTrace(start, end, step_idx=si))
-
-                        # Update tqdm progress bar directly to step_idx
-                        pbar.n = si + 1
-                        pbar.set_postfix(
-                            loop_index=li, step_index=si + 1, step_name=name
-                        )  # step_name indicate  last finished step_name
+                try:
+                    next_si = self._run_step(li, si, self.loop_prev_out)
+                finally:
+                    # Update tqdm progress bar directly to step_idx
+                    pbar.n = si + 1
+                    pbar.set_postfix(
+                        loop_index=li, step_index=si + 1, step_name=name
+                    )  # step_name indicate  last finished step_name
+                if next_si != si + 1:
+                    # the loop is skipped: directly jump to the last step.
+                    self.step_idx = next_si
+                    continue
 
                 # index increase and save session
-                self.step_idx = (self.step_idx + 1) % len(self.steps)
+                self.step_idx = next_si % len(self.steps)
                 if self.step_idx == 0:  # reset to step 0 in next round
                     self.loop_idx += 1
                     if loop_n is not None:
@@ -193,13 +186,297 @@ class LoopBase:
 
                 self.dump(self.session_folder / f"{li}" / f"{si}_{name}")  # save a snapshot after the session
 
+    def _log_progress(self, li: int, si: int) -> None:
+        if RD_AGENT_SETTINGS.enable_mlflow:
+            mlflow.log_metric("loop_index", li)
+            mlflow.log_metric("step_index", si)
+            current_local_datetime = datetime.datetime.now(pytz.timezone("Asia/Shanghai"))  # type: ignore
+            float_like_datetime = (
+                current_local_datetime.second
+                + current_local_datetime.minute * 1e2
+                + current_local_datetime.hour * 1e4
+                + current_local_datetime.day * 1e6
+                + current_local_datetime.month * 1e8
+                + current_local_datetime.year * 1e10
+            )
+            mlflow.log_metric("current_datetime", float_like_datetime)
+
+        if self.timer.started and RD_AGENT_SETTINGS.enable_mlflow:
+            mlflow.log_metric("remain_time", self.timer.remain_time().seconds)  # type: ignore[union-attr]
+            if self.timer.all_duration:
+                mlflow.log_metric(
+                    "remain_percent", self.timer.remain_time() / self.timer.all_duration * 100  # type: ignore[operator]
+                )
+
+    def _is_timeout(self) -> bool:
+        if self.timer.started:
+            if self.timer.is_timeout():
+                logger.warning("Timeout, exiting the loop.")
+                return True
+            else:
+                logger.info(f"Timer remaining time: {self.timer.remain_time()}")
+        return False
+
+    def _run_step(self, li: int, si: int, prev_out: dict[str, Any]) -> int:
+        """
+        Run the step `si` of loop `li` on the former step results `prev_out` (and save its result in it).
+
+        Returns
+        -------
+        int
+            the index of the next step of the loop; it is the last step if the loop is skipped.
+        """
+        name = self.steps[si]
+        logger.info(f"Start Loop {li}, Step {si}: {name}")
+        with logger.tag(f"Loop_{li}.{name}"), PROFILER.span(name, cat="step", loop=li):
+            start = datetime.datetime.now(datetime.timezone.utc)
+            func: Callable[..., Any] = cast(Callable[..., Any], getattr(self, name))
+            try:
+                prev_out[name] = func(prev_out)
+                # TODO: Fix the error logger.exception(f"Skip loop {li} due to {e}")
+            except Exception as e:
+                if isinstance(e, self.skip_loop_error):
+                    # FIXME: This does not support previous demo (due to their last step is not for recording)
+                    logger.warning(f"Skip loop {li} due to {e}")
+                    # NOTE: strong assumption!  The last step is responsible for recording information
+                    prev_out[self.EXCEPTION_KEY] = e  # type: ignore
+                    return len(self.steps) - 1
+                else:
+                    raise
+            finally:
+                # make sure failure steps are displayed correclty
+                end = datetime.datetime.now(datetime.timezone.utc)
+                self.loop_trace[li].append(LoopTrace(start, end, step_idx=si))
+        return si + 1
+
+    def _step_ready(self, li: int, si: int) -> bool:
+        """The steps in `ordered_steps` wait until the former loops in flight have passed them"""
+        if self.steps[si] not in self.ordered_steps:
+            return True
+        return all(state["step_idx"] > si for lj, state in self.running_loops.items() if lj < li)
+
+    def _run_concurrently(self, step_n: int | None, loop_n: int | None, n_parallel: int) -> None:
+        """
+        Keep up to `n_parallel` loops in flight; every loop runs its steps one by one in its own thread.
+
+        - `loop_idx` is the next loop to start; the loops in flight are saved in `running_loops` (loop index ->
+          {"step_idx": the next step, "prev_out": the step results}), so the snapshots resume all of them.
+        - The steps in `ordered_steps` run in the order of the loops, one at a time.
+        - At most `step_concurrency[step]` loops run `step` at the same time.
+        - `step_n` counts the steps of all the loops; `loop_n` counts the loops started, including the resumed ones.
+        """
+        running: dict[int, dict[str, Any]] = self.__dict__.setdefault("running_loops", {})
+        if self.step_idx != 0:
+            # the current loop was left incomplete by the sequential mode
+            running[self.loop_idx] = {"step_idx": self.step_idx, "prev_out": self.loop_prev_out}
+            self.loop_idx += 1
+            self.step_idx, self.loop_prev_out = 0, {}
+
+        cond = threading.Condition()  # it guards the scheduling states & the snapshots
+        limits = {name: threading.Semaphore(n) for name, n in self.step_concurrency.items()}
+        stop = threading.Event()
+        errors: list[BaseException] = []
+        loops_to_start = None if loop_n is None else loop_n - len(running)
+        pbar = tqdm(desc="Workflow Progress", unit="step")
+
+        def run_loop(li: int) -> None:
+            nonlocal step_n
+            state = running[li]
+            try:
+                while state["step_idx"] < len(self.steps):
+                    si = state["step_idx"]
+                    with cond:
+                        cond.wait_for(lambda: stop.is_set() or self._step_ready(li, si))
+                        if stop.is_set():
+                            return
+                        if step_n is not None:
+                            if step_n <= 0:
+                                stop.set()
+                                cond.notify_all()
+                                return
+                            step_n -= 1
+                    self._log_progress(li, si)
+                    if self._is_timeout():
+                        stop.set()
+                        with cond:
+                            cond.notify_all()
+                        return
+
+                    name = self.steps[si]
+                    with limits.get(name, nullcontext()):
+                        next_si = self._run_step(li, si, state["prev_out"])
+                    with cond:
+                        state["step_idx"] = next_si
+                        if next_si >= len(self.steps):
+                            del running[li]
+                        self._dump_concurrently(self.session_folder / f"{li}" / f"{si}_{name}")
+                        pbar.update()
+                        pbar.set_postfix(loop_index=li, step_index=si + 1, step_name=name)
+                        cond.notify_all()
+            except BaseException as e:
+                # the failed step is run again after resuming
+                errors.append(e)
+                stop.set()
+                with cond:
+                    cond.notify_all()
+
+        executor = ThreadPoolExecutor(max_workers=max(n_parallel, len(running)), thread_name_prefix="rdagent-loop")
+        futures: set[Future] = set()
+        interrupted = False
+        try:
+            for li in sorted(running):
+                futures.add(executor.submit(contextvars.copy_context().run, run_loop, li))
+            while True:
+                with cond:
+                    while (
+                        not stop.is_set()
+                        and len(futures) < n_parallel
+                        and (loops_to_start is None or loops_to_start > 0)
+                        and not (self.timer.started and self.timer.is_timeout())
+                    ):
+                        li = self.loop_idx
+                        running[li] = {"step_idx": 0, "prev_out": {}}
+                        self.loop_idx += 1
+                        if loops_to_start is not None:
+                            loops_to_start -= 1
+                        futures.add(executor.submit(contextvars.copy_context().run, run_loop, li))
+                if not futures:
+                    break
+                _, futures = wait(futures, return_when=FIRST_COMPLETED)
+        except BaseException:
+            interrupted = True
+            stop.set()
+            with cond:
+                cond.notify_all()
+            raise
+        finally:
+            # the running steps are finished (but not waited for after an interruption)
+            executor.shutdown(wait=not interrupted)
+            pbar.close()
+        if errors:
+            raise errors[0]
+
+    def _dump_concurrently(self, path: Path) -> None:
+        # the other loops may be changing the states (e.g. the trace) while they are pickled
+        for _ in range(3):
+            try:
+                self.dump(path)
+                return
+            except RuntimeError as e:
+                error = e
+        # the next snapshot saves all the items again instead of referring to the ones of a lost snapshot
+        self.__dict__.pop("_checkpoint", None)
+        logger.error(f"Failed to save the snapshot {path}: {error}")
+
     def dump(self, path: str | Path) -> None:
         if RD_Agent_TIMER_wrapper.timer.started:
             RD_Agent_TIMER_wrapper.timer.update_remain_time()
         path = Path(path)
         path.parent.mkdir(parents=True, exist_ok=True)
-        with path.open("wb") as f:
-            pickle.dump(self, f)
+        with PROFILER.span("dump", cat="pickle"):
+            if path.parent.parent == self.session_folder:
+                # the snapshots of a session share the file contents of the workspaces in `<session folder>/blobs`
+                with WORKSPACE_BLOB_STORE.persist_to(self.session_folder / self.BLOB_FOLDER):
+                    self._dump_checkpoint(path)
+            else:
+                with path.open("wb") as f:
+                    _SnapshotPickler(f, self._excluded_ids()).dump(self)
+        PROFILER.flush()
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("_checkpoint", None)
+        return state
+
+    def _resolve_attribute(self, attr: str) -> Any:
+        obj: Any = self
+        for name in attr.split("."):
+            obj = getattr(obj, name, None)
+        return obj
+
+    def _append_only_items(self) -> list[Any]:
+        items: dict[int, Any] = {}
+        for attr in self.checkpoint_append_only_attributes:
+            obj = self._resolve_attribute(attr)
+            if isinstance(obj, list):
+                items.update((id(item), item) for item in obj)
+        return list(items.values())
+
+    def _excluded_ids(self) -> set[int]:
+        objs = (self._resolve_attribute(attr) for attr in self.checkpoint_excluded_attributes)
+        return {id(obj) for obj in objs if obj is not None}
+
+    def _dump_checkpoint(self, path: Path) -> None:
+        """
+        Save a session snapshot in the delta format. The file holds two pickles:
+
+        1. the header: {"version": ..., "items": [the items appended to `checkpoint_append_only_attributes` since
+           the last snapshot]}
+        2. the loop, where the items saved by this or the former snapshots are referred to by (snapshot, index).
+
+        So a snapshot only saves the new items of the history instead of the whole history.
+        Every `RD_AGENT_SETTINGS.session_checkpoint_compact_interval` snapshots (and the first snapshot after loading),
+        all the items are saved again, so a snapshot depends on a bounded number of former snapshots.
+        """
+        checkpoint = cast(Optional[_CheckpointState], self.__dict__.get("_checkpoint"))
+        interval = RD_AGENT_SETTINGS.session_checkpoint_compact_interval
+        if (
+            checkpoint is None
+            or checkpoint.session_folder != self.session_folder
+            or interval <= 0
+            or checkpoint.count >= interval
+        ):
+            checkpoint = self.__dict__["_checkpoint"] = _CheckpointState(self.session_folder)
+        snapshot = path.relative_to(self.session_folder).as_posix()
+        items = [item for item in self._append_only_items() if id(item) not in checkpoint.refs]
+
+        # the refs to the items of this snapshot are kept only after it is saved
+        staged: dict[int, tuple[str, int, Any]] = {}
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        try:
+            with tmp_path.open("wb") as f:
+                pickler = _SnapshotPickler(f, self._excluded_ids())
+                pickler.persistent_id = functools.partial(  # type: ignore[method-assign]
+                    checkpoint.persistent_id, staged=staged
+                )
+                pickler.dump({"version": self.CHECKPOINT_VERSION, "items": items})
+                # the loop refers to the items saved in the header
+                staged.update((id(item), (snapshot, index, item)) for index, item in enumerate(items))
+                pickler.clear_memo()
+                pickler.dump(self)
+            os.replace(tmp_path, path)  # a crash never leaves a broken snapshot
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            # the refs may be inconsistent with the saved snapshots, so the next snapshot saves all the items again
+            self.__dict__.pop("_checkpoint", None)
+            raise
+        checkpoint.refs.update(staged)
+        checkpoint.count += 1
+
+    @classmethod
+    def _load_checkpoint(cls, path: Path) -> "LoopBase":
+        """Load a snapshot saved by `_dump_checkpoint` (or a whole pickled loop saved by the former versions)"""
+        session_folder = path.parent.parent
+        items: dict[str, list[Any]] = {}
+
+        def persistent_load(pid: Any) -> Any:
+            snapshot, index = pid
+            if snapshot not in items:
+                with (session_folder / snapshot).open("rb") as f:
+                    items[snapshot] = unpickler(f).load()["items"]
+            return items[snapshot][index]
+
+        def unpickler(f: Any) -> pickle.Unpickler:
+            u = pickle.Unpickler(f)
+            u.persistent_load = persistent_load  # type: ignore[method-assign]
+            return u
+
+        with path.open("rb") as f:
+            header = unpickler(f).load()
+            if isinstance(header, LoopBase):
+                return header
+            items[path.relative_to(session_folder).as_posix()] = header["items"]
+            return cast(LoopBase, unpickler(f).load())
 
     @classmethod
     def load(
@@ -210,8 +487,9 @@ class LoopBase:
         replace_timer: bool = True,
     ) -> "LoopBase":
         path = Path(path)
-        with path.open("rb") as f:
-            session = cast(LoopBase, pickle.load(f))
+        # the snapshots are saved as `<session folder>/<loop>/<step>`
+        WORKSPACE_BLOB_STORE.attach(path.parent.parent / cls.BLOB_FOLDER)
+        session = cls._load_checkpoint(path)
 
         # set session folder
         # - P1: if output_path explicitly specified.
@@ -241,6 +519,35 @@ class LoopBase:
         return session
 
 
+class _SnapshotPickler(pickle.Pickler):
+    """Pickle the objects of `excluded` (by id) as None"""
+
+    def __init__(self, file: Any, excluded: set[int]) -> None:
+        super().__init__(file)
+        self.excluded = excluded
+
+    def reducer_override(self, obj: Any) -> Any:
+        if id(obj) in self.excluded:
+            return type(None), ()
+        return NotImplemented
+
+
+class _CheckpointState:
+    """The items saved by the snapshots since the last full snapshot, in the dumping process"""
+
+    def __init__(self, session_folder: Path) -> None:
+        self.session_folder = session_folder
+        self.refs: dict[int, tuple[str, int, Any]] = {}  # id(item) -> (snapshot, index, item)
+        self.count = 0
+
+    def persistent_id(self, obj: Any, staged: dict[int, tuple[str, int, Any]] | None = None) -> Any:
+        """The ref of `obj` if it is saved by a former snapshot (or `staged` in the current one)"""
+        ref = self.refs.get(id(obj))
+        if ref is None and staged is not None:
+            ref = staged.get(id(obj))
+        return ref[:2] if ref is not None and ref[2] is obj else None
+
+
 ASpecificRet = TypeVar("ASpecificRet")
 
 
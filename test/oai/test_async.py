@@ -0,0 +1,64 @@
+import asyncio
+import time
+import unittest
+from typing import Any
+
+import pytest
+
+from rdagent.oai.backend.base import APIBackend
+from rdagent.oai.backend.rate_limit import RateLimiter, TokenBucket
+
+
+class EchoBackend(APIBackend):
+    """A backend answering the user prompt back after a delay"""
+
+    def __init__(self) -> None:
+        super().__init__(use_chat_cache=False, dump_chat_cache=False, use_embedding_cache=False, dump_embedding_cache=False)
+        self.calls = 0
+
+    def _calculate_token_from_messages(self, messages: list[dict[str, Any]]) -> int:
+        return 0
+
+    def _create_embedding_inner_function(self, input_content_list: list[str], *args, **kwargs) -> list[list[float]]:
+        return [[float(len(content))] for content in input_content_list]
+
+    def _create_chat_completion_inner_function(self, messages, json_mode=False, *args, **kwargs):
+        self.calls += 1
+        time.sleep(0.2)
+        return messages[-1]["content"], "stop"
+
+
+@pytest.mark.offline
+class AsyncRequestTest(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(limit_per_minute=60)  # 1 token per second
+        self.assertEqual(bucket.reserve(60), 0)
+        self.assertAlmostEqual(bucket.reserve(1), 1, places=1)
+        self.assertAlmostEqual(bucket.reserve(1), 2, places=1)
+        self.assertEqual(TokenBucket(limit_per_minute=None).reserve(10**6), 0)
+
+        limiter = RateLimiter(rpm=6000, tpm=60)
+        limiter.acquire(60)
+        start = time.monotonic()
+        asyncio.run(limiter.aacquire(1))
+        self.assertGreater(time.monotonic() - start, 0.5)
+
+    def test_concurrent_requests(self):
+        backend = EchoBackend()
+
+        async def run() -> list[str]:
+            return await asyncio.gather(
+                *[backend.abuild_messages_and_create_chat_completion(user_prompt=str(i)) for i in range(16)]
+            )
+
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(run()), [str(i) for i in range(16)])
+        self.assertLess(time.monotonic() - start, 16 * 0.2 / 2)
+        self.assertEqual(backend.calls, 16)
+
+        self.assertEqual(asyncio.run(backend.acreate_embedding(["a", "bb"])), [[1.0], [2.0]])
+        self.assertEqual(asyncio.run(backend.acreate_embedding("ccc")), [3.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import json
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rdagent.core.utils import multiprocessing_wrapper
+from rdagent.oai.backend.base import APIBackend, SessionChatHistoryCache, SQliteLazyCache
+from rdagent.oai.llm_conf import LLM_SETTINGS
+from rdagent.utils import md5_hash
+
+
+def _write_chat_cache(cache_location: str, i: int) -> str | None:
+    cache = SQliteLazyCache(cache_location=cache_location)
+    for j in range(50):
+        cache.chat_set(f"key-{i}-{j}", f"value-{i}-{j}")
+    return cache.chat_get(f"key-{i}-3")
+
+
+class CountingBackend(APIBackend):
+    def __init__(self) -> None:
+        super().__init__(use_chat_cache=True, dump_chat_cache=True, use_embedding_cache=True, dump_embedding_cache=True)
+        self.calls = 0
+
+    def _calculate_token_from_messages(self, messages: list[dict[str, Any]]) -> int:
+        return 0
+
+    def _create_embedding_inner_function(self, input_content_list: list[str], *args, **kwargs) -> list[list[float]]:
+        self.calls += 1
+        return [[float(len(content))] for content in input_content_list]
+
+    def _create_chat_completion_inner_function(self, messages, json_mode=False, *args, **kwargs):
+        self.calls += 1
+        return f"answer {self.calls}", "stop"
+
+
+@pytest.mark.offline
+class SQliteLazyCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_location = str(Path(self.tmp_dir.name) / "prompt_cache.db")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _count(self, table: str) -> int:
+        with sqlite3.connect(self.cache_location) as conn:
+            return conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+    def test_read_your_writes(self):
+        cache = SQliteLazyCache(cache_location=self.cache_location)
+        cache.chat_set("question", "answer")
+        cache.embedding_set({"content": [1.0, 2.0]})
+        cache.message_set("conversation", [{"role": "user", "content": "hi"}])
+        # pending writes are visible before they are committed
+        self.assertEqual(cache.chat_get("question"), "answer")
+        self.assertEqual(cache.embedding_get("content"), [1.0, 2.0])
+        self.assertEqual(cache.message_get("conversation"), [{"role": "user", "content": "hi"}])
+
+        cache.flush()
+        self.assertEqual(self._count("chat_cache"), 1)
+        self.assertEqual(cache.chat_get("question"), "answer")
+
+    def test_embedding_get_many(self):
+        cache = SQliteLazyCache(cache_location=self.cache_location)
+        cache.embedding_set({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+        cache.flush()
+        cache.embedding_set({"c": [5.0, 6.0]})  # pending
+        with sqlite3.connect(self.cache_location) as conn:
+            # a row written by older versions in JSON format
+            conn.execute(
+                "INSERT INTO embedding_cache (md5_key, embedding) VALUES (?, ?)",
+                (md5_hash("d"), json.dumps([7.0, 8.0])),
+            )
+
+        embeddings, mask = cache.embedding_get_many(["d", "a", "missing", "c", "b"])
+        self.assertEqual(mask.tolist(), [True, True, False, True, True])
+        self.assertEqual(embeddings.dtype, np.float32)
+        np.testing.assert_array_equal(embeddings, [[7.0, 8.0], [1.0, 2.0], [5.0, 6.0], [3.0, 4.0]])
+        self.assertEqual(cache.embedding_get("d"), [7.0, 8.0])
+
+        # the JSON row is migrated to the binary format
+        cache.flush()
+        with sqlite3.connect(self.cache_location) as conn:
+            (value,) = conn.execute("SELECT embedding FROM embedding_cache WHERE md5_key=?", (md5_hash("d"),)).fetchone()
+        self.assertIsInstance(value, bytes)
+
+        embeddings, mask = cache.embedding_get_many(["missing"])
+        self.assertEqual(embeddings.shape, (0, 0))
+        self.assertFalse(mask.any())
+
+    def test_lru_tier(self):
+        with mock.patch.object(LLM_SETTINGS, "prompt_cache_path", self.cache_location):
+            backend = CountingBackend()
+        cache = backend.cache
+        answer = backend.build_messages_and_create_chat_completion(user_prompt="question")
+        self.assertEqual(backend.build_messages_and_create_chat_completion(user_prompt="question"), answer)
+        self.assertEqual(backend.create_embedding(["a", "bb"]), [[1.0], [2.0]])
+        # the repeated requests are served by the in-memory tier without touching sqlite
+        with mock.patch.object(cache, "chat_get", side_effect=AssertionError), mock.patch.object(
+            cache, "_get_conn", side_effect=AssertionError
+        ):
+            hits = cache.stats()["chat"]["hits"]
+            self.assertEqual(backend.build_messages_and_create_chat_completion(user_prompt="question"), answer)
+            self.assertEqual(cache.stats()["chat"]["hits"], hits + 1)
+            self.assertEqual(backend.create_embedding(["bb", "a"]), [[2.0], [1.0]])
+        self.assertEqual(backend.calls, 2)
+        self.assertNotEqual(backend.build_messages_and_create_chat_completion(user_prompt="question2"), answer)
+
+    def test_embedding_pipeline(self):
+        with mock.patch.object(LLM_SETTINGS, "prompt_cache_path", self.cache_location):
+            backend = CountingBackend()
+        contents = [f"content {i}" for i in range(10)]
+        with mock.patch.object(LLM_SETTINGS, "embedding_max_str_num", 3), mock.patch.object(
+            backend.cache, "embedding_set", wraps=backend.cache.embedding_set
+        ) as embedding_set:
+            embeddings = backend.create_embedding(contents + contents[::-1])
+            # the duplicated contents are only requested once & the results are written in one batch
+            self.assertEqual(backend.calls, 4)
+            embedding_set.assert_called_once()
+        self.assertEqual(embeddings, [[float(len(c))] for c in contents + contents[::-1]])
+
+        with mock.patch.object(LLM_SETTINGS, "embedding_max_tokens_per_request", 10):
+            chunks = APIBackend._split_embedding_chunks(["a" * 40, "b" * 40, "c", "d"])
+        # an oversized content is still sent alone
+        self.assertEqual(chunks, [["a" * 40], ["b" * 40], ["c", "d"]])
+
+    def test_chat_session_history(self):
+        with mock.patch.object(LLM_SETTINGS, "prompt_cache_path", self.cache_location):
+            backend = CountingBackend()
+            session = backend.build_chat_session(session_system_prompt="system")
+            for i in range(3):
+                session.build_chat_completion(f"question {i}")
+            backend.cache.flush()
+            # every turn only appends its new messages
+            self.assertEqual(self._count("message_log"), 1 + 3 * 2)
+            messages = backend.cache.message_get(session.get_conversation_id())
+            self.assertEqual([m["role"] for m in messages], ["system"] + ["user", "assistant"] * 3)
+            self.assertEqual(backend.cache.message_get(session.get_conversation_id(), start_turn=5), messages[5:])
+
+            with mock.patch.object(LLM_SETTINGS, "max_session_history_messages", 2):
+                truncated = session.build_chat_completion_message("question 3")
+            self.assertEqual(truncated, [messages[0], messages[-1], {"role": "user", "content": "question 3"}])
+
+            # the sessions in the legacy format are migrated when they are loaded
+            legacy = [{"role": "system", "content": "legacy"}, {"role": "user", "content": "hi"}]
+            with sqlite3.connect(self.cache_location) as conn:
+                conn.execute(
+                    "INSERT INTO message_cache (conversation_id, message) VALUES (?, ?)", ("legacy", json.dumps(legacy))
+                )
+            session = backend.build_chat_session(conversation_id="legacy")
+            self.assertEqual(session.build_chat_completion_message("next")[:2], legacy)
+            backend.cache.flush()
+            self.assertEqual(self._count("message_log"), 1 + 3 * 2 + 2)
+
+    def test_session_history_eviction(self):
+        with mock.patch.object(LLM_SETTINGS, "prompt_cache_path", self.cache_location), mock.patch.object(
+            LLM_SETTINGS, "session_history_cache_size", 1
+        ):
+            backend = CountingBackend()
+            sessions = [backend.build_chat_session(session_system_prompt="system") for _ in range(2)]
+            for i in range(2):
+                for session in sessions:
+                    session.build_chat_completion(f"question {i}")
+            # only the latest used history is kept in memory; the other one is read again from the cache
+            histories = SessionChatHistoryCache()._histories
+            self.assertEqual(list(histories), [sessions[-1].get_conversation_id()])
+            for session in sessions:
+                messages = session.build_chat_completion_message("next")
+                questions = [m["content"] for m in messages if m["role"] == "user"]
+                self.assertEqual(questions, ["question 0", "question 1", "next"])
+            self.assertEqual(len(histories), 1)
+
+    def test_concurrent_writers(self):
+        cache = SQliteLazyCache(cache_location=self.cache_location)
+        cache.chat_set("main", "value")
+        res = multiprocessing_wrapper([(_write_chat_cache, (self.cache_location, i)) for i in range(8)], n=4)
+        self.assertEqual(res, [f"value-{i}-3" for i in range(8)])
+        cache.flush()
+        self.assertEqual(self._count("chat_cache"), 8 * 50 + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from types import SimpleNamespace
+
+import pytest
+
+from rdagent.oai.backend.litellm import LiteLLMAPIBackend
+
+ANTHROPIC_MODEL = "anthropic/claude-3-5-sonnet-20240620"
+
+
+def _marked(message: dict) -> bool:
+    content = message["content"]
+    return isinstance(content, list) and content[0]["cache_control"] == {"type": "ephemeral"}
+
+
+@pytest.mark.offline
+class PromptCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.backend = LiteLLMAPIBackend()
+
+    def prepare(self, messages: list[dict], model: str = ANTHROPIC_MODEL) -> list[dict]:
+        return self.backend._prepare_prompt_cache_messages(messages, model)
+
+    def test_system_first(self):
+        messages = [
+            {"role": "user", "content": "q1"},
+            {"role": "system", "content": "s"},
+            {"role": "assistant", "content": "a1"},
+            {"role": "user", "content": "q2"},
+        ]
+        prepared = self.prepare(messages)
+        # the system messages are moved to the front while the order of the conversation is kept
+        self.assertEqual([m["role"] for m in prepared], ["system", "user", "assistant", "user"])
+        self.assertEqual(prepared[1]["content"], "q1")
+        self.assertEqual(messages[0], {"role": "user", "content": "q1"})  # the original messages are not modified
+
+    def test_breakpoints(self):
+        # one message: the new prompt only, nothing is stable
+        self.assertEqual(self.prepare([{"role": "user", "content": "q"}]), [{"role": "user", "content": "q"}])
+
+        # two messages: the system prompt is the stable prefix
+        prepared = self.prepare([{"role": "system", "content": "s"}, {"role": "user", "content": "q"}])
+        self.assertEqual([_marked(m) for m in prepared], [True, False])
+        self.assertEqual(prepared[0]["content"][0]["text"], "s")
+
+        # N messages: the end of the system prompt & the end of the history
+        messages = [{"role": "system", "content": "s"}]
+        for i in range(3):
+            messages += [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}]
+        messages.append({"role": "user", "content": "new"})
+        prepared = self.prepare(messages)
+        self.assertEqual([i for i, m in enumerate(prepared) if _marked(m)], [0, len(messages) - 2])
+        self.assertEqual(prepared[-1], {"role": "user", "content": "new"})
+
+    def test_automatic_cache_provider(self):
+        messages = [
+            {"role": "user", "content": "q1"},
+            {"role": "system", "content": "s"},
+            {"role": "user", "content": "q2"},
+        ]
+        # neither reordered nor marked
+        self.assertEqual(self.prepare(messages, model="gpt-4o"), messages)
+
+    def test_cached_tokens(self):
+        openai_usage = SimpleNamespace(prompt_tokens_details=SimpleNamespace(cached_tokens=128))
+        anthropic_usage = SimpleNamespace(prompt_tokens_details=None, cache_read_input_tokens=64)
+        self.assertEqual(LiteLLMAPIBackend._get_cached_tokens(openai_usage), 128)
+        self.assertEqual(LiteLLMAPIBackend._get_cached_tokens(anthropic_usage), 64)
+        self.assertEqual(LiteLLMAPIBackend._get_cached_tokens(SimpleNamespace()), 0)
+        self.assertEqual(LiteLLMAPIBackend._get_cached_tokens(None), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import time
+import unittest
+from types import SimpleNamespace
+
+import pytest
+
+from rdagent.oai.backend.retry import (
+    LLM_CIRCUIT_BREAKER,
+    CircuitBreaker,
+    RetryBudgetExceeded,
+    RetryState,
+    classify_error,
+    parse_retry_after,
+)
+from rdagent.oai.llm_conf import LLM_SETTINGS
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code: int, headers: dict | None = None) -> None:
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+@pytest.mark.offline
+class RetryTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        # the simulated errors are recorded by the circuit breaker shared by the process
+        LLM_CIRCUIT_BREAKER.record_success()
+
+    def test_classify_error(self):
+        self.assertEqual(classify_error(FakeAPIError(429)), "rate_limit")
+        self.assertEqual(classify_error(FakeAPIError(503)), "server")
+        self.assertEqual(classify_error(APITimeoutError()), "timeout")
+        self.assertEqual(classify_error(ConnectionResetError()), "connection")
+        self.assertEqual(classify_error(json.decoder.JSONDecodeError("", "", 0)), "other")
+        self.assertEqual(classify_error(FakeAPIError(400)), "other")
+
+    def test_retry_after(self):
+        self.assertEqual(parse_retry_after(FakeAPIError(429, {"retry-after": "7"})), 7)
+        self.assertEqual(parse_retry_after(FakeAPIError(429, {"retry-after-ms": "1500"})), 1.5)
+        self.assertIsNone(parse_retry_after(FakeAPIError(429)))
+        self.assertIsNone(parse_retry_after(ValueError()))
+
+        state = RetryState()
+        wait = state.on_error(FakeAPIError(429, {"retry-after": "5"}))
+        self.assertGreaterEqual(wait, 5)
+
+    def test_budget_and_backoff(self):
+        state = RetryState()
+        waits = [state.on_error(FakeAPIError(500)) for _ in range(LLM_SETTINGS.retry_budgets["server"] - 1)]
+        # equal jitter: the waiting time is in [backoff / 2, backoff]
+        for n, wait in enumerate(waits):
+            backoff = min(LLM_SETTINGS.retry_max_wait_seconds, LLM_SETTINGS.retry_wait_seconds * 2**n)
+            self.assertTrue(backoff / 2 <= wait <= backoff)
+        with self.assertRaises(RetryBudgetExceeded):
+            state.on_error(FakeAPIError(500))
+        # the other errors are not limited by the budgets
+        for _ in range(20):
+            self.assertEqual(state.on_error(ValueError()), LLM_SETTINGS.retry_wait_seconds)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=0.3)
+        breaker.record_failure()
+        self.assertEqual(breaker.wait_time(), 0)
+        breaker.record_failure()
+        self.assertGreater(breaker.wait_time(), 0.1)
+        time.sleep(0.3)
+        self.assertEqual(breaker.wait_time(), 0)
+        breaker.record_failure()  # failed again in half open state
+        self.assertGreater(breaker.wait_time(), 0.1)
+        breaker.record_success()
+        self.assertEqual(breaker.wait_time(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from unittest import mock
+
+import pytest
+from litellm import token_counter
+
+from rdagent.log import rdagent_logger as logger
+from rdagent.oai.backend import litellm as litellm_backend
+from rdagent.oai.backend.litellm import count_message_tokens
+from rdagent.oai.backend.usage import UsageLedger, UsageRecord
+
+
+@pytest.mark.offline
+class UsageTest(unittest.TestCase):
+    def test_count_message_tokens(self):
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "Hello world! " * 20},
+        ]
+        self.assertEqual(count_message_tokens("gpt-4o", messages), token_counter(model="gpt-4o", messages=messages))
+
+    def test_token_count_memo(self):
+        texts = [f"prompt {i} " * 100 for i in range(5)]
+        with mock.patch.object(litellm_backend, "_TOKEN_COUNTS_MAX_SIZE", 3):
+            for text in texts + texts[-1:]:
+                self.assertEqual(
+                    litellm_backend._count_text_tokens("gpt-4o", text), token_counter(model="gpt-4o", text=text)
+                )
+            # the memo is bounded and keeps the digests of the texts instead of the texts
+            self.assertLessEqual(len(litellm_backend._TOKEN_COUNTS), 3)
+            self.assertTrue(all(len(digest) == 16 for _, digest in litellm_backend._TOKEN_COUNTS))
+
+    def test_current_tag(self):
+        with logger.tag("Loop_0"), logger.tag("coding"):
+            self.assertEqual(logger.current_tag, "Loop_0.coding")
+        self.assertEqual(logger.current_tag, "")
+
+    def test_ledger(self):
+        ledger = UsageLedger()
+        ledger.record("Loop_0.coding", UsageRecord(calls=1, prompt_tokens=10, cost=0.5, latency=1.0))
+        ledger.record("Loop_0.coding", UsageRecord(calls=1, prompt_tokens=5, cost=0.25, latency=2.0))
+        ledger.record("Loop_1.coding", UsageRecord(calls=1, completion_tokens=3, cost=1.0))
+        self.assertEqual(ledger.to_dict()["Loop_0.coding"]["prompt_tokens"], 15)
+        self.assertEqual(ledger.total("Loop_0").latency, 3.0)
+        self.assertEqual(ledger.total().cost, 1.75)
+        self.assertEqual(ledger.total().calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from rdagent.components.coder.data_science.conf import DS_CODER_COSTEER_SETTINGS
+from rdagent.components.coder.data_science.share.checks import (
+    Check,
+    overlay_path,
+    run_checks,
+)
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.core.experiment import FBWorkspace
+from rdagent.utils.env import LocalConf, LocalEnv
+
+SLOW_SCRIPT = "import time, pathlib\ntime.sleep(1)\npathlib.Path('{out}').write_text('done')\nprint('{out} done')\n"
+
+
+@pytest.mark.offline
+class ChecksTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name)
+        self.workspace = FBWorkspace()
+        self.workspace.workspace_path = self.path / "ws"
+        self.workspace.inject_files(**{"main.py": SLOW_SCRIPT.format(out="main.txt"), "util.py": "X = 1\n"})
+        self.env = LocalEnv(conf=LocalConf(default_entry="", enable_cache=False))
+        self.patchers = [
+            mock.patch.object(RD_AGENT_SETTINGS, "pickle_cache_folder_path_str", str(self.path / "cache")),
+            # filtering the stdout needs the tokenizer of the LLM
+            mock.patch.object(FBWorkspace, "shrink_stdout", staticmethod(lambda stdout: stdout)),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self) -> None:
+        for patcher in self.patchers:
+            patcher.stop()
+        self.tmp_dir.cleanup()
+
+    def test_run_checks(self):
+        checks = [
+            Check("unit", f"{sys.executable} test/unit.py", files={"test/unit.py": SLOW_SCRIPT.format(out="unit.txt")}),
+            Check("main", f"{sys.executable} main.py", in_place=True, requires="unit"),
+        ]
+        start = time.time()
+        results = run_checks(self.workspace, self.env, checks)
+        # the whole workflow runs speculatively at the same time as the test it requires
+        self.assertLess(time.time() - start, 1.9)
+        self.assertEqual([code for _, code in results], [0, 0])
+        self.assertIn("unit.txt done", results[0][0])
+
+        # every check has its own outputs; the outputs of the overlay are removed after the check
+        overlay = overlay_path(self.workspace, "unit")
+        self.assertEqual(sorted(p.name for p in overlay.iterdir()), ["main.py", "test", "util.py"])
+        self.assertTrue((self.workspace.workspace_path / "main.txt").exists())
+        self.assertFalse((self.workspace.workspace_path / "unit.txt").exists())
+        self.assertIn("test/unit.py", self.workspace.file_dict)
+
+        # only the changed files are written into the overlay again
+        mtime = (overlay / "test" / "unit.py").stat().st_mtime_ns
+        self.workspace.inject_files(**{"util.py": "X = 2\n", "main.py": self.workspace.DEL_KEY})
+        checks[0].files = {}
+        run_checks(self.workspace, self.env, checks[:1])
+        self.assertEqual((overlay / "util.py").read_text(), "X = 2\n")
+        self.assertFalse((overlay / "main.py").exists())
+        self.assertEqual((overlay / "test" / "unit.py").stat().st_mtime_ns, mtime)
+
+    def test_required_check(self):
+        checks = [
+            Check("unit", f"{sys.executable} test/unit.py", files={"test/unit.py": "raise SystemExit(1)\n"}),
+            Check("main", f"{sys.executable} main.py", in_place=True, requires="unit"),
+        ]
+        results = run_checks(self.workspace, self.env, checks)
+        # the result of the whole workflow is discarded if the test fails
+        self.assertEqual(results[0][1], 1)
+        self.assertIsNone(results[1])
+
+        # one by one, the whole workflow does not even run
+        (self.workspace.workspace_path / "main.txt").unlink()
+        with mock.patch.object(DS_CODER_COSTEER_SETTINGS, "parallel_eval_checks", 1):
+            results = run_checks(self.workspace, self.env, checks)
+        self.assertIsNone(results[1])
+        self.assertFalse((self.workspace.workspace_path / "main.txt").exists())
+
+        self.workspace.inject_files(**{"test/unit.py": "print('ok')\n"})
+        checks[0].files = {}
+        results = run_checks(self.workspace, self.env, checks)
+        self.assertEqual([code for _, code in results], [0, 0])
+        self.assertTrue((self.workspace.workspace_path / "main.txt").exists())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import threading
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rdagent.components.coder.CoSTEER import CoSTEER
+from rdagent.components.coder.CoSTEER.config import CoSTEERSettings
+from rdagent.components.coder.CoSTEER.evaluators import (
+    CoSTEERMultiFeedback,
+    CoSTEERSingleFeedback,
+)
+from rdagent.components.coder.CoSTEER.evolvable_subjects import EvolvingItem
+from rdagent.components.coder.CoSTEER.evolving_agent import PipelinedRAGEvoAgent
+from rdagent.components.coder.CoSTEER.evolving_strategy import (
+    MultiProcessEvolvingStrategy,
+)
+from rdagent.core.evolving_agent import RAGEvaluator
+from rdagent.core.evolving_framework import EvolvingStrategy
+from rdagent.core.exception import CoderError
+from rdagent.core.experiment import Experiment, Task
+
+# the number of attempts each task needs to pass; "never" always fails
+NEEDED_ATTEMPTS = {"fast": 1, "slow": 3, "never": 100}
+
+
+class CountingStrategy(MultiProcessEvolvingStrategy):
+    def __init__(self) -> None:
+        super().__init__(scen=None, settings=None)
+        self.attempts: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def implement_one_task(self, target_task, queried_knowledge=None, workspace=None, prev_task_feedback=None):
+        with self.lock:
+            self.attempts[target_task.name] += 1
+            return self.attempts[target_task.name]
+
+    def assign_code_list_to_evo(self, code_list, evo):
+        for index, code in enumerate(code_list):
+            if code is not None:
+                evo.sub_workspace_list[index] = code
+        return evo
+
+
+class AttemptEvaluator(RAGEvaluator):
+    def evaluate(self, eo, queried_knowledge=None):
+        return CoSTEERMultiFeedback(
+            [
+                CoSTEERSingleFeedback(
+                    execution="", return_checking=None, code="", final_decision=attempts >= NEEDED_ATTEMPTS[task.name]
+                )
+                for task, attempts in zip(eo.sub_tasks, eo.sub_workspace_list)
+            ]
+        )
+
+
+@pytest.mark.offline
+class PipelinedEvoAgentTest(unittest.TestCase):
+    def test_multistep_evolve(self):
+        strategy = CountingStrategy()
+        agent = PipelinedRAGEvoAgent(max_loop=5, evolving_strategy=strategy, rag=None, max_workers=3)
+        evo = EvolvingItem(sub_tasks=[Task(name) for name in NEEDED_ATTEMPTS])
+        snapshots = list(agent.multistep_evolve(evo, AttemptEvaluator()))
+
+        # every task stops as soon as it passes (or runs out of loops)
+        self.assertEqual(strategy.attempts, {"fast": 1, "slow": 3, "never": 5})
+        self.assertEqual(len(snapshots), len(agent.evolving_trace))
+        final_feedback = agent.evolving_trace[-1].feedback
+        self.assertEqual([fb.final_decision for fb in final_feedback], [True, True, False])
+        self.assertEqual(len(agent.knowledge_trace), 1 + 3 + 5)
+        # the snapshots are not changed by the later rounds
+        self.assertEqual(snapshots[0].sub_workspace_list, [1, 1, 1])
+        self.assertEqual(snapshots[-1].sub_workspace_list, [1, 3, 5])
+        self.assertEqual(evo.sub_workspace_list, [1, 3, 5])
+
+    def test_max_seconds(self):
+        strategy = CountingStrategy()
+        agent = PipelinedRAGEvoAgent(
+            max_loop=100, evolving_strategy=strategy, rag=None, max_workers=3, max_seconds=0.5
+        )
+        evo = EvolvingItem(sub_tasks=[Task(name) for name in NEEDED_ATTEMPTS])
+        strategy.implement_one_task = lambda target_task, *args: time.sleep(0.1) or 0
+        start = time.time()
+        snapshots = list(agent.multistep_evolve(evo, AttemptEvaluator()))
+        # no round is started after the limit, however many rounds are left
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual([fb.final_decision for fb in agent.evolving_trace[-1].feedback], [False] * 3)
+        self.assertTrue(snapshots)
+
+    def test_query_during_generation(self):
+        generations, queries = [], []
+
+        class SlowRAG:
+            def generate_knowledge(self, trace):
+                start = time.monotonic()
+                time.sleep(0.1)
+                generations.append((start, time.monotonic()))
+
+            def query(self, evo, trace):
+                queries.append(time.monotonic())
+
+        agent = PipelinedRAGEvoAgent(
+            max_loop=5,
+            evolving_strategy=CountingStrategy(),
+            rag=SlowRAG(),
+            max_workers=3,
+            with_knowledge=True,
+            knowledge_self_gen=True,
+        )
+        evo = EvolvingItem(sub_tasks=[Task(name) for name in NEEDED_ATTEMPTS])
+        list(agent.multistep_evolve(evo, AttemptEvaluator()))
+        # the sub-tasks query the knowledge while the knowledge of the others is generated
+        self.assertTrue(any(start < t < end for t in queries for start, end in generations))
+
+
+class NamingStrategy(EvolvingStrategy):
+    def evolve(self, *, evo, **kwargs):
+        time.sleep(0.02)
+        evo.sub_workspace_list = [task.name for task in evo.sub_tasks]
+        return evo
+
+
+class NameEvaluator(RAGEvaluator):
+    def evaluate(self, eo, queried_knowledge=None):
+        time.sleep(0.05)
+        return CoSTEERMultiFeedback(
+            [
+                CoSTEERSingleFeedback(execution="", return_checking=None, code="", final_decision=name == "fast")
+                for name in eo.sub_workspace_list
+            ]
+        )
+
+
+@pytest.mark.offline
+class CoSTEERConcurrencyTest(unittest.TestCase):
+    def test_concurrent_develop(self):
+        """The loops running `coding` at the same time share the coder"""
+        coder = CoSTEER(
+            CoSTEERSettings(),
+            NameEvaluator(),
+            NamingStrategy(scen=None),
+            evolving_version=1,
+            scen=None,
+            with_knowledge=False,
+            knowledge_self_gen=False,
+            max_loop=3,
+        )
+
+        def develop(names: list[str]):
+            exp = Experiment(sub_tasks=[Task(name) for name in names])
+            try:
+                return coder.develop(exp)
+            except CoderError:
+                return exp.prop_dev_feedback
+
+        experiments = [["never"], ["fast", "never", "never"]] * 4
+        with ThreadPoolExecutor(max_workers=len(experiments)) as executor:
+            results = list(executor.map(develop, experiments))
+
+        for names, result in zip(experiments, results):
+            if "fast" in names:
+                # the coding is judged by the feedback of its own experiment
+                self.assertIsInstance(result, Experiment)
+                self.assertEqual(result.sub_workspace_list, names)
+                self.assertEqual([fb.final_decision for fb in result.prop_dev_feedback], [True, False, False])
+            else:
+                self.assertEqual([fb.final_decision for fb in result], [False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from rdagent.core.blob_store import WORKSPACE_BLOB_STORE, BlobStore, FileDict
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.core.experiment import FBWorkspace
+
+
+@pytest.mark.offline
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_copy_on_write(self):
+        ws = FBWorkspace()
+        ws.file_dict.update({"main.py": "print(1)", "data.bin": b"\x00"})
+        ws_copy = ws.copy()
+        self.assertEqual(ws_copy.file_dict, {"main.py": "print(1)", "data.bin": b"\x00"})
+        # the contents are shared instead of being copied
+        self.assertIs(ws_copy.file_dict["main.py"], ws.file_dict["main.py"])
+
+        ws_copy.file_dict["main.py"] = "print(2)"
+        del ws_copy.file_dict["data.bin"]
+        self.assertEqual(ws.file_dict, {"main.py": "print(1)", "data.bin": b"\x00"})
+        self.assertEqual(ws_copy.file_dict, {"main.py": "print(2)"})
+
+        # the pickles are self-contained by default
+        loaded = pickle.loads(pickle.dumps(ws))
+        self.assertEqual(loaded.file_dict, ws.file_dict)
+
+    def test_persist(self):
+        file_dicts = [FileDict({"main.py": "x = 1", "spec.md": f"spec {i}"}) for i in range(3)]
+        with WORKSPACE_BLOB_STORE.persist_to(self.path / "blobs"):
+            dumped = pickle.dumps(file_dicts)
+        # the common content is saved once, outside the pickle
+        self.assertEqual(len(list((self.path / "blobs").iterdir())), 4)
+        self.assertNotIn(b"x = 1", dumped)
+        self.assertEqual(pickle.loads(dumped), file_dicts)
+
+        # a fresh store reads the blobs from the attached folder on demand
+        store = BlobStore()
+        store.attach(self.path / "blobs")
+        self.assertEqual(store.get(file_dicts[0].key("main.py")), "x = 1")
+        with self.assertRaises(KeyError):
+            BlobStore().get(file_dicts[0].key("main.py"))
+
+    def test_bounded_memory(self):
+        store = BlobStore()
+        with mock.patch.object(RD_AGENT_SETTINGS, "workspace_blob_memory_chars", 25):
+            saved = store.put("saved " * 2)
+            with store.persist_to(self.path / "blobs"):
+                store._persist([saved])
+            keys = [store.put(f"content {i}") for i in range(5)]
+            # only the latest contents are kept in memory
+            self.assertLessEqual(store._chars, 25)
+            self.assertNotIn(saved, store._blobs)
+            # the dropped contents are read again from the saved (or the spilled) files
+            self.assertEqual(store.get(saved), "saved " * 2)
+            self.assertEqual([store.get(key) for key in keys], [f"content {i}" for i in range(5)])
+        self.assertEqual([p.name for p in (self.path / "blobs").iterdir()], [saved])
+
+    def test_legacy_pickle(self):
+        ws = FBWorkspace()
+        ws.__dict__["file_dict"] = {"main.py": "print(1)"}  # the workspaces pickled by older versions
+        loaded = pickle.loads(pickle.dumps(ws))
+        self.assertIsInstance(loaded.file_dict, FileDict)
+        self.assertEqual(loaded.file_dict, {"main.py": "print(1)"})
+
+    def test_inject_only_changed_files(self):
+        ws = FBWorkspace()
+        ws.workspace_path = self.path / "ws"
+        ws.inject_files(**{"main.py": "print(1)", "test/test.py": "print(2)"})
+
+        def written_by(workspace: FBWorkspace, **files: str) -> list[str]:
+            with mock.patch.object(Path, "write_text", autospec=True, side_effect=Path.write_text) as write_text:
+                workspace.inject_files(**files)
+            return sorted(str(call.args[0].relative_to(ws.workspace_path)) for call in write_text.call_args_list)
+
+        def written(**files: str) -> list[str]:
+            return written_by(ws, **files)
+
+        # e.g. before every execution
+        self.assertEqual(written(**ws.file_dict), [])
+        self.assertEqual(written(**{"main.py": "print(3)", "test/test.py": "print(2)"}), ["main.py"])
+        # the files changed or removed on the disk are written again
+        (ws.workspace_path / "main.py").write_text("print(100)")
+        (ws.workspace_path / "test" / "test.py").unlink()
+        self.assertEqual(written(**ws.file_dict), ["main.py", "test/test.py"])
+        self.assertEqual((ws.workspace_path / "main.py").read_text(), "print(3)")
+        # a copy sharing the folder writes all its files first, whatever the original wrote in the meantime
+        ws_copy = ws.copy()
+        ws.inject_files(**{"main.py": "print(4)"})  # the same size within the same mtime tick
+        self.assertEqual(sorted(written_by(ws_copy, **ws_copy.file_dict)), ["main.py", "test/test.py"])
+        self.assertEqual((ws.workspace_path / "main.py").read_text(), "print(3)")
+        # a same-size write by another writer is noticed even if the mtime is the same (e.g. within one tick)
+        ws.inject_files(**{"main.py": "print(5)"})
+        target = ws.workspace_path / "main.py"
+        st = target.stat()
+        (ws.workspace_path / "main.py.tmp").write_text("print(6)")
+        os.replace(ws.workspace_path / "main.py.tmp", target)
+        os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(written(**{"main.py": "print(5)"}), ["main.py"])
+        self.assertEqual(target.read_text(), "print(5)")
+        # a copy moved to another folder writes its own files
+        ws_copy = ws.copy()
+        ws_copy.workspace_path = self.path / "ws_copy"
+        ws_copy.inject_files(**ws_copy.file_dict)
+        self.assertEqual((ws_copy.workspace_path / "test" / "test.py").read_text(), "print(2)")
+
+
+if __name__ == "__main__":
+    unittest.main()
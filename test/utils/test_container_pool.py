@@ -0,0 +1,126 @@
+import os
+import socket
+import unittest
+from types import SimpleNamespace
+
+import pytest
+
+from rdagent.utils.env import ContainerPool, ContainerPoolUnavailable
+
+CONF = SimpleNamespace(container_pool_size=2, container_max_reuse=3)
+
+
+class FakeContainer:
+    def __init__(self, name: str, status: str = "running", labels: dict | None = None) -> None:
+        self.id = name
+        self.status = status
+        self.labels = labels or {}
+        self.reset_exit_code = 0
+        self.removed = False
+
+    def reload(self) -> None:
+        pass
+
+    def exec_run(self, command: str) -> SimpleNamespace:
+        return SimpleNamespace(exit_code=self.reset_exit_code)
+
+    def remove(self, force: bool = False) -> None:
+        self.removed = True
+
+
+class FakeClient:
+    def __init__(self, containers: list[FakeContainer]) -> None:
+        self.containers = SimpleNamespace(list=lambda all, filters: containers)
+
+
+@pytest.mark.offline
+class ContainerPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = ContainerPool()
+        self.created: list[FakeContainer] = []
+
+    def tearDown(self) -> None:
+        self.pool.close()
+
+    def create(self, status: str = "running"):
+        def create() -> FakeContainer:
+            container = FakeContainer(f"c{len(self.created)}", status)
+            self.created.append(container)
+            return container
+
+        return create
+
+    def test_reuse(self):
+        container = self.pool.acquire(("ws1",), self.create())
+        self.pool.release(("ws1",), container, CONF, healthy=True)
+        # the idle container of the same configuration is reused
+        self.assertIs(self.pool.acquire(("ws1",), self.create()), container)
+        # the other configurations (e.g. another workspace) get their own container
+        other = self.pool.acquire(("ws2",), self.create())
+        self.assertIsNot(other, container)
+        self.assertEqual(len(self.created), 2)
+
+    def test_health_check(self):
+        container = self.pool.acquire(("ws1",), self.create())
+        self.pool.release(("ws1",), container, CONF, healthy=True)
+        container.status = "exited"
+        # the broken idle container is removed & replaced
+        new_container = self.pool.acquire(("ws1",), self.create())
+        self.assertIsNot(new_container, container)
+        self.assertTrue(container.removed)
+
+        # so are the containers failing in a run or failing to be reset
+        self.pool.release(("ws1",), new_container, CONF, healthy=False)
+        self.assertTrue(new_container.removed)
+        container = self.pool.acquire(("ws1",), self.create())
+        container.reset_exit_code = 1
+        self.pool.release(("ws1",), container, CONF, healthy=True)
+        self.assertTrue(container.removed)
+        self.assertEqual(self.pool._idle, [])
+
+    def test_max_reuse(self):
+        container = self.pool.acquire(("ws1",), self.create())
+        for _ in range(CONF.container_max_reuse - 1):
+            self.pool.release(("ws1",), container, CONF, healthy=True)
+            self.assertIs(self.pool.acquire(("ws1",), self.create()), container)
+        self.pool.release(("ws1",), container, CONF, healthy=True)
+        self.assertTrue(container.removed)
+        self.assertIsNot(self.pool.acquire(("ws1",), self.create()), container)
+
+    def test_eviction(self):
+        containers = [self.pool.acquire((f"ws{i}",), self.create()) for i in range(3)]
+        for i, container in enumerate(containers):
+            self.pool.release((f"ws{i}",), container, CONF, healthy=True)
+        # the least recently used container is removed beyond the pool size
+        self.assertEqual([c.removed for c in containers], [True, False, False])
+        self.assertEqual([item[1] for item in self.pool._idle], containers[1:])
+
+    def test_unsupported(self):
+        with self.assertRaises(ContainerPoolUnavailable):
+            self.pool.acquire(("no-sleep",), self.create(status="exited"))
+        self.assertTrue(self.created[0].removed)
+        # the configuration falls back to the one-shot containers without trying again
+        with self.assertRaises(ContainerPoolUnavailable):
+            self.pool.acquire(("no-sleep",), self.create())
+        self.assertEqual(len(self.created), 1)
+        self.assertIsNotNone(self.pool.acquire(("ws1",), self.create()))
+
+    def test_remove_orphans(self):
+        host = socket.gethostname()
+        dead_pid = max(2**22, os.getpid() + 1)  # beyond the default pid_max
+        orphan = FakeContainer("orphan", labels={ContainerPool.LABEL: f"{host}:{dead_pid}"})
+        alive = FakeContainer("alive", labels={ContainerPool.LABEL: ContainerPool.owner()})
+        remote = FakeContainer("remote", labels={ContainerPool.LABEL: f"{host}-other:{dead_pid}"})
+        client = FakeClient([orphan, alive, remote])
+        self.pool.remove_orphans(client)
+        # only the containers of the gone processes on this host are removed
+        self.assertEqual([c.removed for c in (orphan, alive, remote)], [True, False, False])
+
+        # once per process
+        orphan.removed = False
+        self.pool.remove_orphans(client)
+        self.assertFalse(orphan.removed)
+
+
+if __name__ == "__main__":
+    unittest.main()
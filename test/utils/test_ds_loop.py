@@ -0,0 +1,60 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from rdagent.app.data_science.loop import DataScienceRDLoop
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.scenarios.data_science.proposal.exp_gen import DSTrace
+from rdagent.scenarios.data_science.proposal.exp_gen.base import DSHypothesis
+from rdagent.scenarios.data_science.proposal.exp_gen.select import LatestCKPSelector
+
+
+class HistLengthExpGen:
+    """Propose an experiment remembering the length of the hist it is proposed on"""
+
+    def gen(self, trace: DSTrace, selection: tuple[int, ...] = (-1,)):
+        trace.set_current_selection(selection)
+        proposed_on = len(trace.hist)
+        time.sleep(0.05)
+        return SimpleNamespace(hypothesis=DSHypothesis(component="DataLoadSpec"), proposed_on=proposed_on)
+
+
+class FakeDSLoop(DataScienceRDLoop):
+    def __init__(self, session_folder: Path) -> None:
+        self.ckp_selector = LatestCKPSelector()
+        self.exp_gen = HistLengthExpGen()
+        self.trace = DSTrace(scen=None)
+        super(DataScienceRDLoop, self).__init__()
+        self.session_folder = session_folder
+
+    def coding(self, prev_out):
+        time.sleep(0.2)
+        return prev_out["direct_exp_gen"]["exp_gen"]
+
+    def running(self, prev_out):
+        return prev_out["coding"]
+
+
+@pytest.mark.offline
+class DSLoopTest(unittest.TestCase):
+    def test_concurrent_loops(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            loop = FakeDSLoop(Path(tmp_dir) / "__session__")
+            with mock.patch.object(RD_AGENT_SETTINGS, "max_parallel_loops", 3):
+                loop.run(loop_n=5)
+
+        self.assertEqual(len(loop.trace.hist), 5)
+        proposed_on = [exp.proposed_on for exp, _ in loop.trace.hist]
+        # some loops are proposed before the former loops are recorded
+        self.assertTrue(any(n < li for li, n in enumerate(proposed_on)))
+        # their parent is the latest node when they are proposed instead of when they are recorded
+        self.assertEqual(loop.trace.dag_parent, [() if n == 0 else (n - 1,) for n in proposed_on])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,6 +6,7 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 import shutil
 
 from rdagent.utils.env import (
+    CONTAINER_POOL,
     CondaConf,
     LocalConf,
     LocalDockerConf,
@@ -125,6 +126,23 @@ class EnvUtils(unittest.TestCase):
         print(result)
         assert return_code == 124, "Expected return code 124 for timeout"
 
+    def test_docker_container_pool(self):
+        """The entries run in a reused container by `exec`; the results equal the ones of the one-shot containers"""
+        dc = QlibDockerConf(container_pool=True, enable_cache=False)
+        dc.running_timeout_period = 1
+        qtde = QTDockerEnv(dc)
+        qtde.prepare()
+
+        result, return_code = qtde.run_ret_code(entry='echo "Hello, World!"', local_path=str(self.test_workspace))
+        assert return_code == 0 and "Hello, World!" in result
+        _, return_code = qtde.run_ret_code(entry="invalid_command", local_path=str(self.test_workspace))
+        assert return_code != 0, "Expected non-zero return code for invalid command"
+        _, return_code = qtde.run_ret_code(entry="sleep 2", local_path=str(self.test_workspace))
+        assert return_code == 124, "Expected return code 124 for timeout"
+
+        # all the runs share one container
+        self.assertEqual([uses for *_, uses in CONTAINER_POOL._idle], [3])
+
     def test_docker_mem(self):
         cmd = 'python -c \'print("start"); import numpy as np;  size_mb = 500; size = size_mb * 1024 * 1024 // 8; array = np.random.randn(size).astype(np.float64); print("success")\''
 
@@ -0,0 +1,180 @@
+import pickle
+import random
+import tempfile
+import threading
+import unittest
+from itertools import combinations
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rdagent.components.knowledge_management.graph import UndirectedGraph, UndirectedNode
+from rdagent.components.knowledge_management.vector_base import Document
+
+
+def _node(content: str, label: str) -> UndirectedNode:
+    rng = np.random.default_rng(abs(hash(content)) % 2**32)
+    return UndirectedNode(content=content, label=label, embedding=rng.normal(size=8).tolist())
+
+
+@pytest.mark.offline
+class UndirectedGraphTest(unittest.TestCase):
+    def test_add_nodes_bulk(self):
+        graph = UndirectedGraph()
+        components = [_node(f"component {i}", "component") for i in range(10)]
+        pairs = [(_node(f"task {i}", "task"), [components[i % 10], _node(f"error {i % 7}", "task")]) for i in range(1000)]
+        with mock.patch.object(UndirectedGraph, "batch_embedding") as batch_embedding:
+            graph.add_nodes_bulk(pairs)
+            batch_embedding.assert_not_called()  # the nodes are already embedded
+        self.assertEqual(graph.size(), 1000 + 10 + 7)
+        self.assertEqual(graph.vector_base.shape()[0], graph.size())
+
+        task = graph.find_node(content="task 3", label="task")
+        self.assertIs(graph.get_node_by_content("task 3"), task)
+        self.assertIsNone(graph.find_node(content="task 3", label="component"))
+        self.assertEqual(len(graph.get_all_nodes_by_label("component")), 10)
+        self.assertEqual(
+            [node.content for node in graph.get_all_nodes_by_label_list(["component", "task"])[:2]],
+            ["component 0", "component 1"],
+        )
+        self.assertEqual({node.content for node in task.get_neighbors(labels=["component"])}, {"component 3"})
+
+        # the existing nodes are reused
+        graph.add_nodes(_node("task 3", "task"), [_node("component 0", "component")])
+        self.assertEqual(graph.size(), 1017)
+        self.assertIn(components[0], task.neighbors)
+
+        # the search can only flow through the nodes of the constraint labels
+        nodes = graph.get_nodes_within_steps(task, steps=2, constraint_labels=["component"], block=True)
+        self.assertEqual({node.content for node in nodes}, {"component 0", "component 3"})
+
+    def test_query_while_adding(self):
+        graph = UndirectedGraph()
+        graph.add_nodes(_node("component 0", "component"), [])
+        embedding, queried = threading.Event(), threading.Event()
+
+        def batch_embedding(nodes):
+            embedding.set()
+            queried.wait(timeout=5)
+            for node in nodes:
+                node.embedding = _node(node.content, node.label).embedding
+            return nodes
+
+        with mock.patch.object(UndirectedGraph, "batch_embedding", side_effect=batch_embedding):
+            writer = threading.Thread(
+                target=graph.add_nodes,
+                args=(UndirectedNode(content="task 0", label="task"), [UndirectedNode("component 0", "component")]),
+            )
+            writer.start()
+            embedding.wait(timeout=5)
+            # the graph is queried while the new nodes are embedded, and they are not seen half added
+            nodes = graph.get_all_nodes_by_label_list(["component", "task"])
+            self.assertEqual([node.content for node in nodes], ["component 0"])
+            queried.set()
+            writer.join()
+        self.assertEqual(graph.size(), 2)
+        self.assertEqual(len(graph.find_node(content="component 0", label="component").neighbors), 1)
+
+    def test_query_by_intersection(self):
+        rnd = random.Random(0)
+        graph = UndirectedGraph()
+        errors = [_node(f"error {i}", "error") for i in range(6)]
+        traces = [_node(f"trace {i}", "task_trace") for i in range(40)]
+        graph.add_nodes_bulk([(trace, rnd.sample(errors, rnd.randint(1, 4))) for trace in traces])
+
+        # the combinatorial search replaced by the bitsets
+        expected = []
+        for k in range(len(errors), 1, -1):
+            for combination in combinations(errors, k):
+                for node in graph.get_nodes_within_steps(combination[0], constraint_labels=["task_trace"]):
+                    if all(node in graph.get_nodes_within_steps(n, constraint_labels=["task_trace"]) for n in combination):
+                        if node not in [n for _, n in expected]:
+                            expected.append((list(combination), node))
+        def contents(result: list) -> list:
+            return [([n.content for n in origin], node.content) for origin, node in result]
+
+        self.assertEqual(contents(graph.query_by_intersection(errors, constraint_labels=["task_trace"])), contents(expected))
+        self.assertEqual(
+            {node.content for node in graph.get_nodes_intersection(errors[:2], constraint_labels=["task_trace"])},
+            {node.content for origin, node in expected if errors[0] in origin and errors[1] in origin},
+        )
+
+        # the cached neighborhoods are refreshed once the graph is changed
+        graph.add_nodes(_node("trace new", "task_trace"), errors)
+        result = graph.query_by_intersection(errors, constraint_labels=["task_trace"])
+        self.assertEqual(contents(result[:1]), [([e.content for e in errors], "trace new")])
+
+    def test_segments(self):
+        graph = UndirectedGraph()
+        graph.add_nodes(_node("a", "x"), [_node("b", "y"), _node("c", "y")])
+        graph.favorite = [graph.find_node(content="b", label="y")]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "graph.segments"
+            graph.dump_segments(path)
+            graph.add_nodes(_node("d", "x"), [_node("b", "y")])
+            graph.dump_segments(path)
+            # only the new node & edge are appended
+            segments = [p.name for p in sorted((path / "segments").iterdir())]
+            self.assertEqual(segments, ["00000", "00001"])
+            with mock.patch.object(UndirectedGraph, "max_segments", 1):
+                graph.add_nodes(_node("e", "x"), [_node("a", "x")])
+                graph.dump_segments(path)
+            self.assertEqual(len(list((path / "segments").iterdir())), 1)
+
+            loaded = UndirectedGraph(path)
+            self.assertEqual(loaded.size(), 5)
+            d = loaded.find_node(content="d", label="x")
+            self.assertEqual({n.content for n in d.neighbors}, {"b"})
+            self.assertEqual({n.content for n in loaded.find_node(content="b", label="y").neighbors}, {"a", "d"})
+            np.testing.assert_allclose(d.embedding, graph.find_node(content="d", label="x").embedding, rtol=1e-6)
+            # the nodes in the other attributes are the nodes of the loaded graph
+            self.assertIs(loaded.favorite[0], loaded.find_node(content="b", label="y"))
+            self.assertEqual(UndirectedGraph.from_segments(path).size(), 5)
+
+            # the loaded embeddings are searchable
+            a = loaded.find_node(content="a", label="x")
+            with mock.patch.object(Document, "create_embedding", lambda doc: setattr(doc, "embedding", a.embedding)):
+                self.assertEqual(loaded.semantic_search("a", topk_k=1), [a])
+
+    def test_dump_format(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # the pickle file is the default, whatever the suffix; the segmented format is opted in
+            for name, segmented in [("graph.pkl", False), ("graph", False), ("graph.segments", True)]:
+                graph = UndirectedGraph(Path(tmp_dir) / name)
+                graph.add_nodes(_node("a", "x"), [_node("b", "y")])
+                graph.dump()
+                self.assertEqual(graph.path.is_dir(), segmented)
+                self.assertEqual(UndirectedGraph(graph.path).size(), 2)
+
+    def test_removed_edges(self):
+        graph = UndirectedGraph()
+        graph.add_nodes(_node("a", "x"), [_node("b", "y"), _node("c", "y")])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "graph"
+            graph.dump_segments(path)
+            a = graph.find_node(content="a", label="x")
+            a.remove_neighbor(graph.find_node(content="b", label="y"))
+            graph.dump_segments(path)
+            # the removed edge does not come back
+            loaded = UndirectedGraph.from_segments(path)
+            self.assertEqual({n.content for n in loaded.find_node(content="a", label="x").neighbors}, {"c"})
+            self.assertEqual(loaded.find_node(content="b", label="y").neighbors, set())
+            self.assertEqual(loaded.size(), 3)
+
+    def test_legacy_graph(self):
+        graph = UndirectedGraph()
+        graph.add_nodes(_node("a", "x"), [_node("b", "y"), _node("c", "y")])
+        # the graphs & nodes dumped by the older versions have no indexes
+        for node in graph.nodes.values():
+            del node.__dict__["_neighbors_by_label"]
+        state = {k: v for k, v in graph.__dict__.items() if not k.startswith("_")}
+        loaded = UndirectedGraph()
+        loaded.__dict__.update(pickle.loads(pickle.dumps(state)))
+        node = loaded.find_node(content="a", label="x")
+        self.assertEqual({n.content for n in node.get_neighbors(labels=["y"])}, {"b", "c"})
+
+
+if __name__ == "__main__":
+    unittest.main()
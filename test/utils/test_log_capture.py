@@ -0,0 +1,96 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from rdagent.utils.log_capture import LogCapture, follow, prune_logs
+
+
+@pytest.mark.offline
+class LogCaptureTest(unittest.TestCase):
+    def test_capture(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = Path(tmp_dir) / "run.log"
+            capture = LogCapture(
+                log_path, head_lines=3, tail_lines=2, line_len=20, transform=lambda s: s.replace("2024", "[Y]")
+            )
+            with capture:
+                # the lines are split across the chunks
+                capture.feed(b"epoch 0 in 20")
+                capture.feed(b"24\n 10%|\xe2\x96\x88")
+                # a progress bar redrawn by carriage returns keeps its last state only
+                capture.feed(b"\r 50%\rdone\n" + b"x" * 30 + b"\n")
+                for i in range(1, 100):
+                    capture.feed(f"epoch {i}\n".encode())
+                capture.feed(b"the end")
+            file_lines = log_path.read_text().splitlines()
+
+        self.assertEqual(capture.head, ["epoch 0 in [Y]", "done", f"{'x' * 10}... (10 chars are hidden) ...{'x' * 10}"])
+        self.assertEqual(list(capture.tail), ["epoch 99", "the end"])
+        self.assertEqual(capture.n_lines, 103)
+        self.assertIn("... (98 lines are hidden, the whole log is in", capture.text())
+        # the file has the whole log
+        self.assertEqual(len(file_lines), 103)
+        self.assertEqual(file_lines[50], "epoch 48")
+
+    def test_follow(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = Path(tmp_dir) / "run.log"
+            finished = threading.Event()
+
+            def run() -> None:
+                with LogCapture(log_path, echo=False) as capture:
+                    for i in range(5):
+                        capture.feed(f"line {i}\n".encode())
+                finished.set()
+
+            async def tail() -> list[str]:
+                threading.Thread(target=run).start()
+                return [line async for line in follow(log_path, finished.is_set, poll_interval=0.01)]
+
+            self.assertEqual(asyncio.run(tail()), [f"line {i}" for i in range(5)])
+
+    def test_prune_logs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder = Path(tmp_dir)
+            for i in range(4):
+                (folder / f"run{i}.log").write_text(str(i))
+            stat = Path.stat
+
+            def racing_stat(path, *args, **kwargs):
+                if path.name == "run0.log":
+                    path.unlink(missing_ok=True)  # removed by a concurrent run
+                return stat(path, *args, **kwargs)
+
+            with mock.patch.object(Path, "stat", racing_stat):
+                prune_logs(folder, keep=2)
+            self.assertEqual(len(list(folder.iterdir())), 2)
+
+            # the logs still being written are kept, however old they are
+            with LogCapture(folder / "quiet.log", echo=False, max_file_bytes=10) as capture:
+                capture.feed(b"a long & quiet run\n")
+                capture.feed(b"rolled over\n")
+                os.utime(folder / "quiet.log.1", (0, 0))
+                os.utime(folder / "quiet.log", (0, 0))
+                prune_logs(folder, keep=0)
+                self.assertEqual(sorted(p.name for p in folder.iterdir()), ["quiet.log", "quiet.log.1"])
+            prune_logs(folder, keep=0)
+            self.assertEqual(list(folder.iterdir()), [])
+
+    def test_rollover_text(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = Path(tmp_dir) / "run.log"
+            with LogCapture(log_path, head_lines=1, tail_lines=1, echo=False, max_file_bytes=20) as capture:
+                for i in range(10):
+                    capture.feed(f"line {i}\n".encode())
+        # the beginning of the log is lost after the second rollover
+        self.assertIn(f"the last part of the log is in {log_path}.1 & {log_path}", capture.text())
+
+
+if __name__ == "__main__":
+    unittest.main()
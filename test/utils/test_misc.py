@@ -1,9 +1,18 @@
+import threading
+import time
 import unittest
 import sys
 
 import pytest
 
-from rdagent.core.utils import SingletonBaseClass
+from rdagent.core.conf import RD_AGENT_SETTINGS, ExtendedBaseSettings
+from rdagent.core.utils import (
+    EXECUTOR_SERVICE,
+    LLM_CACHE_SEED_GEN,
+    SingletonBaseClass,
+    multiprocessing_wrapper,
+)
+from rdagent.log import rdagent_logger as logger
 
 
 class A(SingletonBaseClass):
@@ -18,6 +27,30 @@ class A(SingletonBaseClass):
         return self.__str__()
 
 
+def _seed_trace(i: int) -> tuple[int, list[int]]:
+    return i, [LLM_CACHE_SEED_GEN.get_next_seed() for _ in range(3)]
+
+
+async def _async_seed_trace(i: int) -> tuple[int, list[int]]:
+    return _seed_trace(i)
+
+
+def _slow_square(i: int) -> int:
+    time.sleep(0.05)
+    return i * i
+
+
+class ScenarioSettings(ExtendedBaseSettings):
+    knowledge_base_path: str | None = None
+
+
+SCENARIO_SETTINGS = ScenarioSettings()  # e.g. `DS_RD_SETTING`
+
+
+def _caller_state(_: int) -> tuple[str, int, str | None]:
+    return logger.current_tag, RD_AGENT_SETTINGS.stdout_context_len, SCENARIO_SETTINGS.knowledge_base_path
+
+
 @pytest.mark.offline
 class MiscTest(unittest.TestCase):
     def test_singleton(self):
@@ -71,6 +104,62 @@ class MiscTest(unittest.TestCase):
         # print(id(a3), id(a3_pkl))  # not the same object
         # print(a1.kwargs)  # a1 will be changed.
 
+    def test_multiprocessing_wrapper_backends(self):
+        traces = {}
+        for backend in ["process", "thread", "async"]:
+            LLM_CACHE_SEED_GEN.set_seed(10)
+            traces[backend] = multiprocessing_wrapper([(_seed_trace, (i,)) for i in range(6)], n=3, backend=backend)
+        # the results are in order and every task gets the same seed trace whatever the backend is
+        self.assertEqual([i for i, _ in traces["process"]], list(range(6)))
+        self.assertEqual(traces["process"], traces["thread"])
+        self.assertEqual(traces["process"], traces["async"])
+        # the persistent workers are reused by the later calls
+        LLM_CACHE_SEED_GEN.set_seed(10)
+        self.assertEqual(
+            multiprocessing_wrapper([(_async_seed_trace, (i,)) for i in range(6)], n=2, backend="async"),
+            traces["thread"],
+        )
+        LLM_CACHE_SEED_GEN.set_seed(10)
+        self.assertEqual(
+            multiprocessing_wrapper([(_seed_trace, (i,)) for i in range(6)], n=2, backend="process"),
+            traces["process"],
+        )
+
+    def test_multiprocessing_wrapper_concurrent_calls(self):
+        EXECUTOR_SERVICE.shutdown("thread")
+        results, errors = {}, []
+
+        def call(n: int) -> None:
+            try:
+                results[n] = multiprocessing_wrapper([(_slow_square, (i,)) for i in range(6)], n=n, backend="thread")
+            except Exception as e:  # noqa: BLE001
+                errors.append(e)
+
+        # the later call needs a larger executor; the former one is kept until the first call is finished
+        threads = [threading.Thread(target=call, args=(2,))]
+        threads[0].start()
+        time.sleep(0.02)
+        threads.append(threading.Thread(target=call, args=(4,)))
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(results, {2: [i * i for i in range(6)], 4: [i * i for i in range(6)]})
+
+    def test_process_workers_follow_the_caller(self):
+        multiprocessing_wrapper([(_caller_state, (i,)) for i in range(2)], n=2, backend="process")  # fork the workers
+        old_len = RD_AGENT_SETTINGS.stdout_context_len
+        try:
+            RD_AGENT_SETTINGS.stdout_context_len = old_len + 1
+            SCENARIO_SETTINGS.knowledge_base_path = "kb.pkl"
+            with logger.tag("Loop_1.running"):
+                states = multiprocessing_wrapper([(_caller_state, (i,)) for i in range(2)], n=2, backend="process")
+        finally:
+            RD_AGENT_SETTINGS.stdout_context_len = old_len
+            SCENARIO_SETTINGS.knowledge_base_path = None
+        # all the settings instances are followed, not only the core ones
+        self.assertEqual(states, [("Loop_1.running", old_len + 1, "kb.pkl")] * 2)
+
 
 if __name__ == "__main__":
     unittest.main()
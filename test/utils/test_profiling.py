@@ -0,0 +1,38 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import pytest
+
+from rdagent.core.profiling import Profiler, load_trace, summarize
+
+
+@pytest.mark.offline
+class ProfilerTest(unittest.TestCase):
+    def test_spans(self):
+        profiler = Profiler()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_path = Path(tmp_dir) / "profile.json"
+            profiler.set_output(profile_path)
+            for _ in range(2):
+                with profiler.span("coding", cat="step"):
+                    with profiler.span("chat_completion", cat="llm"):
+                        profiler.annotate(cache_hit=True)
+                        time.sleep(0.02)
+                    time.sleep(0.01)
+                profiler.flush()  # the spans are appended to the file
+            events = load_trace(profile_path)
+
+        self.assertEqual([event["name"] for event in events], ["chat_completion", "coding"] * 2)
+        self.assertEqual(events[0]["args"]["parent"], "coding")
+        rows = {row["name"]: row for row in summarize(events)}
+        self.assertEqual(rows["coding"]["count"], 2)
+        self.assertEqual(rows["chat_completion"]["hit_rate"], 1.0)
+        # the time of the children is not counted in the self time of the parent
+        self.assertGreater(rows["coding"]["total_s"], rows["chat_completion"]["total_s"])
+        self.assertLess(rows["coding"]["self_s"], rows["chat_completion"]["self_s"])
+
+
+if __name__ == "__main__":
+    unittest.main()
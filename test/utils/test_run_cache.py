@@ -0,0 +1,56 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.utils.env import LocalConf, LocalEnv
+from rdagent.utils.run_cache import RunCache
+
+
+@pytest.mark.offline
+class RunCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name)
+        (self.path / "data.csv").write_text("a,b\n1,2\n")
+        self.workspace = self.path / "ws"
+        self.workspace.mkdir()
+        (self.workspace / "main.py").write_text("print('hello')")
+        (self.workspace / "stale.txt").write_text("stale")
+        (self.workspace / "data.csv").symlink_to(self.path / "data.csv")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_cached_run(self):
+        runs = self.path / "runs.log"
+        # the run counts itself outside the workspace, then changes the workspace
+        entry = f"echo run >> {runs}; {sys.executable} main.py > out/result.txt; rm stale.txt"
+        (self.workspace / "out").mkdir()
+        pristine = self.path / "pristine"
+        shutil.copytree(self.workspace, pristine, symlinks=True)
+
+        le = LocalEnv(conf=LocalConf(default_entry=entry))
+        with mock.patch.object(RD_AGENT_SETTINGS, "pickle_cache_folder_path_str", str(self.path / "cache")):
+            stdout, code = le.run_ret_code(local_path=str(self.workspace))
+            # the same workspace again
+            restored = self.path / "restored"
+            shutil.copytree(pristine, restored, symlinks=True)
+            self.assertEqual(le.run_ret_code(local_path=str(restored)), (stdout, code))
+
+        self.assertEqual(runs.read_text().count("run"), 1)
+        self.assertEqual((restored / "out" / "result.txt").read_text(), "hello\n")
+        self.assertFalse((restored / "stale.txt").exists())
+        self.assertTrue((restored / "data.csv").is_symlink())
+        # only the output is stored; the code & the linked data are not
+        blobs = list((self.path / "cache" / "utils.env.run" / RunCache("").blob_folder).iterdir())
+        self.assertEqual([blob.read_text() for blob in blobs], ["hello\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
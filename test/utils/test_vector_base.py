@@ -0,0 +1,127 @@
+import pickle
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rdagent.components.coder.CoSTEER.knowledge_management import TaskSimilarityIndex
+from rdagent.components.knowledge_management.vector_base import (
+    Document,
+    PDVectorBase,
+    VectorIndex,
+)
+
+
+@pytest.mark.offline
+class VectorBaseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(42)
+        self.embeddings = rng.normal(size=(500, 16))
+        self.labels = [f"label_{i % 3}" for i in range(500)]
+        self.query = rng.normal(size=16)
+
+    def _brute_force(self, rows: np.ndarray, similarity_threshold: float = -1) -> np.ndarray:
+        embeddings = self.embeddings[rows]
+        similarities = embeddings @ self.query / np.linalg.norm(embeddings, axis=1) / np.linalg.norm(self.query)
+        order = np.argsort(-similarities)
+        return rows[order][similarities[order] > similarity_threshold]
+
+    def test_exact_search(self):
+        index = VectorIndex()
+        for i in range(0, 500, 7):  # the rows are added in small batches
+            index.add(self.embeddings[i : i + 7], self.labels[i : i + 7])
+        rows, similarities = index.search(self.query, topk_k=10)
+        np.testing.assert_array_equal(rows, self._brute_force(np.arange(500))[:10])
+        self.assertTrue(np.all(np.diff(similarities) <= 0))
+
+        rows, similarities = index.search(self.query, constraint_labels=["label_1"], similarity_threshold=0.2)
+        np.testing.assert_array_equal(rows, self._brute_force(np.arange(1, 500, 3), similarity_threshold=0.2))
+        self.assertTrue(np.all(similarities > 0.2))
+
+    def test_ivf_search(self):
+        index = VectorIndex(ivf_lists=8, ivf_probes=2, ivf_min_size=100)
+        index.add(self.embeddings, self.labels)
+        # a near duplicate of a stored row is always found in the probed partitions
+        self.query = self.embeddings[123] + 0.01
+        rows, _ = index.search(self.query, topk_k=1)
+        self.assertEqual(rows.tolist(), [123])
+        rows, _ = index.search(self.query, constraint_labels=["label_0"])
+        self.assertEqual(rows[0], 123)
+        self.assertTrue(all(self.labels[row] == "label_0" for row in rows))
+
+    def test_pd_vector_base(self):
+        vector_base = PDVectorBase()
+        vector_base.add([Document(content=f"doc {i}", label=self.labels[i], embedding=self.embeddings[i]) for i in range(5)])
+        vector_base.add(Document(content="doc 5", label="label_2", embedding=self.embeddings[5]))
+        self.assertEqual(vector_base.shape()[0], 6)
+
+        def create_embedding(document: Document) -> None:
+            document.embedding = self.embeddings[3]
+
+        with mock.patch.object(Document, "create_embedding", create_embedding):
+            docs, similarities = vector_base.search("doc 3", topk_k=2)
+            self.assertEqual(docs[0].content, "doc 3")
+            self.assertAlmostEqual(similarities[0], 1, places=5)
+
+            # the rows edited in place (with the same length) are searched as edited
+            vector_base.vector_df.loc[vector_base.vector_df["content"] == "doc 3", "label"] = "relabeled"
+            docs, _ = vector_base.search("doc 3", constraint_labels=["relabeled"])
+            self.assertEqual([doc.content for doc in docs], ["doc 3"])
+            vector_base.vector_df = vector_base.vector_df.iloc[::-1]
+            self.assertEqual(vector_base.search("doc 3", topk_k=1)[0][0].content, "doc 3")
+
+            # the index is not pickled but rebuilt after loading
+            self.assertEqual(vector_base.__getstate__()["_index"].size, 0)
+            loaded = pickle.loads(pickle.dumps(vector_base))
+            self.assertEqual(loaded._index.size, 0)
+            self.assertEqual(loaded.search("doc 3", constraint_labels=["relabeled"])[0][0].content, "doc 3")
+            self.assertEqual(loaded._index.size, 6)
+            docs, _ = vector_base.search("doc 3", topk_k=2)
+
+            # the vector bases dumped by the older versions are migrated
+            legacy = PDVectorBase()
+            legacy.__dict__ = {"path": None, "vector_df": vector_base.vector_df}
+            loaded = pickle.loads(pickle.dumps(legacy))
+            self.assertIsInstance(loaded.vector_df, pd.DataFrame)
+            self.assertEqual([doc.id for doc in loaded.search("doc 3", topk_k=2)[0]], [doc.id for doc in docs])
+
+    def test_task_similarity_index(self):
+        embeddings = {f"task {i}": embedding.tolist() for i, embedding in enumerate(self.embeddings[:20])}
+        backend = mock.MagicMock()
+        backend.create_embedding.side_effect = lambda input_content: [embeddings[c] for c in input_content]
+        with mock.patch("rdagent.components.coder.CoSTEER.knowledge_management.APIBackend", return_value=backend):
+            index = TaskSimilarityIndex()
+            self.assertEqual(index.rank(["task 0"]), {"task 0": []})
+            index.add_tasks([f"task {i}" for i in range(10)])
+            index.add_tasks(["task 3", "task 10"])  # the indexed tasks are not embedded again
+            ranked = index.rank(["task 15", "task 16"])
+            index.rank(["task 15", "task 16"])
+        # every task is embedded only once
+        self.assertEqual(sum(len(call.kwargs["input_content"]) for call in backend.create_embedding.call_args_list), 13)
+        for target, rows in (("task 15", 15), ("task 16", 16)):
+            self.query = self.embeddings[rows]
+            self.assertEqual(ranked[target], [f"task {i}" for i in self._brute_force(np.arange(11))])
+
+        # only the indexed tasks are pickled (without the index, which is rebuilt) and the queried ones are bounded
+        self.assertEqual(list(index._query_embeddings), ["task 15", "task 16"])
+        loaded = pickle.loads(pickle.dumps(index))
+        self.assertEqual(set(loaded._embeddings), {f"task {i}" for i in range(11)})
+        self.assertEqual(loaded._query_embeddings, {})
+        backend.create_embedding.reset_mock()
+        with (
+            mock.patch("rdagent.components.coder.CoSTEER.knowledge_management.APIBackend", return_value=backend),
+            mock.patch.object(TaskSimilarityIndex, "max_query_embeddings", 2),
+        ):
+            self.assertEqual(loaded.rank(["task 15", "task 16"]), ranked)
+            loaded.rank(["task 17", "task 3"])  # the indexed tasks are not queried
+            self.assertEqual(list(loaded._query_embeddings), ["task 16", "task 17"])
+        self.assertEqual(
+            [call.kwargs["input_content"] for call in backend.create_embedding.call_args_list],
+            [["task 15", "task 16"], ["task 17"]],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.utils.workflow import LoopBase, LoopMeta
+
+
+class HistLoop(LoopBase, metaclass=LoopMeta):
+    checkpoint_append_only_attributes = ("trace.hist",)
+
+    def __init__(self, session_folder: Path) -> None:
+        self.trace = SimpleNamespace(hist=[])
+        super().__init__()
+        self.session_folder = session_folder
+
+    def propose(self, prev_out):
+        return {"idea": f"idea {self.loop_idx}"}
+
+    def record(self, prev_out):
+        self.trace.hist.append((prev_out["propose"], "feedback " * 1000))
+
+
+class KnowledgeLoop(HistLoop):
+    checkpoint_excluded_attributes = ("trace.knowledge_base",)
+
+    def __init__(self, session_folder: Path) -> None:
+        super().__init__(session_folder)
+        self.trace.knowledge_base = SimpleNamespace(docs="knowledge " * 10000)
+
+
+class PipelineLoop(LoopBase, metaclass=LoopMeta):
+    ordered_steps = ("record",)
+    step_concurrency = {"running": 1}
+
+    def __init__(self, session_folder: Path) -> None:
+        super().__init__()
+        self.session_folder = session_folder
+
+    def propose(self, prev_out):
+        time.sleep(0.05)
+
+    def running(self, prev_out):
+        time.sleep(0.05)
+
+    def record(self, prev_out):
+        pass
+
+
+@pytest.mark.offline
+class LoopCheckpointTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.session_folder = Path(self.tmp_dir.name) / "__session__"
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_delta_checkpoint(self):
+        loop = HistLoop(self.session_folder)
+        with mock.patch.object(RD_AGENT_SETTINGS, "session_checkpoint_compact_interval", 4):
+            loop.run(loop_n=6)
+
+        sizes = [(self.session_folder / f"{li}" / "1_record").stat().st_size for li in range(6)]
+        # a snapshot only saves the new item instead of the whole history
+        self.assertLess(max(sizes) - min(sizes), 1000)
+        # except the compacted ones (every 4 snapshots)
+        self.assertGreater((self.session_folder / "4" / "0_propose").stat().st_size, 4 * len("feedback " * 1000))
+
+        for li in range(6):
+            session = HistLoop.load(self.session_folder / f"{li}" / "1_record", output_path=self.tmp_dir.name)
+            self.assertEqual([idea["idea"] for idea, _ in session.trace.hist], [f"idea {i}" for i in range(li + 1)])
+        self.assertEqual((session.loop_idx, session.step_idx), (6, 0))
+
+    def test_failed_checkpoint(self):
+        loop = HistLoop(self.session_folder)
+        loop.run(loop_n=2)
+        loop.trace.hist.append(("new item", ""))
+        loop.unpicklable = lambda: None  # the loop fails to be pickled after the new item is saved in the header
+        with self.assertRaises(Exception):
+            loop.dump(self.session_folder / "2" / "0_propose")
+        self.assertEqual(list((self.session_folder / "2").iterdir()), [])
+
+        # the later snapshots do not refer to the failed one
+        del loop.unpicklable
+        loop.dump(self.session_folder / "2" / "1_record")
+        session = HistLoop.load(self.session_folder / "2" / "1_record", output_path=self.tmp_dir.name)
+        self.assertEqual(session.trace.hist[-1], ("new item", ""))
+
+    def test_excluded_attributes(self):
+        loop = KnowledgeLoop(self.session_folder)
+        knowledge_base = loop.trace.knowledge_base
+        loop.run(loop_n=1)
+        loop.dump(Path(self.tmp_dir.name) / "plain.pkl")  # the whole loop outside the session folder
+        # the live object is never replaced, since the other loops may be using it
+        self.assertIs(loop.trace.knowledge_base, knowledge_base)
+
+        for path in (self.session_folder / "0" / "1_record", Path(self.tmp_dir.name) / "plain.pkl"):
+            self.assertLess(path.stat().st_size, len("knowledge " * 10000))
+            session = KnowledgeLoop.load(path, output_path=self.tmp_dir.name)
+            self.assertIsNone(session.trace.knowledge_base)
+            self.assertEqual(len(session.trace.hist), 1)
+
+    def test_lost_snapshot(self):
+        loop = HistLoop(self.session_folder)
+        loop.run(loop_n=1)
+        self.assertIn("_checkpoint", loop.__dict__)
+        with mock.patch.object(HistLoop, "dump", side_effect=RuntimeError("changed during iteration")):
+            loop._dump_concurrently(self.session_folder / "1" / "0_propose")
+        # the next snapshot does not refer to the items of the lost one
+        self.assertNotIn("_checkpoint", loop.__dict__)
+
+    def test_concurrent_loops(self):
+        loop = PipelineLoop(self.session_folder)
+        with mock.patch.object(RD_AGENT_SETTINGS, "max_parallel_loops", 3):
+            loop.run(loop_n=6)
+        self.assertEqual((loop.loop_idx, loop.running_loops), (6, {}))
+
+        steps = {(li, lt.step_idx): lt for li, traces in loop.loop_trace.items() for lt in traces}
+        # the loops overlap: the later loops are proposed before the former ones are recorded
+        self.assertLess(steps[2, 0].start, steps[0, 2].end)
+        for li in range(5):
+            # but they are recorded in order & the experiments are run one at a time
+            self.assertLessEqual(steps[li, 2].end, steps[li + 1, 2].start)
+        running = sorted((steps[li, 1].start, steps[li, 1].end) for li in range(6))
+        for (_, end), (start, _) in zip(running, running[1:]):
+            self.assertLessEqual(end, start)
+
+
+if __name__ == "__main__":
+    unittest.main()